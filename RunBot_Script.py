@@ -9,134 +9,263 @@
 
 import os
 import sys
+
+os.environ["LOGGING_MODE"], os.environ['IS_RUNBOT_RUN'] = "VERBOSE", "1"
+
+# Probe mode: one indexed query decides whether this tick has work before runbot_library and the Jira client load
+import runbot_probe
+startup = runbot_probe.StartupTimer()
+if __name__ == "__main__" and runbot_probe.is_probe_run(sys.argv[1:]):
+    runbot_probe.exit_if_queue_empty(startup)
+
+import argparse
 import cs_logging
 
 import runbot_library
+import runbot_jira_outbox
+import runbot_log_store
+import runbot_db
+import runbot_metrics
 # OTHER IMPORTS REDACTED #
+startup.mark('imports')
 
-jira = cs_jira_requests.JiraRequest()
-final_status_cd, is_failure = 'COMPLETE', 0
-os.environ["LOGGING_MODE"], os.environ['IS_RUNBOT_RUN'] = "VERBOSE", "1"
-command_type = None # to be used in creating RunbotCommand object
-
-# Set defaults
-logheader("runbot.py -> Execution begins")
-is_prod_run = runbot_library.is_prod_run()
-logmsg("runbot.py -> Updating existing Jira status in mis_reports.jobs.RUNJOB_REQUEST_T")
-runbot_library.sync_jira_status_for_outstanding_requests()    
-    
-##### Step 1: Get queue from mis_reports.jobs.RUNJOB_REQUEST_T and validate jira ID #####
-row_to_execute = runbot_library.get_next_row_dict()
-if not row_to_execute:
-    logmsg("runbot.py -> ========= NO RUNJOB ITEMS FOUND =========")
-    logmsg("runbot.py -> >> MIS_Reports.jobs.RUNJOB_REQUEST_T has no outstanding rows with status_cd = 'NEW'. Exiting...")
-    sys.exit(0)
-    
-runbot_id, jira_issue_id, job_name, runbot_cmd, artifact_id, log_run_id, error_snippet, job_type = runbot_library.get_required_row_values(row_to_execute)
-is_rerun = (job_type in ['RERUN_REPORT', 'RELOAD_TABLE'])
 
-if not runbot_cmd:
-    logerr("runbot.py -> ERROR: runbot_cmd not found in DB row. Please check data and retry.")
-    sys.exit(0)
-    
-    
-# Check that Jira Issue ID is valid
-logmsg("runbot.py -> Validating that {} is a valid Jira key...".format(jira_issue_id))
-if not jira.is_valid_issue_key(jira_issue_id):
-    cs_logging.logmsg("runbot.py -> ERROR: {} is not a valid JIRA Story. Please re-run with a valid JIRA ID.".format(jira_issue_id))
+def parse_args():
+    parser = argparse.ArgumentParser(description="Automates DAIPS rerun/runjob requests in full.")
+    parser.add_argument('--probe', action='store_true',
+                        help="Exit within milliseconds when nothing is claimable; Jira is only contacted once a row is claimed")
+    parser.add_argument('--daemon', action='store_true',
+                        help="Keep running and drain the queue with a bounded pool of concurrent workers")
+    parser.add_argument('--max-workers', type=int, default=4,
+                        help="(daemon) Maximum number of RunbotCommand jobs executing at the same time")
+    parser.add_argument('--job-type-limit', action='append', default=[], metavar='JOB_TYPE=N',
+                        help="(daemon) Per-job_type concurrency limit, e.g. RELOAD_TABLE=1. May be repeated")
+    parser.add_argument('--poll-interval', type=int, default=30,
+                        help="(daemon) Seconds to wait between queue polls when no rows are claimable")
+    parser.add_argument('--sync-interval', type=int, default=300,
+                        help="(daemon) Seconds between Jira-DB status syncups")
+    parser.add_argument('--lease-seconds', type=int, default=runbot_library.DEFAULT_LEASE_SECONDS,
+                        help="(daemon) Lease length on claimed rows; leases are renewed while the job runs")
+    parser.add_argument('--prefetch-depth', type=int, default=1,
+                        help="(daemon) Rows claimed and prepared ahead while every worker is busy; 0 disables prefetching")
+    return parser.parse_args()
+
+
+def execute_request(row_to_execute, jira=None, plan=None):
+    """
+    INPUT: row_to_execute (dict) claimed from mis_reports.jobs.RUNJOB_REQUEST_T, jira (JiraRequest, optional),
+           plan (runbot_library.RequestPlan, optional) if the row was already prepared while another request ran
+           - Runs Steps 2-7 for a single request; safe to call repeatedly from one process
+           - Jira updates go to the outbox and are delivered by whichever process runs its drainer
+
+    OUTPUT: final_status_cd (str), or None if the row could not be executed
+    """
+    if jira is None:
+        jira = cs_jira_requests.JiraRequest()
+    outbox = runbot_jira_outbox.get_outbox()
+    metrics = runbot_metrics.get_metrics()
+    final_status_cd, is_failure = 'COMPLETE', 0
+
+    # Validation, classification and CTL scrubbing; a daemon has usually done this while the previous request ran
+    if plan is None:
+        logmsg("runbot.py -> Validating the Jira key and preparing the command...")
+        with metrics.phase('prepare'):
+            plan = runbot_library.prepare_request(row_to_execute, jira=jira)
+    else:
+        logmsg(f"runbot.py -> Request {plan.runbot_id} was prepared ahead of time ({plan.prepare_seconds:.2f}s)")
+        metrics.add_phase('prefetch', plan.prepare_seconds)
+    runbot_id, jira_issue_id, job_name, runbot_cmd, artifact_id, log_run_id, error_snippet, job_type = (
+        plan.runbot_id, plan.jira_issue_id, plan.job_name, plan.runbot_cmd, plan.artifact_id, plan.log_run_id, plan.error_snippet, plan.job_type)
+    is_rerun = plan.is_rerun
+
+    if not runbot_cmd:
+        logerr("runbot.py -> ERROR: runbot_cmd not found in DB row. Please check data and retry.")
+        runbot_library.update_status_cd_for_row(runbot_id, 'ERROR')
+        return
+
+    if not plan.is_valid_issue_key:
+        cs_logging.logmsg("runbot.py -> ERROR: {} is not a valid JIRA Story. Please re-run with a valid JIRA ID.".format(jira_issue_id))
+        runbot_library.update_status_cd_for_row(runbot_id, 'ERROR')
+        return
+    os.environ["WORKING_JIRA_ID"] = jira_issue_id
+
+
+    ##### Step 2: Establish synchronous RunBot logfile on NAS #####
+    logmsg(f"runbot.py -> Establishing synchronous RunBot logfile in {runbot_library.RUNBOT_LOG_DIR}")
+    cs_util.create_directory_if_not_extant(runbot_library.RUNBOT_LOG_DIR)
+    runbot_log = plan.runbot_log # named according to request command_type
+    # Each run is its own indexed segment of runbot_log; older runs are rotated into gzip archives beside it
+    log_store = runbot_log_store.RunLogStore(runbot_log, marker=cs_util.LOG_RUN_MARKER)
+    log_store.begin_run(runbot_id)
+    os.chmod(runbot_log, 0o755)
+    os.environ['RUNBOT_LOG'] = runbot_log
+    logmsg("--- RUNBOT run, triggered by {}. Control-M Run: {} ---".format(jira_issue_id or "[JIRA_ID=Null]", "TRUE" if os.getenv('ESPWOB') else "FALSE"))
+
+
+    ##### Step 3: Assign Jira story, then update Jira and DB statuses to 'IN PROGRESS' state #####
+    jira_updates = []
+    if not is_rerun:
+        username = os.getenv('USER').removeprefix('ad.')
+        logmsg(f"runbot.py -> Assigning {jira_issue_id} to {username}")
+        jira_updates.append((jira_issue_id, 'assign_story_to_user', username))
+
+    # Add comment to Jira that the runjob is now executing. This will be used to determine =run duration
+    logmsg(f"runbot.py -> Commenting BEGIN notice on {jira_issue_id}")
+    job_name_formatted = "" if not job_name else f" (Job Name: {job_name})"
+    jira_updates.append((jira_issue_id, 'add_comment', "Runbot execution of '{0}'{1} begins.".format(runbot_cmd, job_name_formatted)))
+    if not is_rerun:
+        jira_updates.append((jira_issue_id, 'update_story_status', "IN PROGRESS"))
+    with metrics.phase('jira_updates'):
+        outbox.enqueue_many(jira_updates)
+
+    with metrics.phase('mark_running'):
+        status_change_to_running = runbot_library.update_status_cd_for_row(runbot_id, 'RUNNING')
+    if not status_change_to_running:
+        logerr("runbot.py -> Failed to update status_cd to 'RUNNING' on MSSQL")
+
+
+    ##### Step 4: Initalize and run the RunbotCommand object #####
+    RunbotCommand = plan.runbot_command
+    with metrics.phase('execute'):
+        RunbotCommand.process_runbot_command()
+    log_store.end_run()
+    if RunbotCommand.timed_out_reason:
+        final_status_cd, is_failure = 'TIMEOUT', 1
+    elif not RunbotCommand.is_successful:
+        final_status_cd, is_failure = 'ERROR', 1
+
+    # On failure, pull the most relevant error lines (with context) from the tail of this run's log
+    error_text = ""
+    if is_failure:
+        with metrics.phase('error_extract'):
+            error_text = cs_util.format_error_lines(cs_util.extract_error_lines(runbot_log))
+
+    ##### Log CTM output file if command is non-runjob (e.g. CTL, OTS, Release, etc.)
+    if not RunbotCommand.is_runjob:
+        runbot_log_contents = RunbotCommand.get_output_summary(error_text) # bounded tail/error buffers; full output is in runbot_log
+        with metrics.phase('log_upload'):
+            runbot_library.log_output_to_database(runbot_cmd, runbot_log, runbot_log_contents, is_failure, artifact_id, runbot_id)
+
+
+    ##### Step 5: Call update sproc to update 'status_cd' to 'COMPLETE', 'ERROR' or 'TIMEOUT' #####
+    ##### and get the updated runbot row (to comment the log id) in the same transaction
+    with metrics.phase('finish_row'):
+        status_change_endstate, runjob_row, follower_rows = runbot_library.finish_row(runbot_id, final_status_cd)
+    if not status_change_endstate:
+        logerr(f"runbot.py -> Failed to update status_cd to '{final_status_cd}' on MSSQL")
+    runjob_row = runjob_row or row_to_execute
+    runbot_id, jira_issue_id, job_name, runbot_cmd, artifact_id, log_run_id, error_snippet, job_type = runbot_library.get_required_row_values(runjob_row)
+
+
+    ##### Step 6: Comment on Jira story with run results #####
+    # END notice, log location and error snippet are queued together and delivered as a single comment
+    logmsg("runbot.py -> Commenting END notice on {}".format(jira_issue_id))
+    jira_updates = [(jira_issue_id, 'add_comment', "Runbot execution of '{0}'{1} ends. \nStatus: *{2}*".format(runbot_cmd, job_name_formatted, final_status_cd))]
+
+    # noting log location based on job_type
+    if is_rerun:
+        jira_updates.append((jira_issue_id, 'add_comment', f"Log Location: <REDACTED>"))
+
+    if job_type == "":
+        jira_updates.append((jira_issue_id, 'add_comment', "Full logfile available at: <REDACTED>"))
+
+    if error_snippet:
+        jira_updates.append((jira_issue_id, 'add_comment', "{{color:red}}Error Message: {}{{color}}".format(error_snippet)))
+    elif error_text:
+        # No framework snippet (CTL, one-time SQL, publish): quote the lines extracted from runbot_log
+        jira_updates.append((jira_issue_id, 'add_comment', "{{color:red}}Error Message:{{color}}\n{{noformat}}{}{{noformat}}".format(error_text)))
+
+    if RunbotCommand.timed_out_reason:
+        reason = ("exceeded its time budget of {} minute(s)".format(RunbotCommand.budget_seconds // 60)
+                  if RunbotCommand.timed_out_reason == 'BUDGET' else
+                  "produced no output for {} minute(s)".format(runbot_library.STALL_TIMEOUT_SECONDS // 60))
+        jira_updates.append((jira_issue_id, 'add_comment', "{{color:red}}The job {} and was stopped by Runbot.{{color}}".format(reason)))
+
+
+    ##### Step 7: Update Jira status for outstanding requests if not rerun, then terminate execution #####
+    if not is_rerun:
+        jira_updates.append((jira_issue_id, 'update_story_status', "Failed" if is_failure else "Done"))
+        jira_updates.append((jira_issue_id, 'sync_status'))
+    with metrics.phase('jira_updates'):
+        outbox.enqueue_many(jira_updates)
+
+    # Coalesced duplicates of this request get the same result without running again
+    for follower_row in follower_rows:
+        follower_jira_id = follower_row.get('jira_issue_id')
+        follower_updates = [(follower_jira_id, 'add_comment', "Runbot execution of '{0}'{1} was combined with identical request {2}, which ran instead. \nStatus: *{3}*\nLog Location: {4}".format(
+            follower_row.get('runjob_cmd'), job_name_formatted, runbot_id, final_status_cd, runbot_log))]
+        if error_snippet:
+            follower_updates.append((follower_jira_id, 'add_comment', "{{color:red}}Error Message: {}{{color}}".format(error_snippet)))
+        elif error_text:
+            follower_updates.append((follower_jira_id, 'add_comment', "{{color:red}}Error Message:{{color}}\n{{noformat}}{}{{noformat}}".format(error_text)))
+        if not is_rerun:
+            follower_updates.append((follower_jira_id, 'update_story_status', "Failed" if is_failure else "Done"))
+        with metrics.phase('jira_updates'):
+            outbox.enqueue_many(follower_updates)
+
+    finishup_msg = f"runbot.py -> Runbot execution ends. Status='{final_status_cd}'"
+    logsuccess(finishup_msg) if RunbotCommand.is_successful else logerr(finishup_msg)
+    print_console_note(f"Logfile available at: {runbot_log}")
+    return final_status_cd
+
+
+def main():
+    args = parse_args()
+
+    # Set defaults
+    logheader("runbot.py -> Execution begins")
+    is_prod_run = runbot_library.is_prod_run()
+    startup.mark('setup')
+
+    if args.daemon:
+        import runbot_daemon
+        startup.report('daemon')
+        daemon = runbot_daemon.RunbotDaemon(execute_request,
+                                            max_workers=args.max_workers,
+                                            job_type_limits=runbot_daemon.parse_job_type_limits(args.job_type_limit),
+                                            poll_interval=args.poll_interval,
+                                            sync_interval=args.sync_interval,
+                                            lease_seconds=args.lease_seconds,
+                                            prefetch_depth=args.prefetch_depth)
+        daemon.run()
+        sys.exit(0)
+
+    if not args.probe:
+        logmsg("runbot.py -> Updating existing Jira status in mis_reports.jobs.RUNJOB_REQUEST_T")
+        runbot_library.sync_jira_status_for_outstanding_requests()
+        startup.mark('jira_sync')
+
+    ##### Step 1: Claim next row from mis_reports.jobs.RUNJOB_REQUEST_T and validate jira ID #####
+    runbot_library.reclaim_expired_leases()
+    claimed_rows = runbot_library.claim_rows(batch_size=1)
+    startup.mark('claim')
+    metrics = runbot_metrics.get_metrics()
+    if not claimed_rows:
+        logmsg("runbot.py -> ========= NO RUNJOB ITEMS FOUND =========")
+        logmsg("runbot.py -> >> MIS_Reports.jobs.RUNJOB_REQUEST_T has no outstanding rows with status_cd = 'NEW'. Exiting...")
+        startup.report('empty')
+        metrics.add_startup(startup)
+        metrics.finish('EMPTY')
+        sys.exit(0)
+
+    if args.probe:
+        # Deferred until a row is actually claimed, so empty and lost-race ticks never touch Jira
+        logmsg("runbot.py -> Updating existing Jira status in mis_reports.jobs.RUNJOB_REQUEST_T")
+        runbot_library.sync_jira_status_for_outstanding_requests()
+        startup.mark('jira_sync')
+    startup.report('claimed')
+    metrics.add_startup(startup)
+
+    row_to_execute = claimed_rows[0]
+    outbox = runbot_jira_outbox.get_outbox().start()
+    with runbot_library.LeaseKeeper([row_to_execute.get('id')]):
+        final_status_cd = execute_request(row_to_execute)
+    with metrics.phase('jira_flush'):
+        outbox.stop(flush_timeout=60)
+    runbot_db.get_session().report()
+    metrics.finish(final_status_cd or 'NOT_RUN', runbot_id=row_to_execute.get('id'), job_type=row_to_execute.get('job_type'))
     sys.exit(0)
-os.environ["WORKING_JIRA_ID"] = jira_issue_id
-
-
-##### Step 2: Establish synchronous RunBot logfile on NAS #####
-logmsg("runbot.py -> Establishing synchronous RunBot logfile in /NAS/mis/tmp/_runbot/")
-runbot_dirname = runbot_log = "/NAS/mis/tmp/_runbot/"
-cs_util.create_directory_if_not_extant(runbot_dirname)
-# Create runbot_log, formatted according to request command_type
-if ".ctl" in runbot_cmd:
-    command_type = 'CTL'
-    runbot_log += "{}_{}.log".format(runbot_cmd.split('/')[-1].split()[0][:-4], runbot_id)
-elif "one_time_sql" in runbot_cmd:
-    command_type = 'One-Time SQL'
-    runbot_log += "{}_OneTimeSQL_{}.log".format(jira_issue_id, runbot_id)
-elif "releaseselfservicereport" in runbot_cmd:
-    command_type = 'Self-Service Release'
-    runbot_log += "{}_NewSelfService_{}.log".format(runbot_cmd.split()[1], runbot_id)
-else: # Possible values: runjob, publish.sh
-    command_type = 'Publish' if "publish.sh" in runbot_cmd else 'Runjob'
-    runbot_log += "{}_{}.log".format(runbot_cmd.split()[2], runbot_id)
-# os.system(f"touch {runbot_log}")
-with open(runbot_log, 'a+') as file:
-    if file.readlines():
-        file.write("\n\n#############################\n")
-        file.write("### NEW RUNBOT RUN BEGINS ###\n")
-        file.write("#############################\n")
-os.chmod(runbot_log, 755)
-os.environ['RUNBOT_LOG'] = runbot_log
-logmsg("--- RUNBOT run, triggered by {}. Control-M Run: {} ---".format(jira_issue_id or "[JIRA_ID=Null]", "TRUE" if os.getenv('ESPWOB') else "FALSE"))
-
-
-##### Step 3: Assign Jira story, then update Jira and DB statuses to 'IN PROGRESS' state #####
-if not is_rerun:
-    username = os.getenv('USER').removeprefix('ad.')
-    logmsg(f"runbot.py -> Assigning {jira_issue_id} to {username}")
-    jira.assign_story_to_user(jira_issue_id, username)
-   
-# Add comment to Jira that the runjob is now executing. This will be used to determine =run duration
-logmsg(f"runbot.py -> Commenting BEGIN notice on {jira_issue_id}")
-job_name_formatted = "" if not job_name else f" (Job Name: {job_name})"
-jira.add_comment(jira_issue_id, "Runbot execution of '{0}'{1} begins.".format(runbot_cmd, job_name_formatted))
-if not is_rerun:
-    jira.update_story_status(jira_issue_id, "IN PROGRESS")
-
-status_change_to_running = runbot_library.update_status_cd_for_row(runbot_id, 'RUNNING')
-if not status_change_to_running:
-    logerr("runbot.py -> Failed to update status_cd to 'RUNNING' on MSSQL")
-
-
-##### Step 4: Initalize and run the RunbotCommand object #####
-RunbotCommand = runbot_library.RunbotCommand(runbot_cmd, runbot_id, command_type=command_type)
-RunbotCommand.process_runbot_command()
-if not RunbotCommand.is_successful:
-    final_status_cd, is_failure = 'ERROR', 1
-        
-##### Log CTM output file if command is non-runjob (e.g. CTL, OTS, Release, etc.)
-if not RunbotCommand.is_runjob:
-    runbot_log_contents = cs_util.get_unix_command_output(f"cat {runbot_log}")
-    runbot_library.log_output_to_database(runbot_cmd, runbot_log, runbot_log_contents, is_failure, artifact_id, runbot_id)
-
-
-##### Step 5: Call update sproc to update 'status_cd' to 'COMPLETE' or 'ERROR' #####
-status_change_endstate = runbot_library.update_status_cd_for_row(runbot_id, final_status_cd)
-if not status_change_endstate:
-    logerr(f"runbot.py -> Failed to update status_cd to '{final_status_cd}' on MSSQL")
-
-##### Getting updated runbot row to comment the log id
-runjob_row = runbot_library.get_next_row_dict(runbot_id)
-runbot_id, jira_issue_id, job_name, runbot_cmd, artifact_id, log_run_id, error_snippet, job_type = runbot_library.get_required_row_values(runjob_row)
-
-
-##### Step 6: Comment on Jira story with run results #####
-logmsg("runbot.py -> Commenting END notice on {}".format(jira_issue_id))
-jira.add_comment(jira_issue_id, "Runbot execution of '{0}'{1} ends. \nStatus: *{2}*".format(runbot_cmd, job_name_formatted, final_status_cd))
-
-# noting log location based on job_type
-if is_rerun:
-    jira.add_comment(jira_issue_id, f"Log Location: <REDACTED>")
-
-if job_type == "":
-    jira.add_comment(jira_issue_id, "Full logfile available at: <REDACTED>")
-
-if error_snippet:
-    jira.add_comment(jira_issue_id, "{{color:red}}Error Message: {}{{color}}".format(error_snippet))
-
-
-##### Step 7: Update Jira status for outstanding requests if not rerun, then terminate execution #####
-if not is_rerun:
-    jira.update_story_status(jira_issue_id, "Failed" if is_failure else "Done")
-    runbot_library.sync_jira_status_for_outstanding_requests(jira_issue_id)
-
-finishup_msg = f"runbot.py -> Runbot execution ends. Status='{final_status_cd}'"
-logsuccess(finishup_msg) if RunbotCommand.is_successful else logerr(finishup_msg)
-print_console_note(f"Logfile available at: {runbot_log}")
-sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
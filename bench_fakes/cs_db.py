@@ -0,0 +1,98 @@
+""" Purpose: Offline stand-in for cs_db, backed by the SQLite file at RUNBOT_LOCAL_DB (used by runbot_bench.py) """
+#!/bin/env python3
+
+########################################################################
+# Only the statements RunBot sends through cs_db are understood:       #
+#   - EXEC MIS_Reports.jobs.RUNJOB_REQUEST_GET @RUNJOB_ID = n          #
+#   - EXEC MIS_Reports.jobs.RUNJOB_REQUEST_UPDATE @ID = n, @STATUS = s #
+#   - the SRG runjob command lookup in unix_utility                    #
+# Everything else returns no rows. RUNBOT_BENCH_DB_LATENCY_MS adds a   #
+# fixed delay per call to stand in for the network round trip.         #
+########################################################################
+
+import os
+import re
+import time
+import uuid
+import sqlite3
+
+import runbot_queue
+
+DB_LATENCY_SECONDS = float(os.getenv('RUNBOT_BENCH_DB_LATENCY_MS', 0)) / 1000
+EXEC_RE = re.compile(r"^\s*EXEC\s+(?:\w+\.)*(\w+)", re.IGNORECASE)
+PARAM_RE = re.compile(r"@(\w+)\s*=\s*(NULL|N?'(?:[^']|'')*'|-?\d+(?:\.\d+)?)", re.IGNORECASE)
+SRG_JOB_RE = re.compile(r"j\.val_255\s*=\s*N?'([^']*)'", re.IGNORECASE)
+
+_conn = None
+
+
+def _connect():
+    global _conn
+    if _conn is None:
+        # Opening the queue backend creates the schema if the harness has not seeded this file yet
+        _conn = runbot_queue.SqliteQueueBackend(os.environ['RUNBOT_LOCAL_DB']).conn
+    return _conn
+
+
+def _parse_literal(literal):
+    if literal.upper() == 'NULL':
+        return None
+    if literal.endswith("'"):
+        return literal[literal.index("'") + 1:-1].replace("''", "'")
+    return float(literal) if '.' in literal else int(literal)
+
+
+def _get_request(conn, params):
+    rows = conn.execute("SELECT j.*, l.ERROR_SNIPPIT_TX FROM RUNJOB_REQUEST_T j "
+                        "LEFT OUTER JOIN BATCH_FRAMEWORK_LOG_T l ON j.RUN_ID = l.RUN_ID AND l.SEQ_ID = 1 "
+                        "WHERE j.ID = ?", (params.get('RUNJOB_ID'),))
+    return [{k: row[k] for k in row.keys()} for row in rows]
+
+
+def _update_request(conn, params):
+    id, status_cd, now = params.get('ID'), params.get('STATUS'), time.time()
+    if status_cd == 'RUNNING':
+        conn.execute("UPDATE RUNJOB_REQUEST_T SET STATUS_CD = ?, EXECUTION_START_TS = ? WHERE ID = ?", (status_cd, now, id))
+    elif status_cd in ('COMPLETE', 'ERROR', 'TIMEOUT'):
+        run_id = uuid.uuid4().hex[:16]
+        conn.execute("UPDATE RUNJOB_REQUEST_T SET STATUS_CD = ?, EXECUTION_END_TS = ?, RUN_ID = ?, OWNER_TOKEN_TX = NULL, "
+                     "LEASE_EXPIRY_TS = NULL WHERE ID = ?", (status_cd, now, run_id, id))
+        if status_cd in ('ERROR', 'TIMEOUT'):
+            conn.execute("INSERT INTO BATCH_FRAMEWORK_LOG_T (RUN_ID, SEQ_ID, ERROR_SNIPPIT_TX) VALUES (?, 1, ?)",
+                         (run_id, "ERROR: synthetic failure"))
+    elif status_cd == 'NEW':
+        cur = conn.execute("UPDATE RUNJOB_REQUEST_T SET STATUS_CD = 'NEW', EXECUTION_START_TS = NULL, EXECUTION_END_TS = NULL, "
+                           "OWNER_TOKEN_TX = NULL, LEASE_EXPIRY_TS = NULL WHERE ID = ? AND STATUS_CD = 'QUEUED' AND OWNER_TOKEN_TX = ?",
+                           (id, params.get('OWNER_TOKEN')))
+        return [{'RELEASED_CT': cur.rowcount}]
+    else:
+        conn.execute("UPDATE RUNJOB_REQUEST_T SET STATUS_CD = ?, OWNER_TOKEN_TX = NULL, LEASE_EXPIRY_TS = NULL WHERE ID = ?",
+                     (status_cd, id))
+    return []
+
+
+SPROCS = {'RUNJOB_REQUEST_GET': _get_request, 'RUNJOB_REQUEST_UPDATE': _update_request}
+
+
+class DataBase:
+    @staticmethod
+    def mssql_query(sql):
+        """
+        INPUT: sql (str) with literal parameters, as sent by runbot_db.CsDbSession
+        OUTPUT: list of row dicts (upper-case column names)
+        """
+        time.sleep(DB_LATENCY_SECONDS)
+        exec_match = EXEC_RE.match(sql)
+        if exec_match and exec_match.group(1).upper() in SPROCS:
+            params = {name.upper(): _parse_literal(value) for name, value in PARAM_RE.findall(sql)}
+            return SPROCS[exec_match.group(1).upper()](_connect(), params)
+        srg_match = SRG_JOB_RE.search(sql)
+        if srg_match and 'ARTFCT_ATTRB_VALUE_V' in sql:
+            return [{'RUNJOB_CMD': f"runjob srg {srg_match.group(1)} 0"}]
+        return []
+
+
+    @staticmethod
+    def mssql_update(sql):
+        DataBase.mssql_query(sql)
+        return True
@@ -0,0 +1,18 @@
+""" Purpose: Offline stand-in for cs_environment; always a non-production, local run (used by runbot_bench.py) """
+#!/bin/env python3
+
+
+def current_user_is_production():
+    return False
+
+
+def current_machine_is_production_server():
+    return False
+
+
+def is_full_production_run():
+    return False
+
+
+def get_mssql_instance():
+    return "LOCAL"
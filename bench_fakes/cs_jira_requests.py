@@ -0,0 +1,100 @@
+""" Purpose: Offline stand-in for cs_jira_requests with configurable latency (used by runbot_bench.py) """
+#!/bin/env python3
+
+########################################################################
+# Issue state lives in BENCH_JIRA_ISSUE_T inside RUNBOT_LOCAL_DB, so   #
+# every RunBot process of a benchmark sees the same statuses. Each     #
+# call sleeps RUNBOT_BENCH_JIRA_LATENCY_MS (default 150ms, about a     #
+# production REST round trip) and is counted in BENCH_JIRA_CALL_T.     #
+# Like the installed client, it has no search_issues() unless          #
+# RUNBOT_BENCH_JIRA_SEARCH=1, to measure the incremental status sync.  #
+########################################################################
+
+import os
+import re
+import time
+import sqlite3
+
+JIRA_LATENCY_SECONDS = float(os.getenv('RUNBOT_BENCH_JIRA_LATENCY_MS', 150)) / 1000
+ISSUE_KEY_RE = re.compile(r"^[A-Z][A-Z0-9]+-\d+$")
+JQL_RE = re.compile(r'key in \(([^)]*)\) AND updated >= "-(\d+)m"')
+DEFAULT_STATUS = 'Ready to Implement'
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS BENCH_JIRA_ISSUE_T (ISSUE_ID TEXT PRIMARY KEY, STATUS_TX TEXT, ASSIGNEE_TX TEXT,
+                                                   COMMENT_CT INTEGER NOT NULL DEFAULT 0, UPDATED_TS REAL);
+    CREATE TABLE IF NOT EXISTS BENCH_JIRA_CALL_T (ACTION TEXT PRIMARY KEY, CALL_CT INTEGER NOT NULL DEFAULT 0);
+    """
+
+
+class JiraRequest:
+    def __init__(self) -> None:
+        self.conn = sqlite3.connect(os.environ['RUNBOT_LOCAL_DB'], timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        if os.getenv('RUNBOT_BENCH_JIRA_SEARCH') == '1':
+            self.search_issues = self.__search_issues
+
+
+    def __call(self, action):
+        time.sleep(JIRA_LATENCY_SECONDS)
+        self.conn.execute("INSERT INTO BENCH_JIRA_CALL_T (ACTION, CALL_CT) VALUES (?, 1) "
+                          "ON CONFLICT (ACTION) DO UPDATE SET CALL_CT = CALL_CT + 1", (action,))
+
+
+    def __upsert(self, issue_id, column, value):
+        self.conn.execute(f"INSERT INTO BENCH_JIRA_ISSUE_T (ISSUE_ID, STATUS_TX, {column}, UPDATED_TS) VALUES (?, ?, ?, ?) "
+                          f"ON CONFLICT (ISSUE_ID) DO UPDATE SET {column} = excluded.{column}, UPDATED_TS = excluded.UPDATED_TS",
+                          (issue_id, DEFAULT_STATUS, value, time.time()))
+
+
+    def is_valid_issue_key(self, issue_id):
+        self.__call('is_valid_issue_key')
+        return bool(ISSUE_KEY_RE.match(issue_id or ""))
+
+
+    def query_multiple_issues(self, issue_ids):
+        """
+        INPUT: issue_ids (str), comma separated
+        OUTPUT: dict shaped like the Jira search response ({'result': {'issues': [...]}})
+        """
+        self.__call('query_multiple_issues')
+        keys = [key for key in issue_ids.split(",") if key]
+        statuses = dict(self.conn.execute("SELECT ISSUE_ID, STATUS_TX FROM BENCH_JIRA_ISSUE_T WHERE ISSUE_ID IN ({})".format(
+            ", ".join("?" for _ in keys)), keys)) if keys else {}
+        return {'result': {'issues': [{'key': key, 'fields': {'status': {'name': statuses.get(key, DEFAULT_STATUS)}}}
+                                      for key in keys]}}
+
+
+    def __search_issues(self, jql, start_at=0, max_results=50):
+        """
+        INPUT: jql (str); only 'key in (...) AND updated >= "-Nm"' is understood, start_at (int), max_results (int)
+        OUTPUT: dict shaped like the Jira search response, one page of it; issues never touched are treated as not updated
+        """
+        self.__call('search_issues')
+        match = JQL_RE.search(jql)
+        keys = [key.strip() for key in match.group(1).split(",")]
+        since_ts = time.time() - int(match.group(2)) * 60
+        rows = self.conn.execute("SELECT ISSUE_ID, STATUS_TX FROM BENCH_JIRA_ISSUE_T WHERE UPDATED_TS >= ? AND ISSUE_ID IN ({}) "
+                                 "ORDER BY ISSUE_ID".format(", ".join("?" for _ in keys)), (since_ts, *keys)).fetchall()
+        return {'result': {'startAt': start_at, 'maxResults': max_results, 'total': len(rows),
+                           'issues': [{'key': key, 'fields': {'status': {'name': status}}}
+                                      for key, status in rows[start_at:start_at + max_results]]}}
+
+
+    def add_comment(self, issue_id, comment):
+        self.__call('add_comment')
+        self.conn.execute("INSERT INTO BENCH_JIRA_ISSUE_T (ISSUE_ID, STATUS_TX, COMMENT_CT, UPDATED_TS) VALUES (?, ?, 1, ?) "
+                          "ON CONFLICT (ISSUE_ID) DO UPDATE SET COMMENT_CT = COMMENT_CT + 1, UPDATED_TS = excluded.UPDATED_TS",
+                          (issue_id, DEFAULT_STATUS, time.time()))
+        return True
+
+
+    def update_story_status(self, issue_id, status):
+        self.__call('update_story_status')
+        self.__upsert(issue_id, 'STATUS_TX', status)
+        return True
+
+
+    def assign_story_to_user(self, issue_id, username):
+        self.__call('assign_story_to_user')
+        self.__upsert(issue_id, 'ASSIGNEE_TX', username)
+        return True
@@ -0,0 +1,4 @@
+""" Purpose: Shadows pyodbc during offline benchmarks so runbot_db falls back to the cs_db stand-in (used by runbot_bench.py) """
+#!/bin/env python3
+
+raise ImportError("pyodbc is disabled for offline benchmarks; statements go to the local cs_db stand-in")
@@ -0,0 +1,337 @@
+""" Purpose: Offline end-to-end benchmark of RunBot_Script.py against local stand-ins for MSSQL, Jira and runjob """
+#!/bin/env python3
+
+########################################################################
+# Seeds a SQLite queue (RUNBOT_LOCAL_DB) with synthetic runjob and CTL #
+# requests, then drains it with the real RunBot_Script.py, either one  #
+# cron-style process per tick or as a --daemon. bench_fakes/ shadows   #
+# cs_db, cs_jira_requests, cs_environment and pyodbc; a fake runjob on #
+# PATH sleeps, prints log lines and optionally fails. Reports rows per #
+# minute, per-phase latency percentiles (from runbot_metrics JSON      #
+# lines) and peak RSS, and compares them against a saved JSON baseline #
+#   Usage: runbot_bench.py --rows 50 --save-baseline base.json         #
+#          runbot_bench.py --rows 50 --baseline base.json              #
+########################################################################
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import signal
+import argparse
+import resource
+import subprocess
+
+import runbot_queue
+from cs_logging import logmsg, logerr, logwarning, logsuccess
+
+script_arrow = str(os.path.basename(__file__)) + " ->"
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKES_DIR = os.path.join(REPO_DIR, "bench_fakes")
+TERMINAL_STATUSES = ('COMPLETE', 'ERROR', 'TIMEOUT', 'FOLLOWING')
+PERCENTILES = (50, 90, 99)
+NOISE_FLOOR_SECONDS = 0.05 # phase regressions smaller than this are timer noise, whatever the ratio
+
+FAKE_RUNJOB = """#!/bin/sh
+# Stand-in for runjob: sleeps for the first numeric argument, prints RUNBOT_BENCH_LOG_LINES lines, fails on 'fail'
+secs=""; status=0
+for a in "$@"; do
+    case "$a" in
+        fail) status=3 ;;
+        *[!0-9.]*|"") ;;
+        *) [ -z "$secs" ] && secs=$a ;;
+    esac
+done
+echo "runjob $*"
+i=0; while [ $i -lt "${RUNBOT_BENCH_LOG_LINES:-20}" ]; do echo "$(date '+%F %T') INFO step progress line $i"; i=$((i + 1)); done
+sleep "${secs:-0}"
+[ $status -ne 0 ] && echo "ERROR: synthetic failure in runjob $*"
+exit $status
+"""
+
+
+class BenchConfig:
+    """
+    Shape of the synthetic workload; every field can be set from the command line
+    """
+    def __init__(self, rows=20, ctl_fraction=0.3, min_steps=2, max_steps=6, step_seconds=0.05, fail_rate=0.0,
+                 duplicate_rate=0.0, log_lines=20, jira_latency_ms=150, db_latency_ms=2, daemon=False, workers=4,
+                 probe=False, seed=1) -> None:
+        self.rows = rows
+        self.ctl_fraction = ctl_fraction
+        self.min_steps = min_steps
+        self.max_steps = max_steps
+        self.step_seconds = step_seconds
+        self.fail_rate = fail_rate
+        self.duplicate_rate = duplicate_rate
+        self.log_lines = log_lines
+        self.jira_latency_ms = jira_latency_ms
+        self.db_latency_ms = db_latency_ms
+        self.daemon = daemon
+        self.workers = workers
+        self.probe = probe
+        self.seed = seed
+
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+def prepare_workspace(workdir, config):
+    """
+    INPUT: workdir (str), wiped and recreated; config (BenchConfig)
+    OUTPUT: env (dict) for RunBot_Script.py processes of this benchmark
+    """
+    shutil.rmtree(workdir, ignore_errors=True)
+    for name in ("bin", "ctl", "metrics", "ctl_cache"):
+        os.makedirs(os.path.join(workdir, name))
+    runjob = os.path.join(workdir, "bin", "runjob")
+    with open(runjob, 'w') as f:
+        f.write(FAKE_RUNJOB)
+    os.chmod(runjob, 0o755)
+
+    rng = random.Random(config.seed)
+    def step_args():
+        return f"{config.step_seconds}{' fail' if rng.random() < config.fail_rate else ''}"
+
+    rows = []
+    for i in range(config.rows):
+        if rows and rng.random() < config.duplicate_rate:
+            row = dict(rng.choice(rows))
+        elif rng.random() < config.ctl_fraction:
+            ctl = os.path.join(workdir, "ctl", f"bench_{i}.ctl")
+            with open(ctl, 'w') as f:
+                f.write("#!/bin/sh\n" + "".join(f"runjob bench step_{i}_{n} {step_args()}\n"
+                                                for n in range(rng.randint(config.min_steps, config.max_steps))))
+            row = {'JOB_TYPE': 'RELOAD_TABLE', 'JOB_NM': f"bench_{i}", 'RUNJOB_CMD': ctl}
+        else:
+            row = {'JOB_TYPE': 'RERUN_REPORT', 'JOB_NM': f"job_{i}", 'RUNJOB_CMD': f"runjob bench job_{i} {step_args()}"}
+        # A duplicate keeps its source row's ARTIFACT_ID, which is part of the key it coalesces on
+        rows.append({'ARTIFACT_ID': i + 1, **row, 'JIRA_ISSUE_ID': f"BENCH-{i + 1}", 'SCHWAB_ID': "bench"})
+
+    db_path = os.path.join(workdir, "runbot_bench.db")
+    runbot_queue.SqliteQueueBackend(db_path).enqueue(rows)
+
+    env = dict(os.environ)
+    env.update({
+        'PYTHONPATH': os.pathsep.join(filter(None, [FAKES_DIR, REPO_DIR, os.getenv('PYTHONPATH')])),
+        'PATH': os.path.join(workdir, "bin") + os.pathsep + os.getenv('PATH', ""),
+        'USER': os.getenv('USER', "bench"),
+        'RUNBOT_LOCAL_DB': db_path,
+        'RUNBOT_OUTBOX_DB': os.path.join(workdir, "jira_outbox.db"),
+        'RUNBOT_JIRA_CACHE_DB': os.path.join(workdir, "jira_cache.db"),
+        'RUNBOT_METRICS_DIR': os.path.join(workdir, "metrics"),
+        'RUNBOT_METRICS_JSONL': os.path.join(workdir, "metrics", "runbot_runs.jsonl"),
+        'RUNBOT_METRICS_PROM': os.path.join(workdir, "metrics", "runbot.prom"),
+        'RUNBOT_STARTUP_TIMINGS': os.path.join(workdir, "metrics", "startup.jsonl"),
+        'RUNBOT_CTL_CACHE_DIR': os.path.join(workdir, "ctl_cache"),
+        'RUNBOT_RETRY_BACKOFF_SECONDS': "0",
+        'RUNBOT_BENCH_JIRA_LATENCY_MS': str(config.jira_latency_ms),
+        'RUNBOT_BENCH_DB_LATENCY_MS': str(config.db_latency_ms),
+        'RUNBOT_BENCH_LOG_LINES': str(config.log_lines),
+    })
+    return env
+
+
+def _status_counts(db_path):
+    backend = runbot_queue.SqliteQueueBackend(db_path)
+    try:
+        return dict(backend.conn.execute("SELECT STATUS_CD, COUNT(*) FROM RUNJOB_REQUEST_T GROUP BY STATUS_CD").fetchall())
+    finally:
+        backend.conn.close()
+
+
+def _is_drained(db_path):
+    return all(status_cd in TERMINAL_STATUSES for status_cd in _status_counts(db_path))
+
+
+def _drain_one_shot(env, config, log_file):
+    script = [sys.executable, os.path.join(REPO_DIR, "RunBot_Script.py")] + (["--probe"] if config.probe else [])
+    ticks = 0
+    # Coalesced followers finish with their leader, so a fully drained queue can take fewer ticks than rows
+    while not _is_drained(env['RUNBOT_LOCAL_DB']) and ticks < config.rows * 2 + 5:
+        subprocess.run(script, env=env, stdout=log_file, stderr=subprocess.STDOUT, cwd=REPO_DIR)
+        ticks += 1
+    # One more tick on the empty queue measures the idle cron cost
+    subprocess.run(script, env=env, stdout=log_file, stderr=subprocess.STDOUT, cwd=REPO_DIR)
+    return ticks + 1
+
+
+def _drain_daemon(env, config, log_file):
+    proc = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "RunBot_Script.py"), "--daemon",
+                             "--max-workers", str(config.workers), "--poll-interval", "1", "--sync-interval", "3600"],
+                            env=env, stdout=log_file, stderr=subprocess.STDOUT, cwd=REPO_DIR)
+    try:
+        while not _is_drained(env['RUNBOT_LOCAL_DB']) and proc.poll() is None:
+            time.sleep(0.2)
+    finally:
+        if proc.poll() is None:
+            proc.send_signal(signal.SIGTERM)
+        proc.wait()
+    return 1
+
+
+def percentile(values, pct):
+    """
+    INPUT: values (list of float), pct (0-100)
+    OUTPUT: linearly interpolated percentile (float), or None for no values
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def summarize(values):
+    """
+    OUTPUT: dict with count, mean and p50/p90/p99 of values (seconds)
+    """
+    summary = {'count': len(values), 'mean': sum(values) / len(values) if values else None}
+    summary.update({f"p{pct}": percentile(values, pct) for pct in PERCENTILES})
+    return summary
+
+
+def _read_jsonl(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _git_version():
+    try:
+        return subprocess.run(["git", "-C", REPO_DIR, "describe", "--always", "--dirty"], capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmark(config, workdir="/tmp/runbot_bench"):
+    """
+    INPUT: config (BenchConfig), workdir (str, wiped first)
+    OUTPUT: result (dict): throughput, per-phase and per-run latency percentiles, Jira/DB call counts and peak RSS
+    """
+    env = prepare_workspace(workdir, config)
+    logmsg(f"{script_arrow} Draining {config.rows} synthetic request(s) {'with --daemon' if config.daemon else 'one tick at a time'} "
+           f"(workdir {workdir})")
+    start = time.monotonic()
+    with open(os.path.join(workdir, "runbot_output.log"), 'w') as log_file:
+        ticks = (_drain_daemon if config.daemon else _drain_one_shot)(env, config, log_file)
+    elapsed = time.monotonic() - start
+
+    status_counts = _status_counts(env['RUNBOT_LOCAL_DB'])
+    runs = [run for run in _read_jsonl(env['RUNBOT_METRICS_JSONL']) if run.get('outcome') not in ('EMPTY', 'DAEMON')]
+    # Empty ticks are timed by runbot_probe from interpreter start, which also covers the --probe early exit
+    idle_ticks = [tick for tick in _read_jsonl(env['RUNBOT_STARTUP_TIMINGS']) if tick.get('outcome') == 'empty']
+    phases, calls = {}, {}
+    for run in runs:
+        for name, phase in run['phases'].items():
+            phases.setdefault(name, []).append(phase['seconds'])
+        for name, call in run['calls'].items():
+            calls[name] = calls.get(name, 0) + call['count']
+
+    done = sum(status_counts.get(status_cd, 0) for status_cd in TERMINAL_STATUSES)
+    result = {
+        'version': _git_version(),
+        'config': config.as_dict(),
+        'elapsed_seconds': elapsed,
+        'ticks': ticks,
+        'rows_done': done,
+        'status_counts': status_counts,
+        'rows_per_minute': done / elapsed * 60 if elapsed else 0.0,
+        'run_seconds': summarize([run['wall_seconds'] for run in runs]),
+        'idle_tick_seconds': summarize([tick['total'] for tick in idle_ticks]),
+        'phases': {name: summarize(values) for name, values in sorted(phases.items())},
+        'calls_per_run': {name: count / len(runs) for name, count in sorted(calls.items())} if runs else {},
+        # RUSAGE_CHILDREN covers every RunBot process waited for, and transitively the commands they ran
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+    if done < config.rows:
+        logwarning(f"{script_arrow} Only {done} of {config.rows} request(s) reached an end state: {status_counts}")
+    return result
+
+
+def compare_to_baseline(result, baseline, tolerance=0.15):
+    """
+    INPUT: result and baseline (dicts from run_benchmark), tolerance (float), the allowed relative slowdown
+    OUTPUT: list of regression messages (str); empty if result is within tolerance of baseline
+    """
+    regressions = []
+    if baseline.get('config') != result.get('config'):
+        logwarning(f"{script_arrow} Baseline was recorded with a different workload; comparisons may be meaningless")
+    if result['rows_per_minute'] < baseline['rows_per_minute'] * (1 - tolerance):
+        regressions.append(f"throughput {result['rows_per_minute']:.1f} rows/min vs {baseline['rows_per_minute']:.1f} baseline")
+    for name, summary in result['phases'].items():
+        base = baseline['phases'].get(name)
+        if not base or base['p90'] is None or summary['p90'] is None:
+            continue
+        if summary['p90'] > base['p90'] * (1 + tolerance) and summary['p90'] - base['p90'] > NOISE_FLOOR_SECONDS:
+            regressions.append(f"phase '{name}' p90 {summary['p90']:.3f}s vs {base['p90']:.3f}s baseline")
+    if result['peak_rss_mb'] > baseline['peak_rss_mb'] * (1 + tolerance):
+        regressions.append(f"peak RSS {result['peak_rss_mb']:.1f}MB vs {baseline['peak_rss_mb']:.1f}MB baseline")
+    return regressions
+
+
+def print_report(result):
+    logmsg(f"{script_arrow} {result['rows_done']} request(s) in {result['elapsed_seconds']:.1f}s over {result['ticks']} tick(s): "
+           f"{result['rows_per_minute']:.1f} rows/min, peak RSS {result['peak_rss_mb']:.1f}MB, statuses {result['status_counts']}")
+    for name, summary in [('run (wall)', result['run_seconds']), ('idle tick', result['idle_tick_seconds']),
+                          *result['phases'].items()]:
+        if summary['count']:
+            logmsg(f"{script_arrow}   {name:<28} n={summary['count']:<4} mean={summary['mean']:.3f}s "
+                   + " ".join(f"p{pct}={summary[f'p{pct}']:.3f}s" for pct in PERCENTILES))
+    for name, per_run in result['calls_per_run'].items():
+        logmsg(f"{script_arrow}   {name:<28} {per_run:.1f} call(s)/run")
+
+
+def parse_args():
+    defaults = BenchConfig()
+    parser = argparse.ArgumentParser(description="Offline end-to-end RunBot benchmark against local stand-ins")
+    parser.add_argument('--rows', type=int, default=defaults.rows, help="Synthetic requests to queue")
+    parser.add_argument('--ctl-fraction', type=float, default=defaults.ctl_fraction, help="Share of requests that are CTLs")
+    parser.add_argument('--min-steps', type=int, default=defaults.min_steps, help="Fewest runjob steps per CTL")
+    parser.add_argument('--max-steps', type=int, default=defaults.max_steps, help="Most runjob steps per CTL")
+    parser.add_argument('--step-seconds', type=float, default=defaults.step_seconds, help="Duration of each fake runjob")
+    parser.add_argument('--fail-rate', type=float, default=defaults.fail_rate, help="Share of runjobs that fail")
+    parser.add_argument('--duplicate-rate', type=float, default=defaults.duplicate_rate, help="Share of requests repeating an earlier one")
+    parser.add_argument('--log-lines', type=int, default=defaults.log_lines, help="Lines of output per fake runjob")
+    parser.add_argument('--jira-latency-ms', type=float, default=defaults.jira_latency_ms, help="Delay per fake Jira call")
+    parser.add_argument('--db-latency-ms', type=float, default=defaults.db_latency_ms, help="Delay per fake cs_db call")
+    parser.add_argument('--daemon', action='store_true', help="Drain with RunBot_Script.py --daemon instead of one process per tick")
+    parser.add_argument('--workers', type=int, default=defaults.workers, help="(daemon) --max-workers")
+    parser.add_argument('--probe', action='store_true', help="Run one-shot ticks with --probe")
+    parser.add_argument('--seed', type=int, default=defaults.seed, help="Random seed for the synthetic workload")
+    parser.add_argument('--workdir', default="/tmp/runbot_bench", help="Scratch directory, wiped on start")
+    parser.add_argument('--save-baseline', metavar='PATH', help="Write the result as a JSON baseline")
+    parser.add_argument('--baseline', metavar='PATH', help="Compare against a JSON baseline; exit 1 on regression")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="Allowed relative slowdown against the baseline")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    config = BenchConfig(**{key: value for key, value in vars(args).items() if key in BenchConfig().as_dict()})
+    result = run_benchmark(config, workdir=args.workdir)
+    print_report(result)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+        logmsg(f"{script_arrow} Baseline saved to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(result, json.load(f), args.tolerance)
+        if regressions:
+            for regression in regressions:
+                logerr(f"{script_arrow} REGRESSION: {regression}")
+            sys.exit(1)
+        logsuccess(f"{script_arrow} Within {args.tolerance:.0%} of baseline {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
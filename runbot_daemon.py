@@ -0,0 +1,370 @@
+""" Purpose: Long-running RunBot worker daemon that drains mis_reports.jobs.RUNJOB_REQUEST_T """
+#!/bin/env python3
+
+import os
+import time
+import signal
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+import runbot_library
+import runbot_jira_outbox
+import runbot_db
+import runbot_metrics
+from cs_logging import logmsg, logerr, logwarning, logsuccess
+
+script_arrow = str(os.path.basename(__file__)) + " ->"
+
+
+def parse_job_type_limits(limit_args):
+    """
+    INPUT: limit_args (list of str), each in 'JOB_TYPE=N' format (e.g. 'RELOAD_TABLE=1')
+
+    OUTPUT: job_type_limits (dict), mapping job_type -> max concurrent jobs
+    """
+    job_type_limits = {}
+    for arg in limit_args or []:
+        job_type, _, limit = arg.partition('=')
+        if not job_type or not limit.isdigit():
+            raise ValueError(f"Invalid job type limit '{arg}'; expected JOB_TYPE=N")
+        job_type_limits[job_type.strip().upper()] = int(limit)
+    return job_type_limits
+
+
+def _ignore_in_worker(signum, frame):
+    # A handler rather than SIG_IGN: caught signals reset to the default on exec, so the job's own commands stay killable
+    logwarning(f"{script_arrow} Worker {os.getpid()} ignoring signal {signum}; the daemon lets in-flight jobs finish")
+
+
+def _run_in_worker(execute_fn, row_to_execute, plan=None):
+    """
+    Executes a single request inside a pool worker process.
+    Workers are reused, so os.environ is restored after each job and WORKING_JIRA_ID / RUNBOT_LOG cannot leak into the next.
+    plan (runbot_library.RequestPlan, optional) is the request as prepared by the daemon ahead of time
+
+    OUTPUT: (pid, runbot_id, final_status_cd, elapsed_seconds)
+    """
+    # Leave signal handling to the parent; a SIGTERM/SIGINT sent to the whole process group does not stop in-flight jobs
+    signal.signal(signal.SIGINT, _ignore_in_worker)
+    signal.signal(signal.SIGTERM, _ignore_in_worker)
+    environ = dict(os.environ)
+    start = time.monotonic()
+    try:
+        metrics = runbot_metrics.start_run(runbot_id=row_to_execute.get('id'), job_type=row_to_execute.get('job_type'))
+        final_status_cd = execute_fn(row_to_execute, plan=plan)
+        metrics.finish(final_status_cd or 'NOT_RUN')
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+    return os.getpid(), row_to_execute.get('id'), final_status_cd, time.monotonic() - start
+
+
+class WorkerStats:
+    """
+    Per-worker throughput counters, keyed by worker pid
+    """
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.workers = {}
+
+    def record(self, pid, final_status_cd, elapsed):
+        stats = self.workers.setdefault(pid, {'jobs': 0, 'failed': 0, 'busy_seconds': 0.0})
+        stats['jobs'] += 1
+        stats['busy_seconds'] += elapsed
+        if final_status_cd != 'COMPLETE':
+            stats['failed'] += 1
+
+    def report(self):
+        uptime_min = max(time.monotonic() - self.started, 1e-9) / 60
+        total_jobs = sum(s['jobs'] for s in self.workers.values())
+        logmsg(f"{script_arrow} Throughput: {total_jobs} job(s) in {uptime_min:.1f} min ({total_jobs / uptime_min:.2f} jobs/min)")
+        for pid, s in sorted(self.workers.items()):
+            avg = s['busy_seconds'] / s['jobs'] if s['jobs'] else 0
+            logmsg(f"{script_arrow}   worker {pid}: {s['jobs']} job(s), {s['failed']} failed, "
+                   f"{s['jobs'] / uptime_min:.2f} jobs/min, avg {avg:.1f}s/job, "
+                   f"{100 * s['busy_seconds'] / (uptime_min * 60):.0f}% busy")
+
+
+class RunbotDaemon:
+    """
+    Keeps claiming rows and executes up to max_workers requests at once, with optional per-job_type limits.
+    While every worker is busy, up to prefetch_depth extra rows are claimed and prepared (Jira key validated,
+    command classified, CTL scrubbed), so a freed worker starts executing the next request at once.
+    SIGTERM/SIGINT stop claiming new rows; in-flight jobs are allowed to finish before exit.
+    A worker that dies (OOM kill, signal) breaks the whole pool; its rows are given back and a new pool is forked.
+    """
+    def __init__(self, execute_fn, max_workers=4, job_type_limits=None, poll_interval=30, sync_interval=300,
+                 lease_seconds=runbot_library.DEFAULT_LEASE_SECONDS, prefetch_depth=1) -> None:
+        self.execute_fn = execute_fn
+        self.max_workers = max(1, max_workers)
+        self.job_type_limits = job_type_limits or {}
+        self.poll_interval = poll_interval
+        self.sync_interval = sync_interval
+        self.lease_seconds = lease_seconds
+        self.prefetch_depth = max(0, prefetch_depth)
+        self.stats = WorkerStats()
+        self.is_stopping = False
+        self.in_flight = {}   # future -> row dict
+        self.held_rows = []   # claimed rows waiting for a worker or job_type slot
+        self.lost_rows = []   # rows whose worker pool broke under them
+        self.plans = {}       # runbot_id -> RequestPlan for held rows prepared ahead of time
+        self.last_sync = None
+        self.last_renewal = time.monotonic()
+
+
+    def __handle_signal(self, signum, frame):
+        if self.is_stopping:
+            logwarning(f"{script_arrow} Received signal {signum} again; still waiting on {len(self.in_flight)} in-flight job(s)")
+            return
+        logmsg(f"{script_arrow} Received signal {signum}; no new rows will be claimed. Waiting on {len(self.in_flight)} in-flight job(s)...")
+        self.is_stopping = True
+
+
+    def __running_count(self, job_type):
+        return sum(1 for row in self.in_flight.values() if row.get('job_type') == job_type)
+
+
+    def __has_type_slot(self, job_type):
+        limit = self.job_type_limits.get((job_type or '').upper())
+        return limit is None or self.__running_count(job_type) < limit
+
+
+    def __runnable_held_count(self):
+        """
+        OUTPUT: number of held rows that could start as workers free up; rows waiting on a job_type limit are not counted,
+                so a saturated job_type never uses up the claim capacity other job_types need
+        """
+        starting = {}
+        count = 0
+        for row in self.held_rows:
+            job_type = row.get('job_type')
+            limit = self.job_type_limits.get((job_type or '').upper())
+            if limit is None or self.__running_count(job_type) + starting.get(job_type, 0) < limit:
+                starting[job_type] = starting.get(job_type, 0) + 1
+                count += 1
+        return count
+
+
+    def __sync_jira_if_due(self):
+        if self.last_sync is not None and time.monotonic() - self.last_sync < self.sync_interval:
+            return
+        if self.stats.workers:
+            self.stats.report()
+        if self.last_sync is not None:
+            # The parent's own work (Jira sync, outbox delivery, claims) is exported once per sync interval
+            runbot_metrics.get_metrics().finish('DAEMON')
+            runbot_metrics.start_run(role='daemon')
+        logmsg(f"{script_arrow} Updating existing Jira status in mis_reports.jobs.RUNJOB_REQUEST_T")
+        metrics = runbot_metrics.get_metrics()
+        try:
+            with metrics.phase('reclaim'):
+                runbot_library.reclaim_expired_leases()
+            with metrics.phase('jira_sync'):
+                runbot_library.sync_jira_status_for_outstanding_requests()
+            runbot_library.log_queue_forecast(slots=self.max_workers)
+        except Exception as e:
+            logwarning(f"{script_arrow} Jira-DB syncup failed; will retry next interval. Exception: {e}")
+        self.last_sync = time.monotonic()
+
+
+    def __renew_leases_if_due(self):
+        if time.monotonic() - self.last_renewal < self.lease_seconds / 3:
+            return
+        owned_ids = [row.get('id') for row in list(self.in_flight.values()) + self.held_rows]
+        if owned_ids:
+            try:
+                runbot_library.renew_lease(owned_ids, self.lease_seconds)
+            except Exception as e:
+                logwarning(f"{script_arrow} Lease renewal failed; retrying next cycle. Exception: {e}")
+        self.last_renewal = time.monotonic()
+
+
+    def __next_row(self):
+        """
+        OUTPUT: next row (dict) to submit, or None if nothing is runnable right now
+        """
+        for row in self.held_rows:
+            if self.__has_type_slot(row.get('job_type')):
+                self.held_rows.remove(row)
+                return row
+        # Claim one batch for the free worker slots; never hold more runnable rows than there are workers to run them
+        batch_size = min(self.max_workers - len(self.in_flight), self.max_workers - self.__runnable_held_count())
+        if batch_size <= 0:
+            return None
+        claimed_rows = runbot_library.claim_rows(batch_size=batch_size, lease_seconds=self.lease_seconds)
+        if not claimed_rows:
+            return None
+        for row in claimed_rows:
+            if not self.__has_type_slot(row.get('job_type')):
+                logmsg(f"{script_arrow} job_type {row.get('job_type')} at its concurrency limit; holding request {row.get('id')}")
+        self.held_rows.extend(claimed_rows)
+        for row in self.held_rows:
+            if self.__has_type_slot(row.get('job_type')):
+                self.held_rows.remove(row)
+                return row
+        return None
+
+
+    def __submit_available(self, pool):
+        """
+        OUTPUT: number of rows submitted to the pool
+        """
+        submitted = 0
+        while not self.is_stopping and len(self.in_flight) < self.max_workers:
+            row = self.__next_row()
+            if not row:
+                break
+            plan = self.plans.pop(row.get('id'), None)
+            logmsg(f"{script_arrow} Dispatching {'prepared ' if plan else ''}request {row.get('id')} ({row.get('job_type')}): {row.get('runjob_cmd')}")
+            try:
+                self.in_flight[pool.submit(_run_in_worker, self.execute_fn, row, plan)] = row
+            except BrokenProcessPool:
+                # Never reached a worker; hold it again for the rebuilt pool
+                self.held_rows.insert(0, row)
+                self.plans[row.get('id')] = plan
+                raise
+            submitted += 1
+        return submitted
+
+
+    def __prefetch(self):
+        """
+        Runs in the daemon's own loop while every worker is busy: claims up to prefetch_depth rows ahead and
+        prepares one held row that has no plan yet. A row whose preparation fails is prepared again by its worker
+        OUTPUT: True if a row was prepared
+        """
+        if self.is_stopping or len(self.in_flight) < self.max_workers:
+            return False
+        runnable_held = self.__runnable_held_count()
+        if runnable_held < self.prefetch_depth:
+            claimed_rows = runbot_library.claim_rows(batch_size=self.prefetch_depth - runnable_held,
+                                                     lease_seconds=self.lease_seconds)
+            self.held_rows.extend(claimed_rows)
+        row = next((row for row in self.held_rows if row.get('id') not in self.plans), None)
+        if row is None:
+            return False
+        try:
+            with runbot_metrics.get_metrics().phase('prefetch'):
+                self.plans[row.get('id')] = runbot_library.prepare_request(row, echo=False)
+        except Exception as e:
+            logwarning(f"{script_arrow} Could not prepare request {row.get('id')} ahead of time; its worker will. Exception: {e}")
+            self.plans[row.get('id')] = None
+        return True
+
+
+    def __harvest(self, done):
+        for future in done:
+            row = self.in_flight.pop(future)
+            try:
+                pid, runbot_id, final_status_cd, elapsed = future.result()
+            except BrokenProcessPool:
+                self.lost_rows.append(row)
+                continue
+            except Exception as e:
+                logerr(f"{script_arrow} Request {row.get('id')} raised in worker: {e}")
+                continue
+            self.stats.record(pid, final_status_cd, elapsed)
+            logmsg(f"{script_arrow} Request {runbot_id} finished in {elapsed:.1f}s with status '{final_status_cd}'")
+
+
+    def __release_lost_rows(self):
+        for row in self.lost_rows:
+            if runbot_library.release_row(row.get('id')):
+                logmsg(f"{script_arrow} Released request {row.get('id')}, lost before it started, back to 'NEW'")
+            else:
+                # Already started: its lease is no longer renewed, so if it never finished RECLAIM returns it to 'NEW'
+                logwarning(f"{script_arrow} Request {row.get('id')} was lost with its worker; "
+                           "if it did not finish, it is reclaimed when its lease expires")
+        self.lost_rows = []
+
+
+    def __start_pool(self):
+        pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('fork'))
+        # A fork pool launches every worker on its first submit; do that while no other thread of this process is running,
+        # so no worker inherits a lock held by the outbox drainer
+        pool.submit(os.getpid).result()
+        return pool
+
+
+    def __rebuild_pool(self, pool, outbox):
+        """
+        A dead worker breaks the pool and every in-flight job with it: gives their rows back and forks new workers
+        OUTPUT: the new ProcessPoolExecutor
+        """
+        pool.shutdown(wait=True)
+        # Every future is settled now; jobs that finished before the break keep their result
+        self.__harvest(list(self.in_flight))
+        logerr(f"{script_arrow} A worker process died; {len(self.lost_rows)} in-flight job(s) lost. Restarting the pool")
+        self.__release_lost_rows()
+        outbox.stop(flush_timeout=0)
+        pool = self.__start_pool()
+        outbox.start()
+        return pool
+
+
+    def __release_held_rows(self):
+        for row in self.held_rows:
+            plan = self.plans.pop(row.get('id'), None)
+            if plan:
+                plan.discard()
+            logmsg(f"{script_arrow} Releasing held request {row.get('id')} back to 'NEW'")
+            if not runbot_library.release_row(row.get('id')):
+                logerr(f"{script_arrow} Failed to release request {row.get('id')}; it will remain 'QUEUED'")
+        self.held_rows = []
+
+
+    def run(self):
+        """
+        MAIN METHOD - claims and executes rows until signalled to stop
+        """
+        signal.signal(signal.SIGTERM, self.__handle_signal)
+        signal.signal(signal.SIGINT, self.__handle_signal)
+        logmsg(f"{script_arrow} RunBot daemon starting (pid {os.getpid()}): max_workers={self.max_workers}, "
+               f"job_type_limits={self.job_type_limits or 'none'}")
+
+        runbot_metrics.start_run(role='daemon')
+        pool = self.__start_pool()
+        # Workers only enqueue Jira updates; this process delivers them
+        outbox = runbot_jira_outbox.get_outbox().start()
+        try:
+            while not self.is_stopping:
+                self.__sync_jira_if_due()
+                self.__renew_leases_if_due()
+                try:
+                    submitted = self.__submit_available(pool)
+                except BrokenProcessPool:
+                    pool = self.__rebuild_pool(pool, outbox)
+                    continue
+                if self.is_stopping:
+                    break
+                prefetched = self.__prefetch()
+                # Wake up as soon as a slot frees; poll slowly only when the queue looks empty
+                timeout = 1 if submitted or prefetched else self.poll_interval
+                if self.in_flight:
+                    done, _ = wait(self.in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                    self.__harvest(done)
+                    if self.lost_rows:
+                        pool = self.__rebuild_pool(pool, outbox)
+                else:
+                    self.__sleep(timeout)
+
+            self.__release_held_rows()
+            while self.in_flight:
+                done, _ = wait(self.in_flight, timeout=self.lease_seconds / 3)
+                self.__harvest(done)
+                self.__renew_leases_if_due()
+            self.__release_lost_rows()
+        finally:
+            pool.shutdown(wait=True)
+            outbox.stop(flush_timeout=60)
+            self.stats.report()
+            runbot_db.get_session().report()
+            runbot_metrics.get_metrics().finish('DAEMON')
+        logsuccess(f"{script_arrow} RunBot daemon stopped")
+
+
+    def __sleep(self, seconds):
+        deadline = time.monotonic() + seconds
+        while not self.is_stopping and time.monotonic() < deadline:
+            time.sleep(min(1, deadline - time.monotonic()))
@@ -0,0 +1,297 @@
+""" Purpose: Persistent database session with parameterized statements and per-query accounting for RunBot """
+#!/bin/env python3
+
+########################################################################
+# One DbSession per process holds a connection per thread for the     #
+# whole run (or daemon lifetime), so lease renewal, heartbeats and the #
+# outbox drainer never share the main thread's connection or its open  #
+# transaction. Statements take '?' parameters and are executed on a    #
+# cursor cached per SQL text, so the driver prepares each statement    #
+# once. Every call is counted and timed by label.                      #
+#   - DbSession:   DB-API 2.0 connection (pyodbc in prod, sqlite3 in   #
+#                  tests)                                              #
+#   - CsDbSession: fallback through cs_db.DataBase when pyodbc is not  #
+#                  installed; parameters are bound as escaped literals #
+########################################################################
+
+import os
+import time
+import datetime
+import threading
+import contextlib
+
+import cs_db
+from cs_environment import get_mssql_instance
+from cs_logging import logmsg
+
+try:
+    import pyodbc
+except ImportError:
+    pyodbc = None
+
+script_arrow = str(os.path.basename(__file__)) + " ->"
+
+_session = None
+_session_pid = None
+
+
+def mssql_connection_string():
+    """
+    OUTPUT: ODBC connection string (str) for the current MSSQL instance
+    """
+    return (f"DRIVER={{{os.getenv('RUNBOT_ODBC_DRIVER', 'ODBC Driver 17 for SQL Server')}}};"
+            f"SERVER={get_mssql_instance()};DATABASE=MIS_Reports;Trusted_Connection=yes")
+
+
+def get_session():
+    """
+    OUTPUT: this process's DbSession (a forked worker opens its own connection)
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        if pyodbc is not None:
+            _session = DbSession(lambda: pyodbc.connect(mssql_connection_string(), autocommit=True))
+        else:
+            _session = CsDbSession()
+        _session_pid = os.getpid()
+    return _session
+
+
+def set_session(session):
+    """
+    INPUT: session (DbSession), e.g. DbSession(lambda: sqlite3.connect(path)) for local testing
+    """
+    global _session, _session_pid
+    _session, _session_pid = session, os.getpid()
+
+
+class DbSession:
+    """
+    Lazily connects on first use in each thread and keeps the connections open until close().
+    Connections, cached cursors and transaction state are per thread (pyodbc connections are not thread-safe)
+    """
+    is_native = True
+
+    def __init__(self, connect) -> None:
+        self.connect = connect
+        self.stats = {}   # label -> {'calls', 'seconds'}
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        self.__connections = [] # every thread's connection, for close()
+
+
+    @property
+    def conn(self):
+        """ OUTPUT: the calling thread's connection, or None if it has not connected yet """
+        return getattr(self.__local, 'conn', None)
+
+
+    @property
+    def __cursors(self):
+        if not hasattr(self.__local, 'cursors'):
+            self.__local.cursors = {}
+        return self.__local.cursors
+
+
+    @property
+    def __in_transaction(self):
+        return getattr(self.__local, 'in_transaction', False)
+
+
+    def __connection(self):
+        if self.conn is None:
+            self.__local.conn = self.connect()
+            with self.__lock:
+                self.__connections.append(self.__local.conn)
+        return self.conn
+
+
+    def __cursor(self, sql):
+        # Re-executing the same SQL text on the same cursor lets the driver reuse the prepared statement
+        cursor = self.__cursors.get(sql)
+        if cursor is None:
+            cursor = self.__cursors[sql] = self.__connection().cursor()
+        return cursor
+
+
+    def _record(self, label, start):
+        with self.__lock:
+            stats = self.stats.setdefault(label, {'calls': 0, 'seconds': 0.0})
+            stats['calls'] += 1
+            stats['seconds'] += time.monotonic() - start
+
+
+    def query(self, sql, params=(), label=None):
+        """
+        INPUT: sql (str) with '?' placeholders, params (sequence), label (str, optional) for accounting
+        OUTPUT: list of row dicts from the first result set that returns rows
+        """
+        start = time.monotonic()
+        try:
+            cursor = self.__cursor(sql)
+            cursor.execute(sql, tuple(params))
+            # Skip rowcount-only results (e.g. UPDATE inside a sproc) to reach the SELECT
+            while cursor.description is None:
+                if not hasattr(cursor, 'nextset') or not cursor.nextset():
+                    return []
+            columns = [col[0] for col in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        finally:
+            self._record(label or sql.split()[0].upper(), start)
+            self.__autocommit()
+
+
+    def execute(self, sql, params=(), label=None):
+        """
+        OUTPUT: rowcount (int) of the statement
+        """
+        start = time.monotonic()
+        try:
+            cursor = self.__cursor(sql)
+            cursor.execute(sql, tuple(params))
+            return cursor.rowcount
+        finally:
+            self._record(label or sql.split()[0].upper(), start)
+            self.__autocommit()
+
+
+    def executemany(self, sql, seq_of_params, label=None):
+        start = time.monotonic()
+        try:
+            cursor = self.__cursor(sql)
+            if pyodbc is not None and isinstance(self.conn, pyodbc.Connection):
+                cursor.fast_executemany = True
+            cursor.executemany(sql, [tuple(p) for p in seq_of_params])
+            return cursor.rowcount
+        finally:
+            self._record(label or sql.split()[0].upper(), start)
+            self.__autocommit()
+
+
+    def __autocommit(self):
+        # sqlite3 and other drivers without autocommit need an explicit commit outside transaction()
+        if not self.__in_transaction and self.conn is not None and getattr(self.conn, 'autocommit', None) is not True:
+            self.conn.commit()
+
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Groups every statement in the block into one transaction; rolls back on exception
+        """
+        if self.__in_transaction:
+            yield self
+            return
+        conn = self.__connection()
+        has_autocommit = getattr(conn, 'autocommit', None) is True
+        if has_autocommit:
+            conn.autocommit = False
+        self.__local.in_transaction = True
+        try:
+            yield self
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.__local.in_transaction = False
+            if has_autocommit:
+                conn.autocommit = True
+
+
+    def report(self):
+        """
+        Logs round trips and time per query label
+        """
+        if not self.stats:
+            return
+        total_calls = sum(s['calls'] for s in self.stats.values())
+        total_seconds = sum(s['seconds'] for s in self.stats.values())
+        logmsg(f"{script_arrow} {total_calls} database round trip(s), {total_seconds:.2f}s total")
+        for label, s in sorted(self.stats.items(), key=lambda item: -item[1]['seconds']):
+            logmsg(f"{script_arrow}   {label}: {s['calls']} call(s), {s['seconds']:.3f}s")
+
+
+    def close(self):
+        """
+        Closes every thread's connection; call once the background threads using this session have stopped
+        """
+        for cursor in self.__cursors.values():
+            with contextlib.suppress(Exception):
+                cursor.close()
+        self.__local = threading.local()
+        with self.__lock:
+            connections, self.__connections = self.__connections, []
+        for conn in connections:
+            with contextlib.suppress(Exception):
+                conn.close()
+
+
+def to_sql_literal(value):
+    """
+    INPUT: value (None, bool, int, float, datetime or str)
+    OUTPUT: T-SQL literal (str); strings are N-quoted with embedded quotes doubled
+    """
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return "'{}'".format(value.isoformat(sep=' ') if isinstance(value, datetime.datetime) else value.isoformat())
+    return "N'{}'".format(str(value).replace("'", "''"))
+
+
+def bind_params(sql, params):
+    """
+    INPUT: sql (str) with '?' placeholders, params (sequence)
+    OUTPUT: sql (str) with each placeholder replaced by an escaped literal
+    """
+    pieces = sql.split('?')
+    if len(pieces) - 1 != len(params):
+        raise ValueError(f"Statement has {len(pieces) - 1} placeholder(s) but {len(params)} parameter(s) were given")
+    return pieces[0] + "".join(to_sql_literal(p) + piece for p, piece in zip(params, pieces[1:]))
+
+
+class CsDbSession(DbSession):
+    """
+    Fallback when pyodbc is unavailable: same API, executed through cs_db.DataBase with escaped literals.
+    transaction() cannot span cs_db calls, so statements in it run one by one; execute() raises when cs_db reports a failed
+    update, so a failure still stops the statements after it
+    """
+    is_native = False
+
+    def __init__(self) -> None:
+        super().__init__(connect=None)
+
+
+    def query(self, sql, params=(), label=None):
+        start = time.monotonic()
+        try:
+            return cs_db.DataBase.mssql_query(bind_params(sql, params)) or []
+        finally:
+            self._record(label or sql.split()[0].upper(), start)
+
+
+    def execute(self, sql, params=(), label=None):
+        start = time.monotonic()
+        try:
+            if not cs_db.DataBase.mssql_update(bind_params(sql, params)):
+                raise RuntimeError(f"cs_db.DataBase.mssql_update failed: {sql.split(';')[0].strip()}")
+            return 1
+        finally:
+            self._record(label or sql.split()[0].upper(), start)
+
+
+    def executemany(self, sql, seq_of_params, label=None):
+        return sum(self.execute(sql, params, label) for params in seq_of_params)
+
+
+    @contextlib.contextmanager
+    def transaction(self):
+        yield self
+
+
+    def close(self):
+        return
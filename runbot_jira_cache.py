@@ -0,0 +1,238 @@
+""" Purpose: Local cache of Jira issue metadata with incremental "updated since" refresh """
+#!/bin/env python3
+
+########################################################################
+# Issue statuses and key validity are kept in a local SQLite file so   #
+# each tick only asks Jira about what changed:                         #
+#   - issues never seen before, or older than their TTL, are fetched   #
+#     by key (query_multiple_issues)                                   #
+#   - everything else is refreshed with paged 'key in (...)' searches #
+#     for issues updated since the last complete sync (the watermark)  #
+#   - RunBot's own status changes invalidate the entry (event based)   #
+# The searches need JiraRequest.search_issues(jql, start_at,           #
+# max_results), which the installed cs_jira_requests does not have     #
+# yet. Without it every sync fetches every open story by key, as       #
+# before this cache; only key validity is cached.                      #
+########################################################################
+
+import os
+import math
+import time
+import sqlite3
+import contextlib
+
+import runbot_metrics
+from cs_logging import logmsg, logwarning
+
+script_arrow = str(os.path.basename(__file__)) + " ->"
+
+DEFAULT_CACHE_PATH = os.getenv('RUNBOT_JIRA_CACHE_DB', os.path.expanduser("~/.runbot/jira_cache.db"))
+STATUS_TTL_SECONDS = int(os.getenv('RUNBOT_JIRA_STATUS_TTL_SECONDS', 3600))             # safety net behind the watermark search
+UNTRACKED_STATUS_TTL_SECONDS = int(os.getenv('RUNBOT_JIRA_UNTRACKED_TTL_SECONDS', 60))  # while the 'updated' search is failing
+VALID_KEY_TTL_SECONDS = 7 * 24 * 3600
+WATERMARK_OVERLAP_SECONDS = 120 # JQL 'updated' has minute granularity; also absorbs clock skew with the Jira server
+JQL_KEYS_PER_SEARCH = 100       # keeps each 'key in (...)' JQL well under the request URL limit
+JQL_PAGE_SIZE = 100
+
+_cache = None
+_cache_pid = None
+_warned_untracked = False
+
+
+def get_issue_cache(db_path=None):
+    """
+    OUTPUT: this process's IssueCache (a forked worker gets its own instance)
+    """
+    global _cache, _cache_pid
+    if _cache is None or _cache_pid != os.getpid():
+        _cache, _cache_pid = IssueCache(db_path or DEFAULT_CACHE_PATH), os.getpid()
+    return _cache
+
+
+def _issue_statuses(response):
+    """
+    INPUT: response (dict) shaped like the Jira search response ({'result': {'issues': [...]}})
+    OUTPUT: dict of issue key -> status name
+    """
+    return {issue["key"]: issue["fields"]["status"]["name"] for issue in response["result"]["issues"]}
+
+
+class IssueCache:
+    """
+    get_statuses() answers from the cache and refreshes only what may have changed; invalidate() is called
+    whenever RunBot itself changes an issue
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS JIRA_ISSUE_CACHE_T (
+            ISSUE_ID            TEXT PRIMARY KEY,
+            STATUS_TX           TEXT,
+            STATUS_FETCHED_TS   REAL,
+            IS_VALID            INTEGER,
+            VALID_FETCHED_TS    REAL
+        );
+        CREATE TABLE IF NOT EXISTS JIRA_CACHE_STATE_T (
+            NAME                TEXT PRIMARY KEY,
+            VALUE_TS            REAL NOT NULL
+        );
+        """
+
+    def __init__(self, db_path=DEFAULT_CACHE_PATH) -> None:
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self.__connect() as conn:
+            conn.executescript(self.SCHEMA)
+
+
+    def __connect(self):
+        # Short-lived connections, as in the Jira outbox, so the cache is safe across forked workers
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return contextlib.closing(conn)
+
+
+    def get_watermark(self):
+        with self.__connect() as conn:
+            row = conn.execute("SELECT VALUE_TS FROM JIRA_CACHE_STATE_T WHERE NAME = 'STATUS_WATERMARK'").fetchone()
+        return row[0] if row else None
+
+
+    def __set_watermark(self, value_ts):
+        with self.__connect() as conn:
+            conn.execute("INSERT INTO JIRA_CACHE_STATE_T (NAME, VALUE_TS) VALUES ('STATUS_WATERMARK', ?) "
+                         "ON CONFLICT (NAME) DO UPDATE SET VALUE_TS = excluded.VALUE_TS", (value_ts,))
+
+
+    def __put_statuses(self, statuses, fetched_ts):
+        if not statuses:
+            return
+        with self.__connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("INSERT INTO JIRA_ISSUE_CACHE_T (ISSUE_ID, STATUS_TX, STATUS_FETCHED_TS) VALUES (?, ?, ?) "
+                             "ON CONFLICT (ISSUE_ID) DO UPDATE SET STATUS_TX = excluded.STATUS_TX, "
+                             "STATUS_FETCHED_TS = excluded.STATUS_FETCHED_TS",
+                             [(key, status, fetched_ts) for key, status in statuses.items()])
+            conn.execute("COMMIT")
+
+
+    def invalidate(self, issue_ids):
+        """
+        INPUT: issue_ids (iterable of str) whose Jira status RunBot just changed; the next lookup asks Jira
+        """
+        issue_ids = list(issue_ids)
+        if not issue_ids:
+            return
+        with self.__connect() as conn:
+            conn.execute("UPDATE JIRA_ISSUE_CACHE_T SET STATUS_FETCHED_TS = NULL WHERE ISSUE_ID IN ({})".format(
+                ", ".join("?" for _ in issue_ids)), issue_ids)
+
+
+    def is_valid_issue_key(self, jira, issue_id):
+        """
+        INPUT: jira (JiraRequest), issue_id (str)
+        OUTPUT: is_valid (Boolean); a key Jira confirmed is trusted for VALID_KEY_TTL_SECONDS, invalid keys are never cached
+        """
+        metrics = runbot_metrics.get_metrics()
+        with self.__connect() as conn:
+            row = conn.execute("SELECT IS_VALID, VALID_FETCHED_TS FROM JIRA_ISSUE_CACHE_T WHERE ISSUE_ID = ?", (issue_id,)).fetchone()
+        if row and row[0] and row[1] and row[1] > time.time() - VALID_KEY_TTL_SECONDS:
+            metrics.observe('jira_cache', 'is_valid_issue_key', 0.0)
+            return True
+        with metrics.timed_call('jira', 'is_valid_issue_key'):
+            is_valid = jira.is_valid_issue_key(issue_id)
+        if is_valid:
+            with self.__connect() as conn:
+                conn.execute("INSERT INTO JIRA_ISSUE_CACHE_T (ISSUE_ID, IS_VALID, VALID_FETCHED_TS) VALUES (?, 1, ?) "
+                             "ON CONFLICT (ISSUE_ID) DO UPDATE SET IS_VALID = 1, VALID_FETCHED_TS = excluded.VALID_FETCHED_TS",
+                             (issue_id, time.time()))
+        return is_valid
+
+
+    def __fetch_by_key(self, jira, issue_ids):
+        with runbot_metrics.get_metrics().timed_call('jira', 'query_multiple_issues'):
+            return _issue_statuses(jira.query_multiple_issues(",".join(issue_ids)))
+
+
+    def __search_all_pages(self, search_issues, jql):
+        """
+        OUTPUT: statuses (dict) of every issue matching jql, following startAt/maxResults until the result is exhausted
+        """
+        statuses, start_at = {}, 0
+        while True:
+            with runbot_metrics.get_metrics().timed_call('jira', 'search_issues'):
+                response = search_issues(jql, start_at=start_at, max_results=JQL_PAGE_SIZE)
+            page = _issue_statuses(response)
+            statuses.update(page)
+            start_at += len(page)
+            total = response["result"].get("total")
+            if not page or (start_at >= total if total is not None else len(page) < JQL_PAGE_SIZE):
+                return statuses
+
+
+    def __fetch_updated_since(self, jira, issue_ids, since_ts):
+        """
+        OUTPUT: statuses (dict) of the issues among issue_ids updated since since_ts;
+                raises if any search fails, so a partial result is never taken for a complete one
+        """
+        # A relative "-Nm" is evaluated on the Jira server's clock, so neither side's time zone matters
+        minutes = max(1, math.ceil((time.time() - since_ts) / 60))
+        keys = sorted(issue_ids)
+        statuses = {}
+        for i in range(0, len(keys), JQL_KEYS_PER_SEARCH):
+            jql = 'key in ({}) AND updated >= "-{}m"'.format(", ".join(keys[i:i + JQL_KEYS_PER_SEARCH]), minutes)
+            statuses.update(self.__search_all_pages(jira.search_issues, jql))
+        return statuses
+
+
+    def get_statuses(self, jira, issue_ids, force=False):
+        """
+        INPUT: jira (JiraRequest), issue_ids (iterable of str), force (Boolean) to ask Jira about every issue
+        OUTPUT: dict of issue key -> current Jira status; issues Jira returned nothing for are left out
+        """
+        global _warned_untracked
+        issue_ids = list(dict.fromkeys(issue_ids))
+        if not issue_ids:
+            return {}
+        if not hasattr(jira, 'search_issues'):
+            # Without an 'updated' search a cached status cannot be trusted past the next tick; ask Jira about every issue
+            if not _warned_untracked:
+                logwarning(f"{script_arrow} JiraRequest has no search_issues(); Jira statuses are fetched by key on every sync")
+                _warned_untracked = True
+            statuses = self.__fetch_by_key(jira, issue_ids)
+            return {key: statuses[key] for key in issue_ids if statuses.get(key) is not None}
+        started_ts = time.time()
+        with self.__connect() as conn:
+            cached = {key: (status, fetched_ts) for key, status, fetched_ts in conn.execute(
+                "SELECT ISSUE_ID, STATUS_TX, STATUS_FETCHED_TS FROM JIRA_ISSUE_CACHE_T WHERE ISSUE_ID IN ({})".format(
+                    ", ".join("?" for _ in issue_ids)), issue_ids)}
+        statuses = {key: status for key, (status, fetched_ts) in cached.items() if fetched_ts is not None}
+
+        watermark = None if force else self.get_watermark()
+        updated = {}
+        if watermark is not None and statuses:
+            try:
+                updated = self.__fetch_updated_since(jira, set(statuses), watermark - WATERMARK_OVERLAP_SECONDS)
+            except Exception as e:
+                updated = None
+                logwarning(f"{script_arrow} Jira 'updated since' search failed; falling back to TTL refresh. Exception: {e}")
+        is_tracked = watermark is not None and updated is not None
+        if updated:
+            self.__put_statuses(updated, started_ts)
+            statuses.update(updated)
+        updated = updated or {}
+
+        ttl = STATUS_TTL_SECONDS if is_tracked else UNTRACKED_STATUS_TTL_SECONDS
+        to_fetch = issue_ids if force else [key for key in issue_ids if key not in updated
+                                            and (cached.get(key, (None, None))[1] or 0) < started_ts - ttl]
+        if to_fetch:
+            fetched = self.__fetch_by_key(jira, to_fetch)
+            self.__put_statuses(fetched, started_ts)
+            statuses.update(fetched)
+        if not force and (is_tracked or len(to_fetch) == len(issue_ids)):
+            # Only reached when every search page and by-key fetch succeeded: every status is now at least as new as started_ts
+            self.__set_watermark(started_ts)
+
+        from_cache = len(issue_ids) - len(to_fetch) - len(updated)
+        logmsg(f"{script_arrow} Jira status for {len(issue_ids)} issue(s): {len(to_fetch)} fetched by key, "
+               f"{len(updated)} changed since the last sync, {from_cache} from cache")
+        return {key: statuses[key] for key in issue_ids if statuses.get(key) is not None}
@@ -0,0 +1,321 @@
+""" Purpose: Persistent, coalescing outbox for RunBot's Jira side effects """
+#!/bin/env python3
+
+########################################################################
+# Jira updates (comments, status changes, assignment) are written to a #
+# local SQLite outbox and delivered by a background drainer with      #
+# retries and exponential backoff, so job execution never waits on    #
+# Jira. Undelivered entries survive restarts and are picked up by the  #
+# next drainer. Consecutive comments for one issue are merged. The    #
+# drainer prunes SENT entries after SENT_RETENTION_DAYS and DEAD ones  #
+# (kept longer, for inspection) after DEAD_RETENTION_DAYS.             #
+########################################################################
+
+import os
+import json
+import time
+import random
+import sqlite3
+import threading
+
+import cs_jira_requests
+import runbot_metrics
+import runbot_jira_cache
+from cs_logging import logmsg, logerr, logwarning
+
+script_arrow = str(os.path.basename(__file__)) + " ->"
+
+DEFAULT_OUTBOX_PATH = os.getenv('RUNBOT_OUTBOX_DB', os.path.expanduser("~/.runbot/jira_outbox.db"))
+ACTIONS = ('add_comment', 'update_story_status', 'assign_story_to_user', 'sync_status')
+COMMENT_SEPARATOR = "\n\n"
+SENT_RETENTION_DAYS = float(os.getenv('RUNBOT_OUTBOX_SENT_RETENTION_DAYS', 7))
+DEAD_RETENTION_DAYS = float(os.getenv('RUNBOT_OUTBOX_DEAD_RETENTION_DAYS', 30))
+PRUNE_INTERVAL_SECONDS = 3600
+
+_outbox = None
+_outbox_pid = None
+
+
+def get_outbox(db_path=None):
+    """
+    OUTPUT: this process's JiraOutbox (a forked worker gets its own instance; the drainer is not started)
+    """
+    global _outbox, _outbox_pid
+    if _outbox is None or _outbox_pid != os.getpid():
+        _outbox, _outbox_pid = JiraOutbox(db_path or DEFAULT_OUTBOX_PATH), os.getpid()
+    return _outbox
+
+
+class JiraOutbox:
+    """
+    enqueue()/enqueue_many() only write to the local outbox. start() runs a background drainer in this
+    process; flush() drains synchronously until nothing is due or the timeout expires
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS JIRA_OUTBOX_T (
+            ID                INTEGER PRIMARY KEY AUTOINCREMENT,
+            ISSUE_ID          TEXT NOT NULL,
+            ACTION            TEXT NOT NULL,
+            ARGS_TX           TEXT,
+            STATUS_CD         TEXT NOT NULL DEFAULT 'PENDING',
+            ATTEMPTS          INTEGER NOT NULL DEFAULT 0,
+            NEXT_ATTEMPT_TS   REAL NOT NULL DEFAULT 0,
+            LEASE_EXPIRY_TS   REAL,
+            LAST_ERROR_TX     TEXT,
+            CREATED_TS        REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS JIRA_OUTBOX_STATUS_IX ON JIRA_OUTBOX_T (STATUS_CD, ISSUE_ID, ID);
+        """
+
+    def __init__(self, db_path=DEFAULT_OUTBOX_PATH, jira=None, max_attempts=8, base_backoff=5, max_backoff=600,
+                 poll_interval=5, lease_seconds=120) -> None:
+        self.db_path = db_path
+        self.jira = jira
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.__wakeup = threading.Event()
+        self.__stop = threading.Event()
+        self.__thread = None
+        self.__last_prune = None
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self.__connect() as conn:
+            conn.executescript(self.SCHEMA)
+
+
+    def __connect(self):
+        # Short-lived connections keep the outbox safe to use from forked workers and the drainer thread
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return _ClosingConnection(conn)
+
+
+    def enqueue(self, issue_id, action, *args):
+        """
+        INPUT: issue_id (str), action (one of ACTIONS), args for the matching JiraRequest method
+        """
+        self.enqueue_many([(issue_id, action, *args)])
+
+
+    def enqueue_many(self, entries):
+        """
+        INPUT: entries (list of tuples), each (issue_id, action, *args)
+               - Written in one transaction, so comments queued together are always merged on delivery
+        """
+        now = time.time()
+        rows = []
+        for issue_id, action, *args in entries:
+            if action not in ACTIONS:
+                raise ValueError(f"Unknown Jira outbox action '{action}'")
+            if not issue_id:
+                continue
+            rows.append((issue_id, action, json.dumps(args), now))
+        if not rows:
+            return
+        with self.__connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("INSERT INTO JIRA_OUTBOX_T (ISSUE_ID, ACTION, ARGS_TX, CREATED_TS) VALUES (?, ?, ?, ?)", rows)
+            conn.execute("COMMIT")
+        self.__wakeup.set()
+
+
+    def pending_count(self):
+        with self.__connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM JIRA_OUTBOX_T WHERE STATUS_CD IN ('PENDING', 'SENDING')").fetchone()[0]
+
+
+    def __claim_due(self):
+        """
+        Leases the deliverable prefix of each issue's queue. Entries behind a not-yet-due or in-flight entry
+        for the same issue wait, so per-issue ordering (BEGIN comment before status change, etc.) is kept
+        OUTPUT: dict of issue_id -> list of (id, action, args)
+        """
+        now = time.time()
+        with self.__connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT ID, ISSUE_ID, ACTION, ARGS_TX, STATUS_CD, NEXT_ATTEMPT_TS, LEASE_EXPIRY_TS FROM JIRA_OUTBOX_T "
+                "WHERE STATUS_CD IN ('PENDING', 'SENDING') ORDER BY ISSUE_ID, ID").fetchall()
+            claimed, blocked = {}, set()
+            for id, issue_id, action, args_tx, status_cd, next_attempt_ts, lease_expiry_ts in rows:
+                if issue_id in blocked:
+                    continue
+                in_flight = status_cd == 'SENDING' and (lease_expiry_ts or 0) > now
+                if in_flight or next_attempt_ts > now:
+                    blocked.add(issue_id)
+                    continue
+                claimed.setdefault(issue_id, []).append((id, action, json.loads(args_tx or "[]")))
+            ids = [entry[0] for entries in claimed.values() for entry in entries]
+            if ids:
+                conn.execute("UPDATE JIRA_OUTBOX_T SET STATUS_CD = 'SENDING', LEASE_EXPIRY_TS = ? WHERE ID IN ({})".format(
+                    ", ".join("?" for _ in ids)), (now + self.lease_seconds, *ids))
+            conn.execute("COMMIT")
+        return claimed
+
+
+    @staticmethod
+    def coalesce(entries):
+        """
+        INPUT: entries (list of (id, action, args)) for a single issue, in queue order
+        OUTPUT: list of (ids, action, args); consecutive add_comment entries are merged into one comment
+        """
+        batches = []
+        for id, action, args in entries:
+            if action == 'add_comment' and batches and batches[-1][1] == 'add_comment':
+                prev_ids, _, prev_args = batches[-1]
+                batches[-1] = (prev_ids + [id], action, [prev_args[0] + COMMENT_SEPARATOR + args[0]])
+            else:
+                batches.append(([id], action, list(args)))
+        return batches
+
+
+    def __deliver(self, issue_id, action, args):
+        if self.jira is None:
+            self.jira = cs_jira_requests.JiraRequest()
+        if action == 'sync_status':
+            import runbot_library
+            runbot_library.sync_jira_status_for_outstanding_requests(issue_id)
+            return
+        with runbot_metrics.get_metrics().timed_call('jira', action):
+            result = getattr(self.jira, action)(issue_id, *args)
+        if action == 'update_story_status':
+            runbot_jira_cache.get_issue_cache().invalidate([issue_id])
+        if result is False:
+            raise RuntimeError(f"JiraRequest.{action}() returned False")
+
+
+    def __mark_sent(self, conn, ids):
+        conn.execute("UPDATE JIRA_OUTBOX_T SET STATUS_CD = 'SENT', LEASE_EXPIRY_TS = NULL WHERE ID IN ({})".format(
+            ", ".join("?" for _ in ids)), ids)
+
+
+    def __mark_failed(self, conn, ids, error):
+        attempts = conn.execute("SELECT MAX(ATTEMPTS) FROM JIRA_OUTBOX_T WHERE ID IN ({})".format(
+            ", ".join("?" for _ in ids)), ids).fetchone()[0] + 1
+        if attempts >= self.max_attempts:
+            status_cd, next_attempt_ts = 'DEAD', 0
+        else:
+            status_cd = 'PENDING'
+            next_attempt_ts = time.time() + min(self.max_backoff, self.base_backoff * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+        conn.execute("UPDATE JIRA_OUTBOX_T SET STATUS_CD = ?, ATTEMPTS = ?, NEXT_ATTEMPT_TS = ?, LEASE_EXPIRY_TS = NULL, "
+                     "LAST_ERROR_TX = ? WHERE ID IN ({})".format(", ".join("?" for _ in ids)),
+                     (status_cd, attempts, next_attempt_ts, str(error)[:2000], *ids))
+        return status_cd, attempts
+
+
+    def drain_once(self):
+        """
+        Delivers everything currently due
+        OUTPUT: (delivered, failed) counts of Jira calls made
+        """
+        delivered, failed = 0, 0
+        for issue_id, entries in self.__claim_due().items():
+            for position, (ids, action, args) in enumerate(self.coalesce(entries)):
+                try:
+                    self.__deliver(issue_id, action, args)
+                except Exception as e:
+                    failed += 1
+                    # Keep per-issue order: this batch and everything after it for the issue retries together
+                    remaining = [id for batch_ids, _, _ in self.coalesce(entries)[position:] for id in batch_ids]
+                    with self.__connect() as conn:
+                        status_cd, attempts = self.__mark_failed(conn, remaining, e)
+                    if status_cd == 'DEAD':
+                        logerr(f"{script_arrow} Giving up on Jira {action} for {issue_id} after {attempts} attempts: {e}")
+                    else:
+                        logwarning(f"{script_arrow} Jira {action} for {issue_id} failed (attempt {attempts}); will retry. Exception: {e}")
+                    break
+                with self.__connect() as conn:
+                    self.__mark_sent(conn, ids)
+                delivered += 1
+        return delivered, failed
+
+
+    def prune(self):
+        """
+        Deletes SENT entries older than SENT_RETENTION_DAYS and DEAD entries older than DEAD_RETENTION_DAYS
+        OUTPUT: number of entries deleted
+        """
+        now = time.time()
+        with self.__connect() as conn:
+            deleted = conn.execute("DELETE FROM JIRA_OUTBOX_T WHERE (STATUS_CD = 'SENT' AND CREATED_TS < ?) "
+                                   "OR (STATUS_CD = 'DEAD' AND CREATED_TS < ?)",
+                                   (now - SENT_RETENTION_DAYS * 86400, now - DEAD_RETENTION_DAYS * 86400)).rowcount
+        if deleted:
+            logmsg(f"{script_arrow} Pruned {deleted} delivered or abandoned Jira update(s) from {self.db_path}")
+        return deleted
+
+
+    def __prune_if_due(self):
+        if self.__last_prune is not None and time.monotonic() - self.__last_prune < PRUNE_INTERVAL_SECONDS:
+            return
+        self.__last_prune = time.monotonic()
+        self.prune()
+
+
+    def flush(self, timeout=60):
+        """
+        Drains synchronously until nothing deliverable is left or the timeout expires
+        OUTPUT: number of entries still pending (delivered later by the next drainer)
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            delivered, failed = self.drain_once()
+            if not delivered and not failed:
+                break
+        remaining = self.pending_count()
+        if remaining:
+            logwarning(f"{script_arrow} {remaining} Jira update(s) still pending in {self.db_path}; they will be retried by the next run")
+        return remaining
+
+
+    def __drain_loop(self):
+        while not self.__stop.is_set():
+            try:
+                self.drain_once()
+                self.__prune_if_due()
+            except Exception as e:
+                logwarning(f"{script_arrow} Jira outbox drain failed; retrying. Exception: {e}")
+            self.__wakeup.wait(self.poll_interval)
+            self.__wakeup.clear()
+
+
+    def start(self):
+        """
+        Starts the background drainer thread in this process
+        """
+        if self.__thread and self.__thread.is_alive():
+            return self
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__drain_loop, name="jira-outbox", daemon=True)
+        self.__thread.start()
+        return self
+
+
+    def stop(self, flush_timeout=60):
+        """
+        Stops the drainer, then delivers whatever is still due within flush_timeout
+        OUTPUT: number of entries still pending
+        """
+        self.__stop.set()
+        self.__wakeup.set()
+        if self.__thread:
+            self.__thread.join()
+            self.__thread = None
+        return self.flush(flush_timeout)
+
+
+class _ClosingConnection:
+    """
+    sqlite3's own context manager commits but does not close; this one closes
+    """
+    def __init__(self, conn) -> None:
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, *exc):
+        self.conn.close()
@@ -4,38 +4,130 @@
 import os
 import re
 import sys
-import subprocess
 import uuid
-import fileinput
-import shutil
+import random
+import socket
+import threading
+import time
+import heapq
+import hashlib
 
-import cs_db
 import cs_jira_requests
 import unix_utility
+import runbot_queue
+import runbot_log_sink
+import runbot_db
+import runbot_metrics
+import runbot_jira_cache
 from cs_environment import current_user_is_production, get_mssql_instance, is_full_production_run
 from cs_logging import logmsg, logerr, logwarning, logsuccess
 
 script_arrow = str(os.path.basename(__file__)) + " ->"
+DEFAULT_LEASE_SECONDS = 900
+CTL_STEP_CONCURRENCY = int(os.getenv('RUNBOT_CTL_STEP_CONCURRENCY', 4))
+RUNBOT_LOG_DIR = "/NAS/mis/tmp/_runbot/"
+CTL_STEP_TIMEOUT_SECONDS = int(os.getenv('RUNBOT_CTL_STEP_TIMEOUT_SECONDS', 0)) or None # 0: steps may run indefinitely
+# Watchdog: a job is killed once it exceeds its time budget, or produces no output for STALL_TIMEOUT_SECONDS
+JOB_BUDGET_SECONDS = {'RERUN_REPORT': 4 * 3600, 'RELOAD_TABLE': 8 * 3600}
+JOB_BUDGET_SECONDS.update({job_type.strip(): int(seconds) for job_type, _, seconds in  # e.g. RUNBOT_JOB_BUDGETS="RELOAD_TABLE=43200"
+                           (item.partition('=') for item in os.getenv('RUNBOT_JOB_BUDGETS', '').split(',') if '=' in item)})
+DEFAULT_JOB_BUDGET_SECONDS = 6 * 3600
+BUDGET_HISTORY_FACTOR = 3        # budget learned from history: this many times the p90 of past durations
+BUDGET_HISTORY_MIN_SAMPLES = 5
+BUDGET_MIN_SECONDS = 15 * 60
+STALL_TIMEOUT_SECONDS = int(os.getenv('RUNBOT_STALL_TIMEOUT_SECONDS', 2 * 3600)) or None # 0: never kill a silent job
+HEARTBEAT_SECONDS = int(os.getenv('RUNBOT_HEARTBEAT_SECONDS', 60))
+STATUS_LOOKUP_TTL_SECONDS = 3600
+FRIENDLY_STATUS_BY_STATUS_CD = {'NEW': 'Awaiting execution', 'RUNNING': 'Running', 'COMPLETE': 'Done', 'ERROR': 'Failed',
+                                'TIMEOUT': 'Timed out', 'FOLLOWING': 'Combined with an identical request'}
+FRIENDLY_STATUS_BY_JIRA_STATUS = {'Approval Pending': 'Pending manager approval', 'Ready to Implement': 'Awaiting execution'}
+COALESCE_DUPLICATES = os.getenv('RUNBOT_COALESCE_DUPLICATES', '1') != '0'
+CTL_CHECKPOINTS = os.getenv('RUNBOT_CTL_CHECKPOINTS', '0') == '1' # opt-in: splits any setup-then-runjobs CTL into steps
+# Where job logs go is a deployment choice, never a side effect of whether pyodbc imports: '0' keeps the table
+# MIS::Jobs::log_content_to_database writes (and its readers use); '1' writes jobs.RUNBOT_LOG_T/RUNBOT_LOG_CHUNK_T only
+NATIVE_LOG_SINK = os.getenv('RUNBOT_NATIVE_LOG_SINK', '0') == '1'
+RETRY_MAX_ATTEMPTS = int(os.getenv('RUNBOT_RETRY_MAX_ATTEMPTS', 3))
+RETRY_BACKOFF_SECONDS = int(os.getenv('RUNBOT_RETRY_BACKOFF_SECONDS', 60))
+RETRY_BACKOFF_MAX_SECONDS = 900
+ESTIMATE_BASIS_NAMES = {'CMD': "history of this command", 'JOB': "history of this job_nm", 'ARTIFACT': "history of this artifact",
+                        'TYPE': "history of this job_type", 'DEFAULT': "default; no history yet"}
+PER_REQUEST_ARGS_RE = re.compile(r"\s+-(?:request|runbot_id)\s+\S+")
+
+_queue_backend = None
+_owner_token = None
+_log_sink = None
+_status_lookups = None
+
 
 class RunbotCommand:
     """
     RunbotCommand object defaults to is_runjob=True, is_successful=None
     """
-    def __init__(self, command, runbot_id, command_type=None) -> None:
+    def __init__(self, command, runbot_id, command_type=None, start_step_id=None, job_type=None, jira_id=None) -> None:
         self.command = command
         self.runbot_id = runbot_id
         self.type = command_type
-        self.jira_id = os.getenv('WORKING_JIRA_ID')
+        self.jira_id = jira_id or os.getenv('WORKING_JIRA_ID')
         self.is_runjob = True if "runjob" in self.command else False
         self.is_successful = None
+        self.ctl_steps = []
+        self.step_results = []
+        self.output = None # unix_utility.OutputCapture of the executed command
+        self.start_step_id = int(start_step_id) if start_step_id else None # CTL step to (re)start from, from RUNJOB_REQUEST_T
+        self.attempt = 0
+        self.resume = True
+        self.job_type = job_type
+        self.budget_seconds = None
+        self.deadline = None
+        self.timed_out_reason = None # 'BUDGET' or 'STALL' once the watchdog killed the job
+        self.is_prepared = False
+        self.budget_basis = None
+        self.ctl_path = None
+        self.scrubbed_ctl = None
+        self.is_step_graph = False
+        self.original_command = command
+        self.ctl_mtime = None
         
         
+    def __should_retry(self, is_retryable):
+        """
+        Sleeps out the backoff and returns True if a failed attempt should be retried
+        """
+        if not is_retryable or self.attempt >= RETRY_MAX_ATTEMPTS:
+            return False
+        backoff = min(RETRY_BACKOFF_MAX_SECONDS, RETRY_BACKOFF_SECONDS * 2 ** (self.attempt - 1)) * random.uniform(0.8, 1.2)
+        logwarning(f"{script_arrow} Attempt {self.attempt} of {RETRY_MAX_ATTEMPTS} failed with a retryable error; retrying in {backoff:.0f}s")
+        time.sleep(backoff)
+        return True
+
+
+    def __remaining_budget(self):
+        if self.deadline is None:
+            return None
+        return max(1, self.deadline - time.monotonic())
+
+
     def __execute_cmd(self):
-        logmsg(f"{script_arrow} Executing: {self.command}")
-        # run_command_python() returns True if there was a failure
-        if unix_utility.run_command_python(self.command, pipe_output=False):
+        while True:
+            self.attempt += 1
+            logmsg(f"{script_arrow} Executing: {self.command}")
+            watchdog = unix_utility.Watchdog(self.__remaining_budget(), STALL_TIMEOUT_SECONDS)
+            # run_command_streaming() returns True if there was a failure; output is teed to RUNBOT_LOG as it arrives
+            with Heartbeat(self.runbot_id, watchdog.describe):
+                failed, self.output = unix_utility.run_command_streaming(self.command, log_path=os.getenv('RUNBOT_LOG'),
+                                                                         watchdog=watchdog)
+            if self.output.kill_reason:
+                # Running a hung or over-budget job again would only hold the slot longer
+                self.timed_out_reason = self.output.kill_reason
+                break
+            if not failed or not self.__should_retry(unix_utility.is_retryable_failure(
+                    self.output.returncode, [line for _, line in self.output.errors])):
+                break
+        if failed:
             self.is_successful = False
-            if not self.is_runjob:
+            if self.timed_out_reason:
+                logerr(f"{script_arrow} Killed by the watchdog ({self.timed_out_reason}, budget {self.budget_seconds}s): {self.command}")
+            elif not self.is_runjob:
                 # If CTL, log what specific command failed. Commands located in runjobs_list[]
                 logerr(f"{script_arrow} Execution failed on 1 or more steps; check {os.getenv('RUNBOT_LOG')} for details")
             else:
@@ -45,10 +137,10 @@ class RunbotCommand:
             logsuccess(f"{script_arrow} Completed execution of '{self.command}'")
     
     
-    def __format_runjob_cmd(self, run=False):
+    def __format_runjob_cmd(self):
         """
-        INPUT: self.runjob_cmd (str), run (boolean, optional)
-        Function: formats runjob command and optionally executes the command
+        INPUT: self.runjob_cmd (str)
+        Function: formats runjob command
         """
         if current_user_is_production() and "-request" not in self.command:
             if self.is_runjob:
@@ -58,47 +150,228 @@ class RunbotCommand:
             if self.is_runjob:
                 logmsg(f"{script_arrow} Appending '-runbot_id {self.runbot_id}' to runjob command")
             self.command += f" -runbot_id {self.runbot_id}"
-        
-        # Optional parameter [run] will be set if is_runjob=True
-        if run:
-            self.__execute_cmd()
     
     
-    def __process_non_runjob(self):
-        if ".ctl" in self.command:
-            self.type = "CTL"
-            ctl = self.command.split()[0]
-            logmsg(f"{script_arrow} Request type: CTL. Scrubbing for runjob commands...")
-            scrubbed_ctl = "/NAS/mis/tmp/scrubbed_" + ctl.split('/')[-1]
-            shutil.copyfile(ctl, scrubbed_ctl)
-            os.chmod(scrubbed_ctl, 755)
-            for line in fileinput.input(scrubbed_ctl, inplace=True):
-                line = line.strip()
-                if "runjob" in line and not line.startswith('#'):
-                    self.command = line # Set command attribute to current line
-                    self.__format_runjob_cmd()
-                    print(self.command)
-                else:
-                    print(line)
+    def __formatted_runjob(self, line):
+        self.command = line # Set command attribute to current line
+        self.__format_runjob_cmd()
+        return self.command
+
 
+    def __scrub_ctl(self, echo=True):
+        """
+        Scrubs the CTL into a copy private to this request, so concurrent requests for the same CTL never share one
+        """
+        self.type = "CTL"
+        self.ctl_path = self.command.split()[0]
+        logmsg(f"{script_arrow} Request type: CTL. Scrubbing for runjob commands...")
+        self.scrubbed_ctl = f"/NAS/mis/tmp/scrubbed_{self.runbot_id}_" + self.ctl_path.split('/')[-1]
+        self.ctl_mtime = os.path.getmtime(self.ctl_path)
+        # Single pass: rewrites runjob lines, writes the scrubbed copy and (if echo) logs its contents
+        if echo:
             logmsg(f"{script_arrow} Scrubbed CTL Contents: ")
-            with open(scrubbed_ctl, 'r') as f:
-                for l in f.readlines():
-                    print(l)
-            
-            self.command = scrubbed_ctl # Set command equal to new scrubbed CTL file
+        with runbot_metrics.get_metrics().phase('ctl_scrub'):
+            self.ctl_steps = unix_utility.scrub_ctl(self.ctl_path, self.scrubbed_ctl, format_runjob=self.__formatted_runjob, echo=echo)
+        self.command = self.original_command # __formatted_runjob() borrowed it for each runjob line
+        os.chmod(self.scrubbed_ctl, 0o755)
+        # With checkpoints on, any setup-then-runjobs CTL runs step by step so a retry can restart from its failed step
+        self.is_step_graph = len(self.ctl_steps) > 1 and unix_utility.is_ctl_step_decomposable(
+            self.ctl_path, self.ctl_steps, require_parallel=not CTL_CHECKPOINTS)
+
+
+    def discard_prepared(self):
+        """
+        Removes this request's scrubbed CTL copy, once it has run or if it will not be executed by this process
+        """
+        if self.scrubbed_ctl and os.path.exists(self.scrubbed_ctl):
+            os.remove(self.scrubbed_ctl)
+        self.is_prepared = False
+
+
+    def __execute_prepared(self):
+        if self.scrubbed_ctl:
+            if os.path.getmtime(self.ctl_path) != self.ctl_mtime:
+                logmsg(f"{script_arrow} {self.ctl_path} changed since it was prepared; scrubbing it again")
+                self.__scrub_ctl()
+            self.command = self.scrubbed_ctl # Set command equal to this request's scrubbed CTL file
+            if self.is_step_graph:
+                self.__execute_ctl_steps(self.ctl_path)
+                return
+            if self.start_step_id:
+                logwarning(f"{script_arrow} START_STEP_ID={self.start_step_id} ignored; this CTL can only run as a whole")
         self.__execute_cmd()
     
     
-    def process_runbot_command(self):
+    def __completed_step_ids(self):
+        """
+        OUTPUT: set of step_ids to skip: steps before START_STEP_ID, plus (in resume mode) steps checkpointed as
+                SUCCESS for this request whose command is unchanged
+        """
+        completed = {step['step_id'] for step in self.ctl_steps if self.start_step_id and step['step_id'] < self.start_step_id}
+        if self.resume and CTL_CHECKPOINTS:
+            checkpoints = get_step_checkpoints(self.runbot_id)
+            completed |= {step['step_id'] for step in self.ctl_steps
+                          if checkpoints.get(step['step_id'], {}).get('status_cd') == 'SUCCESS'
+                          and checkpoints[step['step_id']].get('step_hash_tx') == step_fingerprint(step['command'])}
+        if completed:
+            logmsg(f"{script_arrow} Resuming request {self.runbot_id}: skipping completed step(s) {', '.join(map(str, sorted(completed)))}")
+        return completed
+
+
+    def __checkpoint_step(self, result):
+        if CTL_CHECKPOINTS:
+            save_step_checkpoint(self.runbot_id, result, self.attempt)
+
+
+    def __execute_ctl_steps(self, ctl):
+        """
+        Runs a CTL as a step graph instead of one serial shell script; consecutive steps in a
+        '# runbot: parallel' block run concurrently. Each finished step is checkpointed, and retryable
+        failures are retried from the failed step
+        """
+        logmsg(f"{script_arrow} Executing {self.command} as a step graph")
+        completed = self.__completed_step_ids()
+        while True:
+            self.attempt += 1
+            finished = []
+            def on_step_done(result):
+                finished.append(result['step_id'])
+                self.__checkpoint_step(result)
+            with Heartbeat(self.runbot_id, lambda: f"{len(completed) + len(finished)} of {len(self.ctl_steps)} CTL step(s) done"):
+                self.step_results = unix_utility.execute_ctl_steps(ctl, self.ctl_steps, max_concurrency=CTL_STEP_CONCURRENCY,
+                                                                   completed_step_ids=completed, on_step_done=on_step_done,
+                                                                   step_timeout=CTL_STEP_TIMEOUT_SECONDS, log_path=os.getenv('RUNBOT_LOG'),
+                                                                   deadline=self.deadline, stall_timeout=STALL_TIMEOUT_SECONDS)
+            failed = [result for result in self.step_results if result['status'] in unix_utility.FAILED_STATUSES]
+            timed_out = [result for result in failed if result['status'] == 'TIMEOUT']
+            if timed_out:
+                self.timed_out_reason = timed_out[0].get('kill_reason') or 'BUDGET'
+                break
+            if not failed or not self.__should_retry(all(unix_utility.is_retryable_failure(r['returncode'], r['error_lines'])
+                                                         for r in failed)):
+                break
+            completed |= {result['step_id'] for result in self.step_results if result['status'] in ('SUCCESS', 'CHECKPOINTED')}
+        unix_utility.log_ctl_step_results(self.step_results)
+        self.is_successful = all(result['status'] in ('SUCCESS', 'CHECKPOINTED') for result in self.step_results)
+        if self.is_successful:
+            logsuccess(f"{script_arrow} Completed execution of '{self.command}'")
+        else:
+            failed = [str(result['step_id']) for result in self.step_results if result['status'] in unix_utility.FAILED_STATUSES]
+            logerr(f"{script_arrow} Execution failed on step(s) {', '.join(failed)}; check {os.getenv('RUNBOT_LOG')} for details")
+    
+    
+    def get_output_summary(self, error_text=None):
+        """
+        INPUT: error_text (str, optional), error lines with context extracted from the full log
+        OUTPUT: bounded text (str) describing the run -- error lines and output tail, or per-step results for a step graph
+        """
+        if self.output is not None:
+            return self.output.summary(error_text)
+        text = f"Error lines:\n{error_text}\n\n" if error_text else ""
+        text += "\n".join(f"Step {r['step_id']} (line {r['line_no']}): {r['status']} rc={r['returncode']} "
+                         f"in {r['duration']:.1f}s -- {r['command']}" for r in self.step_results)
+        for r in self.step_results:
+            if r['status'] in unix_utility.FAILED_STATUSES and r.get('output_tail'):
+                text += f"\n\nStep {r['step_id']} output (tail):\n{r['output_tail']}"
+        return text
+    
+    
+    def prepare(self, echo=True):
+        """
+        Everything short of executing: looks up the time budget and formats the runjob command or scrubs the CTL.
+        Touches nothing another running request uses, so it can run while the previous request executes
+        INPUT: echo (bool, optional); log the scrubbed CTL's contents
+        """
+        self.budget_seconds, self.budget_basis = get_time_budget(self.job_type, self.command)
+        if self.is_runjob:
+            self.__format_runjob_cmd()
+        elif ".ctl" in self.command:
+            self.__scrub_ctl(echo)
+        self.is_prepared = True
+
+
+    def process_runbot_command(self, resume=True):
         """
         MAIN METHOD - this public method calls every other method within class RunbotCommand
         Purpose: Scrubs and executes the command, based on whether the command is a runjob or not
+        INPUT: resume (bool, optional); for step-wise CTLs, skip steps already checkpointed as done for this request
         """
-        if self.is_runjob:
-            self.__format_runjob_cmd(run=True)
-        else:
-            self.__process_non_runjob()
+        self.resume = resume
+        if not self.is_prepared:
+            self.prepare()
+        self.deadline = time.monotonic() + self.budget_seconds
+        logmsg(f"{script_arrow} Time budget: {self.budget_seconds / 60:.0f} minute(s) ({self.budget_basis}); "
+               f"stall timeout: {f'{STALL_TIMEOUT_SECONDS / 60:.0f} minute(s)' if STALL_TIMEOUT_SECONDS else 'none'}")
+        try:
+            self.__execute_prepared()
+        finally:
+            self.discard_prepared()
+
+
+def normalize_runbot_cmd(command):
+    """
+    INPUT: command (str), a runjob_cmd as queued or as rewritten by RunbotCommand's runjob formatting
+    OUTPUT: command (str) without the per-request '-request'/'-runbot_id' arguments that formatting appends,
+            whitespace collapsed; two requests with the same normalized command do the same work
+    """
+    return " ".join(PER_REQUEST_ARGS_RE.sub("", command or "").split())
+
+
+def get_time_budget(job_type, command=None):
+    """
+    INPUT: job_type (str), command (str, optional)
+    OUTPUT: (budget_seconds (int), basis (str)); BUDGET_HISTORY_FACTOR x the p90 of past successful runs of the same
+            command, else of the job type, once there are BUDGET_HISTORY_MIN_SAMPLES of them; otherwise the static
+            JOB_BUDGET_SECONDS. Never more than the static budget, never less than BUDGET_MIN_SECONDS
+    """
+    static_budget = JOB_BUDGET_SECONDS.get(job_type, DEFAULT_JOB_BUDGET_SECONDS)
+    try:
+        history = get_queue_backend().get_duration_history(job_type) if job_type else []
+    except Exception as e:
+        logwarning(f"{script_arrow} Could not read duration history for {job_type}; using the static budget. Exception: {e}")
+        history = []
+    normalized = normalize_runbot_cmd(command) if command else None
+    same_command = [seconds for cmd, seconds in history if seconds is not None and normalize_runbot_cmd(cmd) == normalized]
+    same_type = [seconds for cmd, seconds in history if seconds is not None]
+    for durations, basis in ((same_command, "history of this command"), (same_type, f"history of {job_type}")):
+        if len(durations) >= BUDGET_HISTORY_MIN_SAMPLES:
+            durations = sorted(durations)
+            p90 = durations[min(len(durations) - 1, int(len(durations) * 0.9))]
+            budget = int(min(static_budget, max(BUDGET_MIN_SECONDS, BUDGET_HISTORY_FACTOR * p90)))
+            return budget, f"{basis}: p90 {p90:.0f}s over {len(durations)} run(s)"
+    return static_budget, f"static budget for {job_type or 'unknown job type'}"
+
+
+def step_fingerprint(command):
+    """
+    OUTPUT: short hash (str) of a CTL step's normalized command; a checkpoint only applies while the step is unchanged
+    """
+    return hashlib.sha1(normalize_runbot_cmd(command).encode()).hexdigest()[:16]
+
+
+def get_step_checkpoints(runbot_id):
+    """
+    OUTPUT: dict of step_id -> checkpoint dict recorded for runbot_id (empty if they cannot be read)
+    """
+    try:
+        return {row.get('step_id'): row for row in get_queue_backend().get_step_checkpoints(runbot_id)}
+    except Exception as e:
+        logwarning(f"{script_arrow} Could not read step checkpoints for request {runbot_id}; running every step. Exception: {e}")
+        return {}
+
+
+def save_step_checkpoint(runbot_id, result, attempt=1):
+    """
+    INPUT: runbot_id, result (dict) from unix_utility.execute_ctl_steps(), attempt (int)
+    OUTPUT: is_success (Boolean); a failed write only costs re-running the step on a later retry
+    """
+    try:
+        get_queue_backend().save_step_checkpoint(runbot_id, result['step_id'], step_fingerprint(result['command']),
+                                                 result['status'], result['returncode'], result['duration'], attempt)
+        return True
+    except Exception as e:
+        logwarning(f"{script_arrow} Could not checkpoint step {result['step_id']} of request {runbot_id}. Exception: {e}")
+        return False
 
 
 def is_prod_run():
@@ -122,6 +395,75 @@ def get_required_row_values(row_to_execute):
     return id, jira_issue_id, job_name, runjob_cmd, artifact_id, log_run_id, error_snippet, job_type
 
 
+def classify_command(runbot_cmd, jira_issue_id, runbot_id):
+    """
+    INPUT: runbot_cmd (str), jira_issue_id (str), runbot_id (int)
+    OUTPUT: (command_type (str), runbot_log (str)), the logfile in RUNBOT_LOG_DIR named according to command_type
+    """
+    runbot_log = RUNBOT_LOG_DIR
+    if ".ctl" in runbot_cmd:
+        command_type = 'CTL'
+        runbot_log += "{}_{}.log".format(runbot_cmd.split('/')[-1].split()[0][:-4], runbot_id)
+    elif "one_time_sql" in runbot_cmd:
+        command_type = 'One-Time SQL'
+        runbot_log += "{}_OneTimeSQL_{}.log".format(jira_issue_id, runbot_id)
+    elif "releaseselfservicereport" in runbot_cmd:
+        command_type = 'Self-Service Release'
+        runbot_log += "{}_NewSelfService_{}.log".format(runbot_cmd.split()[1], runbot_id)
+    else: # Possible values: runjob, publish.sh
+        command_type = 'Publish' if "publish.sh" in runbot_cmd else 'Runjob'
+        runbot_log += "{}_{}.log".format(runbot_cmd.split()[2], runbot_id)
+    return command_type, runbot_log
+
+
+class RequestPlan:
+    """
+    A claimed row with everything worked out that does not need the execution slot: row values, Jira key
+    validity, command_type, runbot_log and a prepared RunbotCommand. Built by prepare_request(); picklable,
+    so a daemon can prepare the next request while a worker runs the current one
+    """
+    def __init__(self, row_to_execute) -> None:
+        self.row = row_to_execute
+        (self.runbot_id, self.jira_issue_id, self.job_name, self.runbot_cmd, self.artifact_id, self.log_run_id,
+         self.error_snippet, self.job_type) = get_required_row_values(row_to_execute)
+        self.is_rerun = self.job_type in ['RERUN_REPORT', 'RELOAD_TABLE']
+        self.is_valid_issue_key = None
+        self.command_type = None
+        self.runbot_log = None
+        self.runbot_command = None
+        self.prepare_seconds = 0.0
+
+    def is_runnable(self):
+        return bool(self.runbot_cmd) and bool(self.is_valid_issue_key)
+
+    def discard(self):
+        if self.runbot_command:
+            self.runbot_command.discard_prepared()
+
+
+def prepare_request(row_to_execute, jira=None, echo=True):
+    """
+    INPUT: row_to_execute (dict) claimed from mis_reports.jobs.RUNJOB_REQUEST_T, jira (JiraRequest, optional),
+           echo (bool, optional); log the scrubbed CTL's contents
+    OUTPUT: RequestPlan; is_runnable() is False if the row has no command or an invalid Jira key
+    """
+    start = time.monotonic()
+    plan = RequestPlan(row_to_execute)
+    if plan.runbot_cmd:
+        logmsg(f"{script_arrow} Validating that {plan.jira_issue_id} is a valid Jira key...")
+        with runbot_metrics.get_metrics().phase('jira_validate'):
+            plan.is_valid_issue_key = runbot_jira_cache.get_issue_cache().is_valid_issue_key(
+                jira or cs_jira_requests.JiraRequest(), plan.jira_issue_id)
+    if plan.is_runnable():
+        plan.command_type, plan.runbot_log = classify_command(plan.runbot_cmd, plan.jira_issue_id, plan.runbot_id)
+        plan.runbot_command = RunbotCommand(plan.runbot_cmd, plan.runbot_id, command_type=plan.command_type,
+                                            start_step_id=row_to_execute.get('start_step_id'), job_type=plan.job_type,
+                                            jira_id=plan.jira_issue_id)
+        plan.runbot_command.prepare(echo=echo)
+    plan.prepare_seconds = time.monotonic() - start
+    return plan
+
+
 def get_next_row_dict(runbot_id=None):
     """
     Function to get the next status_cd = 'NEW' (unrun) item in mis_reports.jobs.RUNJOB_REQUEST_T
@@ -129,21 +471,85 @@ def get_next_row_dict(runbot_id=None):
     """
     logmsg(f"{script_arrow} Accessing DB to find next open request...")
     # This sproc returns 1 row for execution and marks the row as 'QUEUED'
-    sql = """
-        EXEC MIS_Reports.jobs.RUNJOB_REQUEST_GET @IS_AUTOMATION = 1;
-        """
     if runbot_id:
-        sql = """
-        EXEC MIS_Reports.jobs.RUNJOB_REQUEST_GET @RUNJOB_ID = {};
-        """.format(runbot_id)
-        
-    rows_list = cs_db.DataBase.mssql_query(sql)
+        rows_list = runbot_db.get_session().query("EXEC MIS_Reports.jobs.RUNJOB_REQUEST_GET @RUNJOB_ID = ?;",
+                                                  (int(runbot_id),), label='RUNJOB_REQUEST_GET')
+    else:
+        rows_list = runbot_db.get_session().query("EXEC MIS_Reports.jobs.RUNJOB_REQUEST_GET @IS_AUTOMATION = 1;",
+                                                  label='RUNJOB_REQUEST_GET')
     if rows_list:
         row_to_execute = rows_list[0]
     else:
         return False
     row_to_execute =  {k.lower(): v for k, v in row_to_execute.items()}
     return row_to_execute
+
+
+def get_friendly_status(status_cd, jira_status_tx):
+    """
+    OUTPUT: FRIENDLY_STATUS (str) as computed by RUNJOB_REQUEST_GET for the status queue report
+    """
+    return FRIENDLY_STATUS_BY_STATUS_CD.get(status_cd) or FRIENDLY_STATUS_BY_JIRA_STATUS.get(jira_status_tx, jira_status_tx)
+
+
+class LookupCache:
+    """
+    Per-process cache of joined lookup values (person, artifact title). Missing or expired keys are fetched
+    together in one call to fetch(keys), so a page of rows costs at most one round trip per lookup table
+    """
+    def __init__(self, fetch, ttl_seconds=STATUS_LOOKUP_TTL_SECONDS) -> None:
+        self.fetch = fetch
+        self.ttl_seconds = ttl_seconds
+        self.__entries = {}   # key -> (expires_at, value); value None records a key that does not exist
+
+
+    def get_many(self, keys):
+        """
+        INPUT: keys (iterable)
+        OUTPUT: dict of key -> value for keys that exist
+        """
+        now = time.monotonic()
+        keys = {key for key in keys if key is not None}
+        missing = [key for key in keys if self.__entries.get(key, (0, None))[0] <= now]
+        if missing:
+            fetched = self.fetch(missing)
+            for key in missing:
+                self.__entries[key] = (now + self.ttl_seconds, fetched.get(key))
+        return {key: self.__entries[key][1] for key in keys if self.__entries[key][1] is not None}
+
+
+def _get_status_lookups():
+    global _status_lookups
+    if _status_lookups is None:
+        backend = get_queue_backend()
+        _status_lookups = (LookupCache(backend.get_people), LookupCache(backend.get_artifact_titles))
+    return _status_lookups
+
+
+def get_status_page(cursor=None, page_size=200, since_id=0):
+    """
+    Incremental view of the status queue report (the non-automation branch of RUNJOB_REQUEST_GET)
+    INPUT: cursor (int), the 'cursor' from the previous page/poll; None or 0 starts a full snapshot
+           page_size (int), since_id (int, optional) to only return requests with ID > since_id
+    OUTPUT: dict with 'rows' (list of row dicts, same columns as RUNJOB_REQUEST_GET including friendly_status),
+            'cursor' (int) to pass to the next call, and 'has_more' (bool) if another page is ready right away
+            - Only rows inserted or updated after cursor are returned; an unchanged queue costs one index seek
+    """
+    rows = get_queue_backend().get_status_changes(since_version=cursor or 0, since_id=since_id, page_size=page_size)
+    people_cache, artifact_cache = _get_status_lookups()
+    people = people_cache.get_many(row.get('schwab_id') for row in rows)
+    titles = artifact_cache.get_many(row.get('artifact_id') for row in rows)
+
+    page_rows = []
+    for row in rows:
+        person, title_tx = people.get(row.get('schwab_id')), titles.get(row.get('artifact_id'))
+        if person is None or title_tx is None:
+            continue # INNER JOINs in RUNJOB_REQUEST_GET drop these rows from the report too
+        row.update(person, title_tx=title_tx, friendly_status=get_friendly_status(row.get('status_cd'), row.get('jira_status_tx')))
+        page_rows.append(row)
+    return {'rows': page_rows,
+            'cursor': rows[-1]['row_version'] if rows else (cursor or 0),
+            'has_more': len(rows) >= page_size}
       
             
 def update_status_cd_for_row(id, new_status):
@@ -153,79 +559,367 @@ def update_status_cd_for_row(id, new_status):
     OUTPUT: is_success (Boolean)
     """
     logmsg(f"{script_arrow} Updating 'status_cd' in mis_reports.jobs.RUNJOB_REQUEST_T to {new_status}")
-    sql = """
-        EXEC  MIS_Reports.jobs.RUNJOB_REQUEST_UPDATE 
-        @ID = {},
-        @STATUS = '{}';
-        """.format(id, new_status)
-    return cs_db.DataBase.mssql_update(sql)
+    try:
+        runbot_db.get_session().execute("EXEC MIS_Reports.jobs.RUNJOB_REQUEST_UPDATE @ID = ?, @STATUS = ?;",
+                                        (int(id), new_status), label='RUNJOB_REQUEST_UPDATE')
+    except Exception as e:
+        logerr(f"{script_arrow} RUNJOB_REQUEST_UPDATE failed for {id}: {e}")
+        return False
+    return True
+
+
+def finish_row(id, final_status):
+    """
+    Moves a row and its followers (coalesced duplicates) to the end state and re-reads the row
+    (for RUN_ID / ERROR_SNIPPIT_TX) in one transaction
+    INPUT: 'id', final_status ('COMPLETE', 'ERROR' or 'TIMEOUT')
+    OUTPUT: (is_success (Boolean), refreshed row dict or False, list of follower row dicts)
+    """
+    session = runbot_db.get_session()
+    logmsg(f"{script_arrow} Updating 'status_cd' in mis_reports.jobs.RUNJOB_REQUEST_T to {final_status}")
+    try:
+        with session.transaction():
+            # Not update_status_cd_for_row(): a failed leader update must raise, so followers never finish without it
+            session.execute("EXEC MIS_Reports.jobs.RUNJOB_REQUEST_UPDATE @ID = ?, @STATUS = ?;",
+                            (int(id), final_status), label='RUNJOB_REQUEST_UPDATE')
+            followers = get_queue_backend().finish_followers(id, final_status)
+            if followers:
+                logmsg(f"{script_arrow} Request(s) {', '.join(str(row.get('id')) for row in followers)} take the result of request {id}")
+            result = True, get_next_row_dict(id), followers
+    except Exception as e:
+        logerr(f"{script_arrow} Failed to finish request {id}: {e}")
+        return False, False, []
+    if final_status == 'COMPLETE':
+        update_duration_estimates(id)
+    return result
+
+
+def update_duration_estimates(id):
+    """
+    Folds a completed request's runtime into the rolling estimates that order claims; never fails the request
+    INPUT: 'id'
+    """
+    try:
+        get_queue_backend().update_duration_estimates(id)
+    except Exception as e:
+        logwarning(f"{script_arrow} Could not update runtime estimates with request {id}. Exception: {e}")
+
+
+def release_row(id):
+    """
+    Returns a claimed ('QUEUED') row to 'NEW' so another run can pick it up, e.g. on daemon shutdown
+    INPUT: 'id'
+    OUTPUT: is_success (Boolean)
+    """
+    return get_queue_backend().release_rows(get_owner_token(), [id]) > 0
+
+
+def get_queue_backend():
+    """
+    OUTPUT: the active runbot_queue.QueueBackend; defaults to MSSQL (RUNJOB_REQUEST_* sprocs), or SQLite if RUNBOT_LOCAL_DB is set
+    """
+    global _queue_backend
+    if _queue_backend is None:
+        _queue_backend = runbot_queue.get_default_backend()
+    return _queue_backend
+
+
+def set_queue_backend(backend):
+    """
+    INPUT: backend (runbot_queue.QueueBackend), e.g. runbot_queue.SqliteQueueBackend('/tmp/queue.db') for local testing
+    """
+    global _queue_backend, _status_lookups
+    _queue_backend, _status_lookups = backend, None
+
+
+def get_owner_token():
+    """
+    OUTPUT: owner token (str) identifying this host/process on claimed rows; forked workers share their parent's token
+    """
+    global _owner_token
+    if _owner_token is None:
+        _owner_token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    return _owner_token
+
+
+def claim_rows(batch_size=1, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    Atomically claims up to batch_size 'NEW' rows, marking them 'QUEUED' under this process's owner token
+    INPUT: batch_size (int), lease_seconds (int)
+    OUTPUT: list of row dicts (same shape as get_next_row_dict()), possibly empty
+    """
+    logmsg(f"{script_arrow} Claiming up to {batch_size} open request(s) as {get_owner_token()}...")
+    while True:
+        rows = get_queue_backend().claim_rows(get_owner_token(), batch_size=batch_size, lease_seconds=lease_seconds)
+        if rows:
+            logmsg(f"{script_arrow} Claimed request(s): {', '.join(str(row.get('id')) for row in rows)}")
+            for row in rows:
+                if row.get('est_seconds') is not None:
+                    logmsg(f"{script_arrow}   request {row.get('id')}: expected runtime {_format_seconds(row['est_seconds'])} "
+                           f"(estimate by {ESTIMATE_BASIS_NAMES.get(row.get('est_basis_cd'), row.get('est_basis_cd'))})")
+        if not rows or not COALESCE_DUPLICATES:
+            return rows
+        rows_to_execute = coalesce_duplicate_requests(rows)
+        if rows_to_execute:
+            return rows_to_execute
+        # every claimed row was a duplicate of a queued/running request; try the next ones
+
+
+def _format_seconds(seconds):
+    return f"{seconds / 3600:.1f}h" if seconds >= 3600 else f"{seconds / 60:.0f}m" if seconds >= 60 else f"{seconds:.0f}s"
+
+
+def get_queue_forecast(slots=None):
+    """
+    Estimated queue wait for every request not yet running, from the rolling runtime estimates
+    INPUT: slots (int, optional), requests executing at once; defaults to the number running now (at least 1)
+    OUTPUT: list of dicts (id, status_cd, job_type, job_nm, est_seconds, est_basis_cd, age_seconds, wait_seconds) in
+            claim order. Aging lowers every waiting request's score at the same rate, so today's order is the order
+            they will start in unless new requests arrive
+    """
+    rows = get_queue_backend().get_schedule()
+    running = [row for row in rows if row.get('status_cd') == 'RUNNING']
+    # A slot frees when its job's estimate runs out; one already past its estimate is taken to finish any moment
+    free_at = [max(0.0, float(row['est_seconds']) - float(row.get('elapsed_seconds') or 0)) for row in running]
+    free_at += [0.0] * max(0, (slots or len(running) or 1) - len(running))
+    heapq.heapify(free_at)
+    forecast = []
+    for row in rows:
+        if row.get('status_cd') == 'RUNNING':
+            continue
+        start = heapq.heappop(free_at)
+        heapq.heappush(free_at, start + float(row['est_seconds']))
+        forecast.append({key: row.get(key) for key in ('id', 'status_cd', 'job_type', 'job_nm', 'est_seconds', 'est_basis_cd', 'age_seconds')})
+        forecast[-1]['wait_seconds'] = start
+    return forecast
+
+
+def log_queue_forecast(slots=None, limit=20):
+    """
+    INPUT: slots (int, optional), as in get_queue_forecast(); limit (int), requests to list
+    """
+    forecast = get_queue_forecast(slots)
+    if not forecast:
+        return
+    logmsg(f"{script_arrow} Queue forecast: {len(forecast)} request(s) waiting; "
+           f"the last starts in about {_format_seconds(forecast[-1]['wait_seconds'])}")
+    for entry in forecast[:limit]:
+        logmsg(f"{script_arrow}   request {entry['id']} ({entry['job_type']} {entry['job_nm'] or ''}): "
+               f"expected {_format_seconds(entry['est_seconds'])} by {ESTIMATE_BASIS_NAMES.get(entry['est_basis_cd'], entry['est_basis_cd'])}, "
+               f"queued {_format_seconds(entry['age_seconds'] or 0)} ago, estimated wait {_format_seconds(entry['wait_seconds'])}")
+
+
+def _duplicate_key(row):
+    return (row.get('job_type'), row.get('artifact_id'), row.get('job_nm'), normalize_runbot_cmd(row.get('runjob_cmd')))
+
+
+def coalesce_duplicate_requests(claimed_rows):
+    """
+    Attaches duplicate requests (same job_type, artifact_id, job_nm and normalized runjob_cmd) to one leading execution.
+    A claimed row that duplicates a request already queued/running elsewhere becomes that request's follower; 'NEW'
+    duplicates of any queued/running request are attached too, so they are never claimed and run again
+    INPUT: claimed_rows (list of row dicts) just claimed by this process
+    OUTPUT: list of row dicts from claimed_rows that should still execute
+    """
+    backend = get_queue_backend()
+    claimed_ids = {row.get('id') for row in claimed_rows}
+    leader_by_key, pending_by_key = {}, {}
+    for row in backend.get_active_requests():
+        if row.get('id') in claimed_ids or not row.get('runjob_cmd'):
+            continue
+        if row.get('status_cd') in ('QUEUED', 'RUNNING'):
+            leader_by_key.setdefault(_duplicate_key(row), row.get('id'))
+        else:
+            pending_by_key.setdefault(_duplicate_key(row), []).append(row.get('id'))
+
+    rows_to_execute = []
+    for row in claimed_rows:
+        key = _duplicate_key(row)
+        leader_id = leader_by_key.get(key)
+        if row.get('runjob_cmd') and leader_id is not None and backend.attach_followers(leader_id, [row.get('id')], get_owner_token()):
+            logmsg(f"{script_arrow} Request {row.get('id')} duplicates request {leader_id}; attached as a follower instead of running")
+            continue
+        leader_by_key[key] = row.get('id')
+        rows_to_execute.append(row)
+
+    for key, ids in pending_by_key.items():
+        if key in leader_by_key:
+            attached = backend.attach_followers(leader_by_key[key], ids)
+            if attached:
+                logmsg(f"{script_arrow} Attached queued duplicate(s) {', '.join(map(str, attached))} to request {leader_by_key[key]}")
+    return rows_to_execute
+
+
+def renew_lease(ids, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    INPUT: ids (list of int) currently owned by this process, lease_seconds (int)
+    OUTPUT: number of leases renewed (int); fewer than len(ids) means another host reclaimed a row
+    """
+    renewed = get_queue_backend().renew_lease(get_owner_token(), list(ids), lease_seconds=lease_seconds)
+    if renewed < len(ids):
+        logwarning(f"{script_arrow} Renewed {renewed} of {len(ids)} lease(s); the rest already finished or are no longer owned by {get_owner_token()}")
+    return renewed
+
+
+def reclaim_expired_leases():
+    """
+    Returns rows whose owner stopped renewing (crashed host/run) to 'NEW'
+    OUTPUT: list of reclaimed ids
+    """
+    reclaimed = get_queue_backend().reclaim_expired()
+    if reclaimed:
+        logwarning(f"{script_arrow} Reclaimed {len(reclaimed)} request(s) with expired leases: {', '.join(map(str, reclaimed))}")
+    return reclaimed
+
+
+class LeaseKeeper:
+    """
+    Context manager that renews the leases on ids from a background thread while a job runs
+    """
+    def __init__(self, ids, lease_seconds=DEFAULT_LEASE_SECONDS) -> None:
+        self.ids = list(ids)
+        self.lease_seconds = lease_seconds
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__renew_loop, daemon=True)
+
+    def __renew_loop(self):
+        while not self.__stop.wait(self.lease_seconds / 3):
+            try:
+                renew_lease(self.ids, self.lease_seconds)
+            except Exception as e:
+                logwarning(f"{script_arrow} Lease renewal failed; retrying. Exception: {e}")
+
+    def __enter__(self):
+        self.__thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.__stop.set()
+        self.__thread.join()
+
+
+class Heartbeat:
+    """
+    Context manager that stamps HEARTBEAT_TS and a progress line on a running request from a background thread
+    """
+    def __init__(self, runbot_id, describe=None, interval=HEARTBEAT_SECONDS) -> None:
+        self.runbot_id = runbot_id
+        self.describe = describe
+        self.interval = interval
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__heartbeat_loop, daemon=True)
+
+    def __heartbeat_loop(self):
+        while not self.__stop.wait(self.interval):
+            try:
+                get_queue_backend().heartbeat(get_owner_token(), self.runbot_id, self.describe() if self.describe else None)
+            except Exception as e:
+                logwarning(f"{script_arrow} Heartbeat failed; retrying. Exception: {e}")
+
+    def __enter__(self):
+        if self.runbot_id is not None and self.interval:
+            self.__thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.__stop.set()
+        if self.__thread.is_alive():
+            self.__thread.join()
+
+
+def get_log_sink():
+    """
+    OUTPUT: the active runbot_log_sink.LogSink, or None to use the legacy Perl writer (RUNBOT_NATIVE_LOG_SINK not set)
+    """
+    global _log_sink
+    if _log_sink is None and runbot_queue.LOCAL_DB_PATH:
+        _log_sink = runbot_log_sink.SqliteLogSink(runbot_queue.LOCAL_DB_PATH)
+    elif _log_sink is None and NATIVE_LOG_SINK:
+        if not runbot_log_sink.is_native_logging_available():
+            # No silent fallback to Perl: that would put this host's logs in a different table from every other host's
+            logerr(f"{script_arrow} RUNBOT_NATIVE_LOG_SINK=1 but pyodbc is not installed; database log writes will fail")
+        _log_sink = runbot_log_sink.MssqlLogSink()
+    return _log_sink
+
+
+def set_log_sink(sink):
+    """
+    INPUT: sink (runbot_log_sink.LogSink), e.g. runbot_log_sink.SqliteLogSink('/tmp/logs.db') for local testing
+    """
+    global _log_sink
+    _log_sink = sink
 
 
 def log_output_to_database(job_command, log_file_name, log_text, is_failure, artifact_id, runbot_id):
+    """
+    Writes log_text as ordered, parameterized chunk batches through the native log sink when RUNBOT_NATIVE_LOG_SINK=1,
+    otherwise through the Perl MIS::Jobs writer into the existing log table
+    OUTPUT: is_success (Boolean)
+    """
     logmsg(f"{script_arrow} Logging output to database")
     if not log_text:
         log_text = "Nothing to log"
 
-    log_text = log_text.replace("'", "").replace('\\n', '\n').replace('\\t', '\t')
+    log_text = log_text.replace('\\n', '\n').replace('\\t', '\t')
+
+    sink = get_log_sink()
+    if sink is None:
+        return runbot_log_sink.perl_log_content_to_database(job_command, log_file_name, log_text, is_failure, artifact_id, runbot_id)
 
-    params = "'{}', '{}', '{}', {}, {}, {}".format(job_command, log_file_name, log_text, is_failure, artifact_id, runbot_id)    
-    mod_to_call = "if (! MIS::Jobs::log_content_to_database(" + params + ")) {exit 1;} else {exit 0;}"
-    rc = subprocess.call(["perl", "-mMIS::Jobs", "-e", mod_to_call])
+    writer = runbot_log_sink.ChunkedLogWriter(sink, job_command, log_file_name, is_failure, artifact_id, runbot_id)
+    writer.write(log_text)
+    is_success = writer.close()
+    if is_success:
+        logmsg(f"{script_arrow} Logged {writer.char_count} characters in {writer.chunk_count} chunk(s) as log {writer.log_id}")
+    return is_success
 
 
 def sync_jira_status_for_outstanding_requests(jira_issue_id=None):
     """
     Function to query existing, non-completed Jira release stories and update the runjob table in MSSQL
     with those stories' current status from Jira.  Runbot will look for 'Ready for Implementation' to execute a request
+    Changes are matched to DB rows by issue key and written in one set-based statement/transaction
+    OUTPUT: number of rows (int) whose JIRA_STATUS_TX changed
     """
+    backend = get_queue_backend()
     # Get all pending Jira IDs (and associated statuses) from MSSQL, if jira_issue_id is blank
     if jira_issue_id is None:
-        sql = """
-            SELECT  JIRA_ISSUE_ID, JIRA_STATUS_TX
-                FROM     mis_reports.jobs.RUNJOB_REQUEST_T
-            WHERE    (JIRA_STATUS_TX IS NULL OR 
-                JIRA_STATUS_TX NOT IN('Done','Done - With Issues','Failed','Cancelled'))
-                AND EXECUTION_END_TS IS NULL
-                AND QUEUE_TS > getDate() - 7
-            ORDER BY ID;
-            """
-        rows_list = cs_db.DataBase.mssql_query(sql)
-        if rows_list is None:
+        db_statuses = backend.get_outstanding_jira_statuses()
+        if not db_statuses:
             logmsg(f"{script_arrow} No non-complete Jira stories found in DB; skipping status syncup")
-            return
-        issues_csv, status_list = "", []
-        
-        for iss in rows_list:
-            issues_csv += iss.get('JIRA_ISSUE_ID') + ","
-            status_list.append(iss.get('JIRA_STATUS_TX'))
-        issues_csv = issues_csv[:-1]
-        logmsg(f"{script_arrow} Found {len(rows_list)} issues in sync_jira_status_for_outstanding_requests()")
+            return 0
+        logmsg(f"{script_arrow} Found {len(db_statuses)} issues in sync_jira_status_for_outstanding_requests()")
     else:
         logmsg(f"{script_arrow} Executing Jira-DB syncup for current issue ID...")
-        issues_csv = jira_issue_id
+        db_statuses = {jira_issue_id: None}
 
-    # Call Jira WebService for each status
+    # Only issues that are new, expired or updated since the last sync are fetched from the Jira WebService;
+    # a single-issue sync follows a status change by RunBot and always asks Jira
     jira = cs_jira_requests.JiraRequest()
-    jira_issues = jira.query_multiple_issues(issues_csv)
-    
-    for ind, issue in enumerate(jira_issues["result"]["issues"]):
-        # If DB status already matches status from Jira, skip this issue
-        if issue["fields"]["status"]["name"] == status_list[ind]:
-            continue
-        # Update Jira status in runjob database
-        logmsg(f"{script_arrow} Syncing mis_reports.jobs.RUNJOB_REQUEST_T entry for {issue['key']} with current status from Jira: '{issue['fields']['status']['name']}'")
-        try:
-            sql = """
-                UPDATE mis_reports.jobs.RUNJOB_REQUEST_T
-                SET JIRA_STATUS_TX = '{0}'
-                WHERE    JIRA_ISSUE_ID = '{1}';
-                """.format(issue["fields"]["status"]["name"], issue["key"])
-            mssql_resultset = cs_db.DataBase.mssql_update(sql)
-        except Exception as e:
-            logwarning(f"{script_arrow} Unable to update status for {issue['key']}. Exception:")
-            logwarning(f"{e.message} {e.args}", skip_format=True)
-            continue  
-    logmsg(f"{script_arrow} mis_reports.jobs.RUNJOB_REQUEST_T Jira status syncup complete")
+    jira_statuses = runbot_jira_cache.get_issue_cache().get_statuses(jira, db_statuses, force=jira_issue_id is not None)
+
+    missing = [key for key in db_statuses if key not in jira_statuses]
+    if missing:
+        logwarning(f"{script_arrow} Jira returned no result for {len(missing)} issue(s); leaving DB status as-is: {', '.join(missing)}")
+
+    # Diff by issue key; a single-issue sync always writes, as the UPDATE itself skips unchanged rows
+    changed_statuses = {key: status for key, status in jira_statuses.items()
+                        if key in db_statuses and status != db_statuses[key]}
+    if not changed_statuses:
+        logmsg(f"{script_arrow} mis_reports.jobs.RUNJOB_REQUEST_T Jira statuses already current; nothing to sync")
+        logmsg("-" * 54)
+        return 0
+    for key, status in changed_statuses.items():
+        logmsg(f"{script_arrow} Syncing mis_reports.jobs.RUNJOB_REQUEST_T entry for {key} with current status from Jira: '{status}'")
+
+    start = time.monotonic()
+    try:
+        rows_updated = backend.bulk_update_jira_status(changed_statuses)
+    except Exception as e:
+        logwarning(f"{script_arrow} Unable to bulk update Jira status for {len(changed_statuses)} issue(s); transaction rolled back. Exception:")
+        logwarning(f"{e}", skip_format=True)
+        return 0
+    logmsg(f"{script_arrow} mis_reports.jobs.RUNJOB_REQUEST_T Jira status syncup complete: "
+           f"{rows_updated} row(s) updated for {len(changed_statuses)} issue(s) in {time.monotonic() - start:.2f}s")
     logmsg("-" * 54)
-cs_runbot.txt
-Displaying runbot.txt.
+    return rows_updated
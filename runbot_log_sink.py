@@ -0,0 +1,327 @@
+""" Purpose: In-process, chunked database log writer for RunBot (replaces the per-run Perl MIS::Jobs call) """
+#!/bin/env python3
+
+########################################################################
+# Log text is split into ordered chunks and written with parameterized #
+# executemany() batches, optionally from a background writer thread    #
+# fed by a bounded queue. Each log gets a header row in RUNBOT_LOG_T;  #
+# chunks live in RUNBOT_LOG_CHUNK_T and can be read back in pages.     #
+#   - MssqlLogSink:  production, via pyodbc when it is installed       #
+#   - SqliteLogSink: local stand-in for testing and benchmarking       #
+########################################################################
+
+import os
+import sys
+import time
+import uuid
+import queue
+import sqlite3
+import threading
+import subprocess
+
+import runbot_db
+from cs_logging import logmsg, logerr, logwarning
+
+try:
+    import pyodbc
+except ImportError:
+    pyodbc = None
+
+script_arrow = str(os.path.basename(__file__)) + " ->"
+
+DEFAULT_CHUNK_CHARS = 32000   # fits VARCHAR(MAX) comfortably and keeps each row well under the TDS packet limit
+DEFAULT_BATCH_ROWS = 50
+
+
+class LogSink:
+    """
+    DB-API 2.0 log sink. Subclasses provide connect(), the placeholder style and the paged chunk query
+    """
+    placeholder = "?"
+    fast_executemany = False
+    log_table = "RUNBOT_LOG_T"
+    chunk_table = "RUNBOT_LOG_CHUNK_T"
+
+    def __init__(self) -> None:
+        self.conn = None
+
+    def connect(self):
+        raise NotImplementedError
+
+    def chunk_page_query(self, log_id, next_seq, page_size):
+        """
+        OUTPUT: (sql, params) selecting at most page_size chunks of log_id from next_seq on, in order
+        """
+        raise NotImplementedError
+
+    def __cursor(self):
+        if self.conn is None:
+            self.conn = self.connect()
+        return self.conn.cursor()
+
+    def __marks(self, n):
+        return ", ".join([self.placeholder] * n)
+
+    def write_chunks(self, rows):
+        """
+        INPUT: rows (list of (log_id, chunk_seq, chunk_tx)), written in one parameterized batch and committed
+        """
+        cur = self.__cursor()
+        if self.fast_executemany:
+            cur.fast_executemany = True
+        cur.executemany(f"INSERT INTO {self.chunk_table} (LOG_ID, CHUNK_SEQ, CHUNK_TX) VALUES ({self.__marks(3)})", rows)
+        self.conn.commit()
+
+    def write_header(self, log_id, job_command, log_file_name, is_failure, artifact_id, runbot_id, chunk_count, char_count):
+        cur = self.__cursor()
+        cur.execute(f"INSERT INTO {self.log_table} (LOG_ID, RUNBOT_ID, ARTIFACT_ID, JOB_CMD_TX, LOG_FILE_NM, IS_FAILURE, "
+                    f"CHUNK_CT, CHAR_CT) VALUES ({self.__marks(8)})",
+                    (log_id, runbot_id, artifact_id, job_command, log_file_name, int(bool(is_failure)), chunk_count, char_count))
+        self.conn.commit()
+
+    def iter_chunks(self, log_id, page_size=20):
+        """
+        INPUT: log_id (str), page_size (int, optional)
+        OUTPUT: generator of chunk_tx (str) in order, fetched page_size chunks per round trip
+        """
+        next_seq = 0
+        while True:
+            cur = self.__cursor()
+            cur.execute(*self.chunk_page_query(log_id, next_seq, page_size))
+            rows = cur.fetchall()
+            cur.close()
+            if not rows:
+                return
+            for seq, chunk_tx in rows:
+                yield chunk_tx
+            next_seq = rows[-1][0] + 1
+
+    def get_log_ids(self, runbot_id):
+        """
+        OUTPUT: list of log_ids (str) written for runbot_id, oldest first
+        """
+        cur = self.__cursor()
+        cur.execute(f"SELECT LOG_ID FROM {self.log_table} WHERE RUNBOT_ID = {self.placeholder} ORDER BY CREATED_TS", (runbot_id,))
+        return [row[0] for row in cur.fetchall()]
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class SqliteLogSink(LogSink):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS RUNBOT_LOG_T (
+            LOG_ID       TEXT PRIMARY KEY,
+            RUNBOT_ID    INTEGER,
+            ARTIFACT_ID  INTEGER,
+            JOB_CMD_TX   TEXT,
+            LOG_FILE_NM  TEXT,
+            IS_FAILURE   INTEGER,
+            CHUNK_CT     INTEGER,
+            CHAR_CT      INTEGER,
+            CREATED_TS   REAL DEFAULT (julianday('now'))
+        );
+        CREATE INDEX IF NOT EXISTS RUNBOT_LOG_RUNBOT_IX ON RUNBOT_LOG_T (RUNBOT_ID);
+        CREATE TABLE IF NOT EXISTS RUNBOT_LOG_CHUNK_T (
+            LOG_ID     TEXT NOT NULL,
+            CHUNK_SEQ  INTEGER NOT NULL,
+            CHUNK_TX   TEXT,
+            PRIMARY KEY (LOG_ID, CHUNK_SEQ)
+        );
+        """
+
+    def __init__(self, db_path) -> None:
+        super().__init__()
+        self.db_path = db_path
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.executescript(self.SCHEMA)
+        return conn
+
+    def chunk_page_query(self, log_id, next_seq, page_size):
+        return (f"SELECT CHUNK_SEQ, CHUNK_TX FROM {self.chunk_table} WHERE LOG_ID = ? AND CHUNK_SEQ >= ? "
+                "ORDER BY CHUNK_SEQ LIMIT ?", (log_id, next_seq, page_size))
+
+
+class MssqlLogSink(LogSink):
+    fast_executemany = True
+    log_table = "MIS_Reports.jobs.RUNBOT_LOG_T"
+    chunk_table = "MIS_Reports.jobs.RUNBOT_LOG_CHUNK_T"
+
+    def connect(self):
+        if pyodbc is None:
+            raise RuntimeError("pyodbc is not installed; native database logging is unavailable")
+        # Own connection (not the shared runbot_db session) so a background writer never interleaves with it
+        return pyodbc.connect(runbot_db.mssql_connection_string(), autocommit=False)
+
+    def chunk_page_query(self, log_id, next_seq, page_size):
+        # TOP bounds each page server-side; without it every page re-reads the rest of the log
+        return (f"SELECT TOP (?) CHUNK_SEQ, CHUNK_TX FROM {self.chunk_table} WHERE LOG_ID = ? AND CHUNK_SEQ >= ? "
+                "ORDER BY CHUNK_SEQ", (page_size, log_id, next_seq))
+
+
+def is_native_logging_available():
+    """
+    OUTPUT: True if MssqlLogSink can be used on this host (pyodbc installed)
+    """
+    return pyodbc is not None
+
+
+class ChunkedLogWriter:
+    """
+    Splits log text into chunk_chars-sized chunks and writes them batch_rows at a time.
+    With background=True a writer thread drains a bounded queue, so producers block only when it is full.
+    close() writes the header row and reports success
+    """
+    def __init__(self, sink, job_command, log_file_name, is_failure, artifact_id, runbot_id,
+                 chunk_chars=DEFAULT_CHUNK_CHARS, batch_rows=DEFAULT_BATCH_ROWS, background=False, max_queued_batches=8) -> None:
+        self.sink = sink
+        self.meta = (job_command, log_file_name, is_failure, artifact_id, runbot_id)
+        self.log_id = uuid.uuid4().hex
+        self.chunk_chars = chunk_chars
+        self.batch_rows = batch_rows
+        self.chunk_count = 0
+        self.char_count = 0
+        self.error = None
+        self.__pending = []
+        self.__buffer = ""
+        self.__queue = queue.Queue(maxsize=max_queued_batches) if background else None
+        self.__thread = None
+        if background:
+            self.__thread = threading.Thread(target=self.__writer_loop, name="runbot-log-writer", daemon=True)
+            self.__thread.start()
+
+    def __writer_loop(self):
+        while True:
+            batch = self.__queue.get()
+            if batch is None:
+                return
+            if self.error is None:
+                try:
+                    self.sink.write_chunks(batch)
+                except Exception as e:
+                    self.error = e
+
+    def __flush_batch(self):
+        if not self.__pending:
+            return
+        batch, self.__pending = self.__pending, []
+        if self.__queue is not None:
+            self.__queue.put(batch)
+        elif self.error is None:
+            try:
+                self.sink.write_chunks(batch)
+            except Exception as e:
+                self.error = e
+
+    def __add_chunk(self, chunk):
+        self.__pending.append((self.log_id, self.chunk_count, chunk))
+        self.chunk_count += 1
+        self.char_count += len(chunk)
+        if len(self.__pending) >= self.batch_rows:
+            self.__flush_batch()
+
+    def write(self, text):
+        """
+        INPUT: text (str), appended to the log
+        """
+        buffer, pos = self.__buffer + text, 0
+        while len(buffer) - pos >= self.chunk_chars:
+            self.__add_chunk(buffer[pos:pos + self.chunk_chars])
+            pos += self.chunk_chars
+        self.__buffer = buffer[pos:]
+
+    def write_file(self, path, encoding='utf-8'):
+        """
+        INPUT: path (str) of a logfile, streamed in chunk_chars pieces without loading it whole
+        """
+        with open(path, encoding=encoding, errors='replace') as f:
+            while True:
+                text = f.read(self.chunk_chars)
+                if not text:
+                    break
+                self.write(text)
+
+    def close(self):
+        """
+        OUTPUT: is_success (bool); True once every chunk and the header row are committed
+        """
+        if self.__buffer:
+            self.__add_chunk(self.__buffer)
+            self.__buffer = ""
+        self.__flush_batch()
+        if self.__thread is not None:
+            self.__queue.put(None)
+            self.__thread.join()
+        if self.error is None:
+            try:
+                self.sink.write_header(self.log_id, *self.meta, self.chunk_count, self.char_count)
+            except Exception as e:
+                self.error = e
+        if self.error is not None:
+            logerr(f"{script_arrow} Failed writing log {self.log_id} to database: {self.error}")
+            return False
+        return True
+
+
+def perl_log_content_to_database(job_command, log_file_name, log_text, is_failure, artifact_id, runbot_id):
+    """
+    Legacy path: escapes the whole log into a Perl one-liner and calls MIS::Jobs::log_content_to_database
+    OUTPUT: is_success (bool)
+    """
+    log_text = log_text.replace("'", "")
+    params = "'{}', '{}', '{}', {}, {}, {}".format(job_command, log_file_name, log_text, is_failure, artifact_id, runbot_id)
+    mod_to_call = "if (! MIS::Jobs::log_content_to_database(" + params + ")) {exit 1;} else {exit 0;}"
+    try:
+        return subprocess.call(["perl", "-mMIS::Jobs", "-e", mod_to_call]) == 0
+    except OSError as e:
+        logerr(f"{script_arrow} Perl log writer failed to start: {e}")
+        return False
+
+
+def benchmark_log_writer(db_path, log_bytes=50_000_000, background=True, compare_perl=False):
+    """
+    INPUT: db_path (str), log_bytes (int), background (bool), compare_perl (bool)
+           - Writes a synthetic log through ChunkedLogWriter into SqliteLogSink, reads it back, and optionally
+             times the legacy Perl path on the same text (requires perl and MIS::Jobs on this host)
+
+    OUTPUT: dict of timings in seconds
+    """
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    line = "2024-06-03 12:00:00 INFO step completed; rows processed: 123456\n"
+    log_text = line * max(1, log_bytes // len(line))
+    sink = SqliteLogSink(db_path)
+
+    start = time.monotonic()
+    writer = ChunkedLogWriter(sink, "runjob bench job", "/tmp/bench.log", 0, 0, 0, background=background)
+    writer.write(log_text)
+    is_success = writer.close()
+    results = {'native_write': time.monotonic() - start}
+
+    start = time.monotonic()
+    read_back = sum(len(chunk) for chunk in sink.iter_chunks(writer.log_id))
+    results['native_read'] = time.monotonic() - start
+    if not is_success or read_back != len(log_text):
+        logerr(f"{script_arrow} Read back {read_back} of {len(log_text)} characters")
+
+    if compare_perl:
+        start = time.monotonic()
+        perl_log_content_to_database("runjob bench job", "/tmp/bench.log", log_text, 0, 0, 0)
+        results['perl_write'] = time.monotonic() - start
+
+    logmsg(f"{script_arrow} {len(log_text) / 1e6:.1f} MB in {writer.chunk_count} chunk(s): "
+           + ", ".join(f"{k}={v:.2f}s" for k, v in results.items()))
+    sink.close()
+    return results
+
+
+if __name__ == "__main__":
+    # Usage: runbot_log_sink.py [db_path] [log_bytes] [--perl]
+    args = [a for a in sys.argv[1:] if a != '--perl']
+    benchmark_log_writer(args[0] if args else "/tmp/runbot_log_bench.db",
+                         int(args[1]) if len(args) > 1 else 50_000_000,
+                         compare_perl='--perl' in sys.argv)
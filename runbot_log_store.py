@@ -0,0 +1,235 @@
+""" Purpose: Per-run indexed, rotating and compressed store for RunBot's NAS logfiles """
+#!/bin/env python3
+
+########################################################################
+# Every run appended to a RunBot log (<log>) is a segment recorded in  #
+# a small JSON index beside it (<log>.idx.json): run label, file,      #
+# byte offset and length. The active <log> keeps only the newest runs; #
+# older ones are rotated into <log>.<seq>.gz, one gzip member per run, #
+# so any run is read back with a single seek. Archives beyond          #
+# ARCHIVE_KEEP_RUNS runs are deleted.                                  #
+########################################################################
+
+import os
+import json
+import time
+import gzip
+import fcntl
+import argparse
+import contextlib
+
+from cs_logging import logmsg, logwarning
+
+script_arrow = str(os.path.basename(__file__)) + " ->"
+
+ROTATE_BYTES = int(os.getenv('RUNBOT_LOG_ROTATE_BYTES', 64 * 1024 * 1024))
+KEEP_PLAIN_RUNS = int(os.getenv('RUNBOT_LOG_KEEP_PLAIN_RUNS', 1))      # finished runs left uncompressed in the active log
+ARCHIVE_KEEP_RUNS = int(os.getenv('RUNBOT_LOG_ARCHIVE_KEEP_RUNS', 30))
+COPY_CHUNK_BYTES = 1024 * 1024
+RUN_SEPARATOR = "\n\n#############################\n{marker}\n#############################\n"
+
+
+def _copy_range(src, dst, offset, length):
+    src.seek(offset)
+    while length > 0:
+        data = src.read(min(COPY_CHUNK_BYTES, length))
+        if not data:
+            break
+        dst.write(data)
+        length -= len(data)
+
+
+class RunLogStore:
+    """
+    begin_run() starts a new segment at the end of the active log (rotating older runs first), end_run() closes it;
+    read_run() returns one run's text, from the active log or an archive
+    """
+    def __init__(self, log_path, marker=None) -> None:
+        self.log_path = log_path
+        self.index_path = log_path + ".idx.json"
+        self.marker = marker
+        self.current = None
+
+
+    @contextlib.contextmanager
+    def __locked(self):
+        with open(self.index_path + ".lock", 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+
+    def __load(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {'next_run_id': 1, 'next_archive': 1, 'runs': []}
+        size = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+        plain = [run for run in index['runs'] if not run['compressed']]
+        if size and not plain:
+            # Output written before the store existed (or by an older RunBot) becomes one legacy segment
+            index['runs'].append({'run_id': index['next_run_id'], 'label': 'legacy', 'file': os.path.basename(self.log_path),
+                                  'offset': 0, 'length': size, 'raw_length': size, 'compressed': False,
+                                  'started_ts': os.path.getmtime(self.log_path), 'finished_ts': os.path.getmtime(self.log_path)})
+            index['next_run_id'] += 1
+        return index
+
+
+    def __save(self, index):
+        tmp_path = f"{self.index_path}.{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+
+    def begin_run(self, label):
+        """
+        INPUT: label (str), e.g. the runbot_id
+        OUTPUT: the new run's index entry (dict); the run separator is written when the active log already has runs
+        """
+        with self.__locked():
+            index = self.__load()
+            self.__rotate(index)
+            offset = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+            if offset and self.marker:
+                with open(self.log_path, 'a') as f:
+                    f.write(RUN_SEPARATOR.format(marker=self.marker))
+                offset = os.path.getsize(self.log_path)
+            self.current = {'run_id': index['next_run_id'], 'label': str(label), 'file': os.path.basename(self.log_path),
+                            'offset': offset, 'length': None, 'raw_length': None, 'compressed': False,
+                            'started_ts': time.time(), 'finished_ts': None}
+            index['next_run_id'] += 1
+            index['runs'].append(self.current)
+            self.__save(index)
+            if not offset:
+                open(self.log_path, 'a').close()
+        return self.current
+
+
+    def end_run(self):
+        """
+        OUTPUT: the finished run's index entry (dict), with its length, or None if no run was begun
+        """
+        if self.current is None:
+            return None
+        with self.__locked():
+            index = self.__load()
+            run = next((r for r in index['runs'] if r['run_id'] == self.current['run_id']), None)
+            if run is not None:
+                run['length'] = run['raw_length'] = os.path.getsize(self.log_path) - run['offset']
+                run['finished_ts'] = time.time()
+                self.__save(index)
+            self.current = None
+        return run
+
+
+    def __rotate(self, index):
+        """
+        Compresses finished plain runs older than the newest KEEP_PLAIN_RUNS into a new archive and rewrites the
+        active log with what is left. Only called between runs, under the index lock
+        """
+        plain = [run for run in index['runs'] if not run['compressed']]
+        if any(run['length'] is None for run in plain):
+            # A run that never finished (killed RunBot): close it at the current end of the log
+            size = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+            for run in plain:
+                if run['length'] is None:
+                    run['length'] = run['raw_length'] = max(0, size - run['offset'])
+                    run['finished_ts'] = run['finished_ts'] or time.time()
+        active_size = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+        # Past ROTATE_BYTES even the newest runs are compressed
+        to_archive = plain[:-KEEP_PLAIN_RUNS] if KEEP_PLAIN_RUNS and active_size < ROTATE_BYTES else plain
+        if not to_archive:
+            return
+
+        archive_name = f"{os.path.basename(self.log_path)}.{index['next_archive']}.gz"
+        archive_path = os.path.join(os.path.dirname(self.log_path), archive_name)
+        index['next_archive'] += 1
+        with open(self.log_path, 'rb') as src, open(archive_path, 'ab') as dst:
+            for run in to_archive:
+                start = dst.tell()
+                with gzip.GzipFile(filename="", mode='wb', fileobj=dst, mtime=int(run['started_ts'])) as member:
+                    _copy_range(src, member, run['offset'], run['length'])
+                run.update({'file': archive_name, 'offset': start, 'length': dst.tell() - start, 'compressed': True})
+
+            kept = [run for run in plain if not run['compressed']]
+            tmp_path = f"{self.log_path}.{os.getpid()}"
+            with open(tmp_path, 'wb') as dst_active:
+                if kept:
+                    shift = kept[0]['offset']
+                    _copy_range(src, dst_active, shift, active_size - shift)
+                    for run in kept:
+                        run['offset'] -= shift
+            os.chmod(tmp_path, os.stat(self.log_path).st_mode & 0o7777)
+            os.replace(tmp_path, self.log_path)
+        logmsg(f"{script_arrow} Rotated {len(to_archive)} run(s) of {self.log_path} into {archive_name} "
+               f"({sum(r['raw_length'] for r in to_archive)} -> {sum(r['length'] for r in to_archive)} bytes)")
+        self.__prune(index)
+
+
+    def __prune(self, index):
+        archived = [run for run in index['runs'] if run['compressed']]
+        dropped = archived[:-ARCHIVE_KEEP_RUNS] if len(archived) > ARCHIVE_KEEP_RUNS else []
+        if not dropped:
+            return
+        index['runs'] = [run for run in index['runs'] if run not in dropped]
+        still_used = {run['file'] for run in index['runs']}
+        for archive_name in {run['file'] for run in dropped} - still_used:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(os.path.dirname(self.log_path), archive_name))
+
+
+    def list_runs(self):
+        """
+        OUTPUT: index entries (list of dict), oldest first
+        """
+        with self.__locked():
+            return self.__load()['runs']
+
+
+    def read_run(self, run_id=None, label=None):
+        """
+        INPUT: run_id (int, optional) or label (str, optional); the latest run by default, or the latest with label
+        OUTPUT: that run's log text (str), or None if it is not in the index
+        """
+        runs = self.list_runs()
+        if run_id is not None:
+            runs = [run for run in runs if run['run_id'] == run_id]
+        elif label is not None:
+            runs = [run for run in runs if run['label'] == str(label)]
+        if not runs:
+            return None
+        run = runs[-1]
+        path = os.path.join(os.path.dirname(self.log_path), run['file'])
+        length = run['length'] if run['length'] is not None else os.path.getsize(path) - run['offset']
+        with open(path, 'rb') as f:
+            f.seek(run['offset'])
+            data = f.read(length)
+        if run['compressed']:
+            data = gzip.decompress(data)
+        return data.decode('utf-8', errors='replace')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List or print runs of a RunBot logfile")
+    parser.add_argument('log_path')
+    parser.add_argument('--run', type=int, help="run_id to print (default: latest)")
+    parser.add_argument('--label', help="print the latest run with this label (e.g. runbot_id)")
+    parser.add_argument('--list', action='store_true', help="list the runs in the index")
+    args = parser.parse_args()
+
+    store = RunLogStore(args.log_path)
+    if args.list:
+        for run in store.list_runs():
+            print(f"{run['run_id']:>5} {run['label']:>12} {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(run['started_ts']))} "
+                  f"{run['raw_length'] or 0:>12} bytes {'in ' + run['file'] if run['compressed'] else ''}")
+        return
+    text = store.read_run(args.run, args.label)
+    if text is None:
+        logwarning(f"{script_arrow} No such run in {store.index_path}")
+        raise SystemExit(1)
+    print(text, end="")
+
+
+if __name__ == "__main__":
+    main()
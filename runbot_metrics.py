@@ -0,0 +1,249 @@
+""" Purpose: Per-phase timing, child process rusage and DB/Jira call accounting for RunBot runs """
+#!/bin/env python3
+
+########################################################################
+# One Metrics object per run (per request in a daemon worker) records  #
+# wall time per phase, rusage of every child command, and call counts #
+# and latencies by kind (db, jira). finish() exports the run:          #
+#   - one JSON line per run appended to RUNBOT_METRICS_JSONL           #
+#   - cumulative counters rewritten atomically to RUNBOT_METRICS_PROM  #
+#     in Prometheus textfile format (node_exporter textfile collector) #
+########################################################################
+
+import os
+import sys
+import json
+import time
+import fcntl
+import resource
+import threading
+import contextlib
+
+from cs_logging import logmsg, logwarning
+
+script_arrow = str(os.path.basename(__file__)) + " ->"
+
+METRICS_DIR = os.getenv('RUNBOT_METRICS_DIR', "/NAS/mis/tmp/_runbot/metrics")
+JSONL_PATH = os.getenv('RUNBOT_METRICS_JSONL', os.path.join(METRICS_DIR, "runbot_runs.jsonl"))
+PROM_PATH = os.getenv('RUNBOT_METRICS_PROM', os.path.join(METRICS_DIR, "runbot.prom"))
+
+_metrics = None
+_metrics_pid = None
+
+
+def get_metrics():
+    """
+    OUTPUT: this process's current Metrics (a forked worker starts its own)
+    """
+    global _metrics, _metrics_pid
+    if _metrics is None or _metrics_pid != os.getpid():
+        _metrics, _metrics_pid = Metrics(), os.getpid()
+    return _metrics
+
+
+def start_run(**labels):
+    """
+    INPUT: labels (str -> value), recorded with the run, e.g. runbot_id=123
+    OUTPUT: a fresh Metrics that becomes this process's current one
+    """
+    global _metrics, _metrics_pid
+    _metrics, _metrics_pid = Metrics(labels), os.getpid()
+    return _metrics
+
+
+def _db_stats():
+    # Only read the session if this process already has one; never import or connect just for metrics
+    runbot_db = sys.modules.get('runbot_db')
+    session = getattr(runbot_db, '_session', None) if runbot_db and getattr(runbot_db, '_session_pid', None) == os.getpid() else None
+    return {label: dict(s) for label, s in (session.stats if session else {}).items()}
+
+
+class Metrics:
+    """
+    Thread-safe accumulator for a single run; the Jira outbox drainer and LeaseKeeper threads record into it too
+    """
+    def __init__(self, labels=None) -> None:
+        self.labels = dict(labels or {})
+        self.started = time.time()
+        self.phases = {}     # name -> {'count', 'seconds'}
+        self.calls = {}      # (kind, label) -> {'count', 'seconds', 'errors'}
+        self.children = {}   # label -> {'count', 'user_seconds', 'system_seconds', 'max_rss_kb'}
+        self.__start = time.monotonic()
+        self.__lock = threading.Lock()
+        self.__db_baseline = _db_stats()
+
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Times the enclosed block as phase name; repeated phases accumulate
+        """
+        start = time.monotonic()
+        try:
+            yield self
+        finally:
+            self.add_phase(name, time.monotonic() - start)
+
+
+    def add_phase(self, name, seconds, count=1):
+        with self.__lock:
+            phase = self.phases.setdefault(name, {'count': 0, 'seconds': 0.0})
+            phase['count'] += count
+            phase['seconds'] += seconds
+
+
+    def add_startup(self, timer):
+        """
+        INPUT: timer (runbot_probe.StartupTimer); its phases are recorded as 'startup.<phase>'
+        """
+        for name, seconds in timer.as_dict()['phases'].items():
+            self.add_phase(f"startup.{name}", seconds)
+
+
+    @contextlib.contextmanager
+    def timed_call(self, kind, label):
+        """
+        Times one external call (e.g. kind='jira', label='add_comment'); an exception counts as an error
+        """
+        start, ok = time.monotonic(), False
+        try:
+            yield
+            ok = True
+        finally:
+            self.observe(kind, label, time.monotonic() - start, ok)
+
+
+    def observe(self, kind, label, seconds, ok=True):
+        with self.__lock:
+            call = self.calls.setdefault((kind, label), {'count': 0, 'seconds': 0.0, 'errors': 0})
+            call['count'] += 1
+            call['seconds'] += seconds
+            call['errors'] += 0 if ok else 1
+
+
+    def record_child(self, label, rusage, count=1):
+        """
+        INPUT: label (str), rusage (resource.struct_rusage) of the reaped child(ren), count (int, optional)
+        """
+        with self.__lock:
+            child = self.children.setdefault(label, {'count': 0, 'user_seconds': 0.0, 'system_seconds': 0.0, 'max_rss_kb': 0})
+            child['count'] += count
+            child['user_seconds'] += rusage.ru_utime
+            child['system_seconds'] += rusage.ru_stime
+            child['max_rss_kb'] = max(child['max_rss_kb'], rusage.ru_maxrss)
+
+
+    @contextlib.contextmanager
+    def children_of(self, label, count=1):
+        """
+        Records the CPU of children reaped inside the block (RUSAGE_CHILDREN delta), for runners such as asyncio
+        that don't expose per-child rusage. max_rss_kb is then the largest child this process has ever reaped
+        """
+        before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        try:
+            yield
+        finally:
+            after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            delta = resource.struct_rusage((after.ru_utime - before.ru_utime, after.ru_stime - before.ru_stime, after.ru_maxrss)
+                                           + tuple(after)[3:])
+            self.record_child(label, delta, count)
+
+
+    def snapshot(self):
+        """
+        OUTPUT: dict describing the run so far; DB calls come from the runbot_db session, net of the run's start
+        """
+        calls = {f"{kind}:{label}": dict(c) for (kind, label), c in self.calls.items()}
+        for label, s in _db_stats().items():
+            base = self.__db_baseline.get(label, {'calls': 0, 'seconds': 0.0})
+            if s['calls'] > base['calls']:
+                calls[f"db:{label}"] = {'count': s['calls'] - base['calls'], 'seconds': s['seconds'] - base['seconds'], 'errors': 0}
+        return {'ts': self.started, 'host': os.uname().nodename, 'pid': os.getpid(), **self.labels,
+                'wall_seconds': time.monotonic() - self.__start,
+                'phases': {name: dict(p) for name, p in self.phases.items()},
+                'calls': calls,
+                'children': {label: dict(c) for label, c in self.children.items()}}
+
+
+    def finish(self, outcome, **fields):
+        """
+        INPUT: outcome (str), e.g. the final status_cd or 'EMPTY'; fields are added to the JSON line
+               - Exports the run; failures to write metrics are logged and never fail the run
+        OUTPUT: snapshot (dict)
+        """
+        record = {**self.snapshot(), 'outcome': outcome, **fields}
+        logmsg(f"{script_arrow} Run took {record['wall_seconds']:.1f}s: " + ", ".join(
+            f"{name}={p['seconds']:.2f}s" for name, p in sorted(record['phases'].items(), key=lambda item: -item[1]['seconds'])))
+        try:
+            os.makedirs(os.path.dirname(JSONL_PATH), exist_ok=True)
+            with open(JSONL_PATH, 'a') as f:
+                f.write(json.dumps(record, default=str) + "\n")
+            update_prometheus_textfile(record)
+        except OSError as e:
+            logwarning(f"{script_arrow} Could not export run metrics to {METRICS_DIR}: {e}")
+        return record
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _merge_totals(totals, record):
+    def add(name, labels, value):
+        key = json.dumps([name, sorted(labels.items())])
+        totals[key] = totals.get(key, 0) + value
+
+    add('runbot_runs_total', {'outcome': record['outcome']}, 1)
+    add('runbot_run_seconds_total', {}, record['wall_seconds'])
+    for name, p in record['phases'].items():
+        add('runbot_phase_seconds_total', {'phase': name}, p['seconds'])
+        add('runbot_phase_count_total', {'phase': name}, p['count'])
+    for key, c in record['calls'].items():
+        kind, _, label = key.partition(':')
+        add('runbot_calls_total', {'kind': kind, 'call': label}, c['count'])
+        add('runbot_call_seconds_total', {'kind': kind, 'call': label}, c['seconds'])
+        add('runbot_call_errors_total', {'kind': kind, 'call': label}, c['errors'])
+    for label, c in record['children'].items():
+        add('runbot_child_processes_total', {'command': label}, c['count'])
+        add('runbot_child_cpu_seconds_total', {'command': label, 'mode': 'user'}, c['user_seconds'])
+        add('runbot_child_cpu_seconds_total', {'command': label, 'mode': 'system'}, c['system_seconds'])
+
+
+def _render_prometheus(totals, record):
+    lines, typed = [], set()
+    gauges = [('runbot_last_run_timestamp_seconds', {}, record['ts'] + record['wall_seconds']),
+              ('runbot_last_run_seconds', {}, record['wall_seconds'])]
+    gauges += [('runbot_last_run_child_max_rss_bytes', {'command': label}, c['max_rss_kb'] * 1024)
+               for label, c in record['children'].items()]
+    series = [(*json.loads(key), value, 'counter') for key, value in sorted(totals.items())]
+    series += [(name, sorted(labels.items()), value, 'gauge') for name, labels, value in gauges]
+    for name, labels, value, metric_type in series:
+        if name not in typed:
+            lines.append(f"# TYPE {name} {metric_type}")
+            typed.add(name)
+        label_tx = ",".join(f'{k}="{_label_value(v)}"' for k, v in labels)
+        value = round(value, 6)
+        lines.append(f"{name}{{{label_tx}}} {value}" if label_tx else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def update_prometheus_textfile(record, prom_path=None):
+    """
+    INPUT: record (dict) from Metrics.finish(), prom_path (str, optional)
+           - Adds the run to the cumulative totals kept beside the textfile and rewrites it atomically.
+             A file lock serializes concurrent writers (one-shot runs, daemon workers)
+    """
+    prom_path = prom_path or PROM_PATH
+    os.makedirs(os.path.dirname(prom_path) or ".", exist_ok=True)
+    with open(prom_path + ".lock", 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(prom_path + ".totals.json") as f:
+                totals = json.load(f)
+        except (OSError, ValueError):
+            totals = {}
+        _merge_totals(totals, record)
+        for path, text in ((prom_path + ".totals.json", json.dumps(totals)), (prom_path, _render_prometheus(totals, record))):
+            with open(path + f".{os.getpid()}", 'w') as f:
+                f.write(text)
+            os.replace(path + f".{os.getpid()}", path)
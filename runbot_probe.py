@@ -0,0 +1,121 @@
+""" Purpose: Millisecond empty-queue probe and startup timing breakdown for RunBot_Script.py """
+#!/bin/env python3
+
+########################################################################
+# Imported by RunBot_Script.py before anything heavy. In probe mode a  #
+# single indexed query decides whether this tick has work; if not, the #
+# process exits without importing runbot_library/Jira or syncing Jira  #
+# statuses. StartupTimer records where startup time goes, logged per   #
+# run and optionally appended as JSON lines to RUNBOT_STARTUP_TIMINGS. #
+########################################################################
+
+import os
+import sys
+import json
+import time
+_import_started = time.perf_counter()
+
+import runbot_queue
+from cs_logging import logmsg, logwarning
+
+script_arrow = str(os.path.basename(__file__)) + " ->"
+
+STARTUP_TIMINGS_PATH = os.getenv('RUNBOT_STARTUP_TIMINGS')
+
+
+def _process_age():
+    """
+    OUTPUT: seconds (float) since this process was exec'd, or None where /proc is unavailable
+            - Covers interpreter boot and every import that ran before this module
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22 (starttime, in clock ticks since boot); comm may contain spaces, so split after its ')'
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupTimer:
+    """
+    Splits startup into named phases: mark(phase) closes the phase that ran since the previous mark.
+    The first phase starts when this module began importing its own dependencies
+    """
+    def __init__(self) -> None:
+        self.last = _import_started
+        self.phases = {}
+        age = _process_age()
+        if age is not None:
+            # Everything before this module started importing: interpreter boot plus the script's own light imports
+            self.phases['interpreter'] = round(max(0.0, age - (time.perf_counter() - _import_started)), 4)
+        self.reported = False
+
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = round(self.phases.get(phase, 0.0) + now - self.last, 4)
+        self.last = now
+
+
+    def as_dict(self):
+        return {'phases': dict(self.phases), 'total': round(sum(self.phases.values()), 4)}
+
+
+    def report(self, outcome):
+        """
+        INPUT: outcome (str), e.g. 'empty', 'claimed', 'daemon'
+               - Logs the breakdown once and, if RUNBOT_STARTUP_TIMINGS is set, appends it as a JSON line
+        """
+        if self.reported:
+            return
+        self.reported = True
+        timings = self.as_dict()
+        logmsg(f"{script_arrow} Startup ({outcome}) took {timings['total'] * 1000:.1f}ms: "
+               + ", ".join(f"{phase}={seconds * 1000:.1f}ms" for phase, seconds in timings['phases'].items()))
+        if not STARTUP_TIMINGS_PATH:
+            return
+        try:
+            with open(STARTUP_TIMINGS_PATH, 'a') as f:
+                f.write(json.dumps({'ts': time.time(), 'host': os.uname().nodename, 'pid': os.getpid(),
+                                    'outcome': outcome, **timings}) + "\n")
+        except OSError as e:
+            logwarning(f"{script_arrow} Could not append startup timings to {STARTUP_TIMINGS_PATH}: {e}")
+
+
+def is_probe_run(argv):
+    """
+    INPUT: argv (list of str), normally sys.argv[1:]
+    OUTPUT: True if the empty-queue fast path applies (--probe given, not a daemon run)
+    """
+    return '--probe' in argv and '--daemon' not in argv
+
+
+def has_claimable_rows(backend=None):
+    """
+    INPUT: backend (runbot_queue.QueueBackend, optional); defaults to runbot_queue.get_default_backend()
+    OUTPUT: True if there is anything to claim or reclaim. A failed probe returns True, so the full
+            startup path (and its error handling) runs instead of silently skipping work
+    """
+    try:
+        return (backend or runbot_queue.get_default_backend()).has_claimable_rows()
+    except Exception as e:
+        logwarning(f"{script_arrow} Queue probe failed; continuing with full startup. Exception: {e}")
+        return True
+
+
+def exit_if_queue_empty(timer, backend=None):
+    """
+    INPUT: timer (StartupTimer), backend (runbot_queue.QueueBackend, optional)
+           - Exits the process with status 0 when the queue is empty; returns otherwise
+    """
+    timer.mark('probe_imports')
+    is_work_queued = has_claimable_rows(backend)
+    timer.mark('probe_query')
+    if is_work_queued:
+        return
+    logmsg(f"{script_arrow} MIS_Reports.jobs.RUNJOB_REQUEST_T has no claimable rows. Exiting...")
+    timer.report('empty')
+    sys.exit(0)
@@ -0,0 +1,749 @@
+""" Purpose: Pluggable queue backends for mis_reports.jobs.RUNJOB_REQUEST_T (claiming, leases, Jira status sync) """
+#!/bin/env python3
+
+########################################################################
+# Every backend claims rows atomically in batches and stamps them with #
+# an owner token and a lease expiry. Owners renew their leases while   #
+# a job runs; rows whose lease expired (crashed host) are reclaimed.   #
+#   - MssqlQueueBackend:  production, via the RUNJOB_REQUEST_* sprocs  #
+#   - SqliteQueueBackend: local reference implementation for testing  #
+########################################################################
+
+import os
+import sys
+import time
+import sqlite3
+import threading
+
+import runbot_db
+from cs_logging import logmsg, logerr, logwarning
+
+script_arrow = str(os.path.basename(__file__)) + " ->"
+
+CLAIMABLE_JOB_TYPES = ('RERUN_REPORT', 'RELOAD_TABLE')
+FINAL_JIRA_STATUSES = ('Done', 'Done - With Issues', 'Failed', 'Cancelled')
+JIRA_SYNC_WINDOW_DAYS = 7
+STATUS_JOB_TYPES = ('RERUN_REPORT', 'RELOAD_TABLE', 'ONE_TIME_SQL_IMP_DML', 'SELF_SERVICE')
+STATUS_WINDOW_DAYS = 20
+STATUS_COLUMNS = ('ID', 'JIRA_ISSUE_ID', 'SCHWAB_ID', 'JOB_TYPE', 'ARTIFACT_ID', 'JOB_NM', 'RUNJOB_CMD', 'START_STEP_ID',
+                  'QUEUE_TS', 'EXECUTION_START_TS', 'EXECUTION_END_TS', 'STATUS_CD', 'RUN_ID', 'JIRA_STATUS_TX')
+# Claim order: shortest expected runtime first, each second of queue wait taking AGING_FACTOR seconds off a request's
+# expected runtime so long jobs are not starved. Expected runtimes are rolling (EWMA) estimates kept per command,
+# job_nm, artifact_id and job_type in RUNJOB_DURATION_ESTIMATE_T; RUNBOT_SCHEDULING_POLICY=FIFO claims by ID
+SCHEDULING_POLICY = os.getenv('RUNBOT_SCHEDULING_POLICY', 'SHORTEST_EXPECTED_FIRST').upper()
+AGING_FACTOR = float(os.getenv('RUNBOT_SCHED_AGING_FACTOR', 2.0))
+DEFAULT_ESTIMATE_SECONDS = float(os.getenv('RUNBOT_SCHED_DEFAULT_SECONDS', 900)) # requests with no history at all
+ESTIMATE_ALPHA = float(os.getenv('RUNBOT_SCHED_ESTIMATE_ALPHA', 0.3))            # weight of the newest run in the estimate
+ESTIMATE_KEY_LENGTH = 400
+LOCAL_DB_PATH = os.getenv('RUNBOT_LOCAL_DB') # SQLite stand-in for the queue and log tables (offline benchmarks); unset in production
+
+
+class QueueBackend:
+    """
+    Interface every queue backend implements. Rows are returned as dicts with lower-cased column names,
+    matching the shape of runbot_library.get_next_row_dict()
+    """
+    def has_claimable_rows(self):
+        """ OUTPUT: True if a row is claimable or an expired lease is waiting to be reclaimed (indexed lookup, no locks taken) """
+        raise NotImplementedError
+
+    def claim_rows(self, owner_token, batch_size=1, lease_seconds=900):
+        """ OUTPUT: list of claimed row dicts (status 'QUEUED', owned by owner_token) """
+        raise NotImplementedError
+
+    def renew_lease(self, owner_token, ids, lease_seconds=900):
+        """ OUTPUT: number of rows (int) whose lease was extended """
+        raise NotImplementedError
+
+    def reclaim_expired(self):
+        """ OUTPUT: list of ids whose lease expired and were returned to 'NEW' """
+        raise NotImplementedError
+
+    def release_rows(self, owner_token, ids):
+        """ OUTPUT: number of rows (int) returned to 'NEW' without being run """
+        raise NotImplementedError
+
+    def get_outstanding_jira_statuses(self):
+        """ OUTPUT: dict of JIRA_ISSUE_ID -> JIRA_STATUS_TX for unfinished requests from the last 7 days """
+        raise NotImplementedError
+
+    def get_active_requests(self):
+        """ OUTPUT: list of row dicts (id, status_cd, job_type, artifact_id, job_nm, runjob_cmd) of claimable job types
+                    that are 'NEW', 'QUEUED' or 'RUNNING', ordered by ID """
+        raise NotImplementedError
+
+    def attach_followers(self, leader_id, ids, owner_token=None):
+        """
+        Marks ids 'FOLLOWING' leader_id, provided each is still 'NEW' (or 'QUEUED' under owner_token)
+        and the leader is still 'QUEUED' or 'RUNNING'
+        OUTPUT: list of ids attached
+        """
+        raise NotImplementedError
+
+    def finish_followers(self, leader_id, final_status):
+        """ OUTPUT: list of follower row dicts moved to final_status, with the leader's RUN_ID and start time """
+        raise NotImplementedError
+
+    def bulk_update_jira_status(self, status_by_key):
+        """
+        INPUT: status_by_key (dict), JIRA_ISSUE_ID -> current Jira status
+        OUTPUT: number of rows (int) changed, written in a single transaction
+        """
+        raise NotImplementedError
+
+    def get_step_checkpoints(self, runbot_id):
+        """ OUTPUT: list of checkpoint dicts (step_id, step_hash_tx, status_cd, return_cd, duration_sec, attempt_ct) """
+        raise NotImplementedError
+
+    def heartbeat(self, owner_token, id, progress_tx=None):
+        """ Stamps HEARTBEAT_TS (and PROGRESS_TX) on a 'RUNNING' row owned by owner_token. OUTPUT: number of rows (int) updated """
+        raise NotImplementedError
+
+    def get_duration_history(self, job_type, limit=200):
+        """ OUTPUT: list of (runjob_cmd, seconds) for the most recent 'COMPLETE' requests of job_type, newest first """
+        raise NotImplementedError
+
+    def update_duration_estimates(self, id):
+        """
+        Folds the runtime of request id, if it is 'COMPLETE', into the rolling estimates for its command, job_nm,
+        artifact_id and job_type. OUTPUT: number of estimates (int) updated
+        """
+        raise NotImplementedError
+
+    def get_schedule(self):
+        """
+        OUTPUT: list of row dicts (id, status_cd, job_type, job_nm, artifact_id, runjob_cmd, est_seconds, est_basis_cd,
+                age_seconds, elapsed_seconds) of claimable job types that are 'RUNNING', 'QUEUED' or 'NEW', in that order;
+                'NEW' rows in the order they will be claimed
+        """
+        raise NotImplementedError
+
+    def save_step_checkpoint(self, runbot_id, step_id, step_hash, status_cd, returncode, duration, attempt):
+        """ Inserts or replaces the checkpoint for (runbot_id, step_id) """
+        raise NotImplementedError
+
+    def get_status_changes(self, since_version=0, since_id=0, page_size=200):
+        """
+        INPUT: since_version (int) change cursor, since_id (int) lower bound on ID, page_size (int)
+        OUTPUT: list of row dicts (STATUS_COLUMNS plus row_version and error_snippit_tx) changed after since_version,
+                ordered by row_version; only rows of STATUS_JOB_TYPES queued in the last STATUS_WINDOW_DAYS
+        """
+        raise NotImplementedError
+
+    def get_people(self, schwab_ids):
+        """ OUTPUT: dict of SCHWAB_ID -> {'display_nm', 'email_tx'} for the ids that exist """
+        raise NotImplementedError
+
+    def get_artifact_titles(self, artifact_ids):
+        """ OUTPUT: dict of ARTIFACT_ID -> title (str), formatted like TITLE_TX in RUNJOB_REQUEST_GET """
+        raise NotImplementedError
+
+
+class MssqlQueueBackend(QueueBackend):
+    """
+    Production backend; all locking happens inside the sprocs (UPDLOCK/READPAST), so hosts never block each other.
+    Statements run on the shared runbot_db session with bound parameters
+    """
+    def has_claimable_rows(self):
+        # Two index seeks in one round trip: RUNJOB_REQUEST_STATUS_IX for 'NEW' rows, RUNJOB_REQUEST_LEASE_IX for leases to reclaim.
+        # 'NEW' rows need a person and a title, as in RUNJOB_REQUEST_CLAIM, or the probe would wake for rows it can never claim
+        rows_list = runbot_db.get_session().query(
+            "SELECT CASE WHEN EXISTS (SELECT 1 FROM mis_reports.jobs.RUNJOB_REQUEST_T r WITH (NOLOCK) "
+            "WHERE r.STATUS_CD = 'NEW' AND r.JOB_TYPE IN ({}) AND r.QUEUE_TS >= getDate() - 20 "
+            "AND EXISTS (SELECT 1 FROM mis_data.dbo.SCHWAB_PERSON_DM per WITH (NOLOCK) WHERE per.SCHWAB_ID = r.SCHWAB_ID) "
+            "AND EXISTS (SELECT 1 FROM mis_reports.dbo.ARTFCT_DETAILS_VALUES_T ttl WITH (NOLOCK) "
+            "WHERE ttl.ARTFCT_ID = r.ARTIFACT_ID AND ttl.ATTRB_ID = 36)) "
+            "OR EXISTS (SELECT 1 FROM mis_reports.jobs.RUNJOB_REQUEST_T WITH (NOLOCK) "
+            "WHERE LEASE_EXPIRY_TS < getDate() AND STATUS_CD IN ('QUEUED', 'RUNNING')) "
+            "THEN 1 ELSE 0 END AS HAS_ROWS;".format(", ".join("?" for _ in CLAIMABLE_JOB_TYPES)),
+            CLAIMABLE_JOB_TYPES, label='RUNJOB_REQUEST_PROBE')
+        return bool(rows_list and rows_list[0].get('HAS_ROWS'))
+
+    def claim_rows(self, owner_token, batch_size=1, lease_seconds=900):
+        rows_list = runbot_db.get_session().query(
+            "EXEC MIS_Reports.jobs.RUNJOB_REQUEST_CLAIM @OWNER_TOKEN = ?, @BATCH_SIZE = ?, @LEASE_SECONDS = ?, "
+            "@SHORTEST_FIRST = ?, @AGING_FACTOR = ?, @DEFAULT_EST_SECONDS = ?;",
+            (owner_token, int(batch_size), int(lease_seconds), int(SCHEDULING_POLICY != 'FIFO'), AGING_FACTOR,
+             DEFAULT_ESTIMATE_SECONDS), label='RUNJOB_REQUEST_CLAIM')
+        return [{k.lower(): v for k, v in row.items()} for row in rows_list]
+
+    def renew_lease(self, owner_token, ids, lease_seconds=900):
+        if not ids:
+            return 0
+        rows_list = runbot_db.get_session().query(
+            "EXEC MIS_Reports.jobs.RUNJOB_REQUEST_RENEW_LEASE @OWNER_TOKEN = ?, @IDS = ?, @LEASE_SECONDS = ?;",
+            (owner_token, ",".join(str(int(i)) for i in ids), int(lease_seconds)), label='RUNJOB_REQUEST_RENEW_LEASE')
+        return rows_list[0].get('RENEWED_CT', 0) if rows_list else 0
+
+    def reclaim_expired(self):
+        rows_list = runbot_db.get_session().query("EXEC MIS_Reports.jobs.RUNJOB_REQUEST_RECLAIM;", label='RUNJOB_REQUEST_RECLAIM')
+        return [row.get('ID') for row in rows_list]
+
+    def release_rows(self, owner_token, ids):
+        session = runbot_db.get_session()
+        released = 0
+        with session.transaction():
+            for id in ids:
+                rows_list = session.query("EXEC MIS_Reports.jobs.RUNJOB_REQUEST_UPDATE @ID = ?, @STATUS = 'NEW', @OWNER_TOKEN = ?;",
+                                          (int(id), owner_token), label='RUNJOB_REQUEST_UPDATE')
+                released += rows_list[0].get('RELEASED_CT', 0) if rows_list else 0
+        return released
+
+    def get_outstanding_jira_statuses(self):
+        sql = """
+            SELECT  JIRA_ISSUE_ID, JIRA_STATUS_TX
+                FROM     mis_reports.jobs.RUNJOB_REQUEST_T
+            WHERE    (JIRA_STATUS_TX IS NULL OR
+                JIRA_STATUS_TX NOT IN({}))
+                AND EXECUTION_END_TS IS NULL
+                AND QUEUE_TS > getDate() - ?
+            ORDER BY ID;
+            """.format(", ".join("?" for _ in FINAL_JIRA_STATUSES))
+        rows_list = runbot_db.get_session().query(sql, (*FINAL_JIRA_STATUSES, JIRA_SYNC_WINDOW_DAYS), label='JIRA_STATUS_SELECT')
+        return {row.get('JIRA_ISSUE_ID'): row.get('JIRA_STATUS_TX') for row in rows_list if row.get('JIRA_ISSUE_ID')}
+
+    def bulk_update_jira_status(self, status_by_key):
+        if not status_by_key:
+            return 0
+        session = runbot_db.get_session()
+        update_sql = """
+            UPDATE r
+                SET r.JIRA_STATUS_TX = s.JIRA_STATUS_TX
+            FROM mis_reports.jobs.RUNJOB_REQUEST_T r
+                INNER JOIN #jira_status s ON r.JIRA_ISSUE_ID = s.JIRA_ISSUE_ID
+            WHERE r.JIRA_STATUS_TX IS NULL OR r.JIRA_STATUS_TX <> s.JIRA_STATUS_TX;
+            """
+        if session.is_native:
+            with session.transaction():
+                session.execute("CREATE TABLE #jira_status (JIRA_ISSUE_ID VARCHAR(50) PRIMARY KEY, JIRA_STATUS_TX VARCHAR(100));",
+                                label='JIRA_STATUS_STAGE')
+                session.executemany("INSERT INTO #jira_status VALUES (?, ?);", status_by_key.items(), label='JIRA_STATUS_STAGE')
+                rows_updated = session.execute(update_sql, label='JIRA_STATUS_UPDATE')
+                session.execute("DROP TABLE #jira_status;", label='JIRA_STATUS_STAGE')
+            return rows_updated
+
+        # cs_db fallback: one batch, staged with table value constructors (capped at 1000 rows per INSERT)
+        keys = list(status_by_key)
+        inserts = "\n".join("INSERT INTO #jira_status VALUES {};".format(", ".join("(?, ?)" for _ in keys[i:i + 1000]))
+                            for i in range(0, len(keys), 1000))
+        sql = """
+            SET NOCOUNT ON;
+            SET XACT_ABORT ON;
+            BEGIN TRANSACTION;
+            CREATE TABLE #jira_status (JIRA_ISSUE_ID VARCHAR(50) PRIMARY KEY, JIRA_STATUS_TX VARCHAR(100));
+            {}
+            {}
+            DECLARE @updated INT = @@ROWCOUNT;
+            COMMIT TRANSACTION;
+            DROP TABLE #jira_status;
+            SELECT @updated AS UPDATED_CT;
+            """.format(inserts, update_sql)
+        params = [value for key in keys for value in (key, status_by_key[key])]
+        rows_list = session.query(sql, params, label='JIRA_STATUS_UPDATE')
+        return rows_list[0].get('UPDATED_CT', 0) if rows_list else 0
+
+    def get_active_requests(self):
+        rows_list = runbot_db.get_session().query(
+            "SELECT ID, STATUS_CD, JOB_TYPE, ARTIFACT_ID, JOB_NM, RUNJOB_CMD FROM mis_reports.jobs.RUNJOB_REQUEST_T WITH (NOLOCK) "
+            "WHERE STATUS_CD IN ('NEW', 'QUEUED', 'RUNNING') AND JOB_TYPE IN ({}) AND QUEUE_TS >= getDate() - 20 ORDER BY ID;".format(
+                ", ".join("?" for _ in CLAIMABLE_JOB_TYPES)), CLAIMABLE_JOB_TYPES, label='RUNJOB_REQUEST_ACTIVE')
+        return [{k.lower(): v for k, v in row.items()} for row in rows_list]
+
+    def attach_followers(self, leader_id, ids, owner_token=None):
+        if not ids:
+            return []
+        rows_list = runbot_db.get_session().query(
+            "EXEC MIS_Reports.jobs.RUNJOB_REQUEST_ATTACH_FOLLOWERS @LEADER_ID = ?, @IDS = ?, @OWNER_TOKEN = ?;",
+            (int(leader_id), ",".join(str(int(id)) for id in ids), owner_token), label='RUNJOB_REQUEST_ATTACH_FOLLOWERS')
+        return [row.get('ID') for row in rows_list]
+
+    def finish_followers(self, leader_id, final_status):
+        rows_list = runbot_db.get_session().query(
+            "EXEC MIS_Reports.jobs.RUNJOB_REQUEST_FINISH_FOLLOWERS @LEADER_ID = ?, @STATUS = ?;",
+            (int(leader_id), final_status), label='RUNJOB_REQUEST_FINISH_FOLLOWERS')
+        return [{k.lower(): v for k, v in row.items()} for row in rows_list]
+
+    def heartbeat(self, owner_token, id, progress_tx=None):
+        rows_list = runbot_db.get_session().query(
+            "EXEC MIS_Reports.jobs.RUNJOB_REQUEST_HEARTBEAT @OWNER_TOKEN = ?, @ID = ?, @PROGRESS_TX = ?;",
+            (owner_token, int(id), progress_tx[:200] if progress_tx else None), label='RUNJOB_REQUEST_HEARTBEAT')
+        return rows_list[0].get('UPDATED_CT', 0) if rows_list else 0
+
+    def get_duration_history(self, job_type, limit=200):
+        # Seek on RUNJOB_REQUEST_HISTORY_IX
+        rows_list = runbot_db.get_session().query(
+            "SELECT TOP (?) RUNJOB_CMD, DATEDIFF(SECOND, EXECUTION_START_TS, EXECUTION_END_TS) AS DURATION_SEC "
+            "FROM mis_reports.jobs.RUNJOB_REQUEST_T WITH (NOLOCK) WHERE JOB_TYPE = ? AND STATUS_CD = 'COMPLETE' "
+            "AND EXECUTION_START_TS IS NOT NULL AND EXECUTION_END_TS IS NOT NULL ORDER BY ID DESC;",
+            (int(limit), job_type), label='RUNJOB_DURATION_HISTORY')
+        return [(row.get('RUNJOB_CMD'), row.get('DURATION_SEC')) for row in rows_list]
+
+    def update_duration_estimates(self, id):
+        rows_list = runbot_db.get_session().query(
+            "EXEC MIS_Reports.jobs.RUNJOB_DURATION_ESTIMATE_UPDATE @ID = ?, @ALPHA = ?;",
+            (int(id), ESTIMATE_ALPHA), label='RUNJOB_DURATION_ESTIMATE_UPDATE')
+        return rows_list[0].get('UPDATED_CT', 0) if rows_list else 0
+
+    def get_schedule(self):
+        rows_list = runbot_db.get_session().query(
+            "EXEC MIS_Reports.jobs.RUNJOB_REQUEST_SCHEDULE @SHORTEST_FIRST = ?, @AGING_FACTOR = ?, @DEFAULT_EST_SECONDS = ?;",
+            (int(SCHEDULING_POLICY != 'FIFO'), AGING_FACTOR, DEFAULT_ESTIMATE_SECONDS), label='RUNJOB_REQUEST_SCHEDULE')
+        return [{k.lower(): v for k, v in row.items()} for row in rows_list]
+
+    def get_step_checkpoints(self, runbot_id):
+        rows_list = runbot_db.get_session().query(
+            "SELECT STEP_ID, STEP_HASH_TX, STATUS_CD, RETURN_CD, DURATION_SEC, ATTEMPT_CT "
+            "FROM mis_reports.jobs.RUNJOB_STEP_CHECKPOINT_T WHERE RUNBOT_ID = ? ORDER BY STEP_ID;",
+            (int(runbot_id),), label='STEP_CHECKPOINT_SELECT')
+        return [{k.lower(): v for k, v in row.items()} for row in rows_list]
+
+    def save_step_checkpoint(self, runbot_id, step_id, step_hash, status_cd, returncode, duration, attempt):
+        runbot_db.get_session().execute("""
+            MERGE mis_reports.jobs.RUNJOB_STEP_CHECKPOINT_T WITH (HOLDLOCK) AS t
+            USING (SELECT ? AS RUNBOT_ID, ? AS STEP_ID, ? AS STEP_HASH_TX, ? AS STATUS_CD, ? AS RETURN_CD,
+                          ? AS DURATION_SEC, ? AS ATTEMPT_CT) AS s
+                ON t.RUNBOT_ID = s.RUNBOT_ID AND t.STEP_ID = s.STEP_ID
+            WHEN MATCHED THEN
+                UPDATE SET STEP_HASH_TX = s.STEP_HASH_TX, STATUS_CD = s.STATUS_CD, RETURN_CD = s.RETURN_CD,
+                           DURATION_SEC = s.DURATION_SEC, ATTEMPT_CT = s.ATTEMPT_CT, UPDATED_TS = getDate()
+            WHEN NOT MATCHED THEN
+                INSERT (RUNBOT_ID, STEP_ID, STEP_HASH_TX, STATUS_CD, RETURN_CD, DURATION_SEC, ATTEMPT_CT)
+                VALUES (s.RUNBOT_ID, s.STEP_ID, s.STEP_HASH_TX, s.STATUS_CD, s.RETURN_CD, s.DURATION_SEC, s.ATTEMPT_CT);
+            """, (int(runbot_id), int(step_id), step_hash, status_cd, returncode, float(duration), int(attempt)),
+            label='STEP_CHECKPOINT_SAVE')
+
+    def get_status_changes(self, since_version=0, since_id=0, page_size=200):
+        # Seek on RUNJOB_REQUEST_VERSION_IX; rows still being written (version >= MIN_ACTIVE_ROWVERSION) wait for the next
+        # poll, so a cursor never moves past an uncommitted change
+        sql = """
+            SELECT TOP (?) {}, CAST(j.ROW_VERSION_RV AS BIGINT) AS ROW_VERSION, l.ERROR_SNIPPIT_TX
+                FROM     mis_reports.jobs.RUNJOB_REQUEST_T j
+                    LEFT OUTER JOIN mis_reports.jobs.BATCH_FRAMEWORK_LOG_T l WITH(NOLOCK) ON j.RUN_ID = l.RUN_ID AND l.SEQ_ID = 1
+            WHERE    j.ROW_VERSION_RV > CAST(CAST(? AS BIGINT) AS BINARY(8))
+                AND j.ROW_VERSION_RV < MIN_ACTIVE_ROWVERSION()
+                AND j.ID > ?
+                AND j.QUEUE_TS >= getDate() - ?
+                AND j.JOB_TYPE IN ({})
+            ORDER BY j.ROW_VERSION_RV;
+            """.format(", ".join("j." + col for col in STATUS_COLUMNS), ", ".join("?" for _ in STATUS_JOB_TYPES))
+        rows_list = runbot_db.get_session().query(
+            sql, (int(page_size), int(since_version), int(since_id), STATUS_WINDOW_DAYS, *STATUS_JOB_TYPES), label='RUNJOB_STATUS_CHANGES')
+        return [{k.lower(): v for k, v in row.items()} for row in rows_list]
+
+    def get_people(self, schwab_ids):
+        if not schwab_ids:
+            return {}
+        rows_list = runbot_db.get_session().query(
+            "SELECT SCHWAB_ID, DISPLAY_NM, EMAIL_TX FROM mis_data.dbo.SCHWAB_PERSON_DM WITH(NOLOCK) WHERE SCHWAB_ID IN ({});".format(
+                ", ".join("?" for _ in schwab_ids)), list(schwab_ids), label='PERSON_LOOKUP')
+        return {row.get('SCHWAB_ID'): {'display_nm': row.get('DISPLAY_NM'), 'email_tx': row.get('EMAIL_TX')} for row in rows_list}
+
+    def get_artifact_titles(self, artifact_ids):
+        if not artifact_ids:
+            return {}
+        rows_list = runbot_db.get_session().query(
+            "SELECT ARTFCT_ID, ATTRB_ID, VAL_255 FROM mis_reports.dbo.ARTFCT_DETAILS_VALUES_T WITH(NOLOCK) "
+            "WHERE ATTRB_ID IN (35, 36) AND ARTFCT_ID IN ({});".format(", ".join("?" for _ in artifact_ids)),
+            [int(id) for id in artifact_ids], label='ARTIFACT_LOOKUP')
+        return format_artifact_titles((row.get('ARTFCT_ID'), row.get('ATTRB_ID'), row.get('VAL_255')) for row in rows_list)
+
+
+class SqliteQueueBackend(QueueBackend):
+    """
+    Reference implementation on a local SQLite file. BEGIN IMMEDIATE serializes claimers across processes,
+    which makes it suitable for multi-process contention and throughput testing
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS RUNJOB_REQUEST_T (
+            ID                  INTEGER PRIMARY KEY,
+            JIRA_ISSUE_ID       TEXT,
+            SCHWAB_ID           TEXT,
+            JOB_TYPE            TEXT,
+            ARTIFACT_ID         INTEGER,
+            JOB_NM              TEXT,
+            RUNJOB_CMD          TEXT,
+            START_STEP_ID       INTEGER,
+            QUEUE_TS            REAL DEFAULT (strftime('%s', 'now')),
+            EXECUTION_START_TS  REAL,
+            EXECUTION_END_TS    REAL,
+            STATUS_CD           TEXT DEFAULT 'NEW',
+            RUN_ID              TEXT,
+            JIRA_STATUS_TX      TEXT,
+            OWNER_TOKEN_TX      TEXT,
+            LEASE_EXPIRY_TS     REAL,
+            ROW_VERSION         INTEGER,
+            LEADER_ID           INTEGER,
+            HEARTBEAT_TS        REAL,
+            PROGRESS_TX         TEXT
+        );
+        CREATE INDEX IF NOT EXISTS RUNJOB_REQUEST_STATUS_IX ON RUNJOB_REQUEST_T (STATUS_CD, ID);
+        CREATE INDEX IF NOT EXISTS RUNJOB_REQUEST_LEASE_IX ON RUNJOB_REQUEST_T (LEASE_EXPIRY_TS);
+        CREATE INDEX IF NOT EXISTS RUNJOB_REQUEST_VERSION_IX ON RUNJOB_REQUEST_T (ROW_VERSION);
+        CREATE INDEX IF NOT EXISTS RUNJOB_REQUEST_LEADER_IX ON RUNJOB_REQUEST_T (LEADER_ID);
+        CREATE INDEX IF NOT EXISTS RUNJOB_REQUEST_HISTORY_IX ON RUNJOB_REQUEST_T (JOB_TYPE, STATUS_CD, ID);
+
+        -- stands in for MSSQL ROWVERSION: every insert/update stamps the row with the next database-wide version
+        CREATE TABLE IF NOT EXISTS ROW_VERSION_T (VERSION INTEGER NOT NULL);
+        INSERT INTO ROW_VERSION_T SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM ROW_VERSION_T);
+        CREATE TRIGGER IF NOT EXISTS RUNJOB_REQUEST_VERSION_INS AFTER INSERT ON RUNJOB_REQUEST_T BEGIN
+            UPDATE ROW_VERSION_T SET VERSION = VERSION + 1;
+            UPDATE RUNJOB_REQUEST_T SET ROW_VERSION = (SELECT VERSION FROM ROW_VERSION_T) WHERE ID = NEW.ID;
+        END;
+        CREATE TRIGGER IF NOT EXISTS RUNJOB_REQUEST_VERSION_UPD AFTER UPDATE ON RUNJOB_REQUEST_T
+            WHEN NEW.ROW_VERSION IS OLD.ROW_VERSION BEGIN
+            UPDATE ROW_VERSION_T SET VERSION = VERSION + 1;
+            UPDATE RUNJOB_REQUEST_T SET ROW_VERSION = (SELECT VERSION FROM ROW_VERSION_T) WHERE ID = NEW.ID;
+        END;
+
+        -- lookup tables joined by the status report
+        CREATE TABLE IF NOT EXISTS SCHWAB_PERSON_DM (SCHWAB_ID TEXT PRIMARY KEY, DISPLAY_NM TEXT, EMAIL_TX TEXT);
+        CREATE TABLE IF NOT EXISTS ARTFCT_DETAILS_VALUES_T (ARTFCT_ID INTEGER, ATTRB_ID INTEGER, VAL_255 TEXT,
+                                                            PRIMARY KEY (ARTFCT_ID, ATTRB_ID));
+        CREATE TABLE IF NOT EXISTS BATCH_FRAMEWORK_LOG_T (RUN_ID TEXT, SEQ_ID INTEGER, ERROR_SNIPPIT_TX TEXT,
+                                                          PRIMARY KEY (RUN_ID, SEQ_ID));
+
+        CREATE TABLE IF NOT EXISTS RUNJOB_DURATION_ESTIMATE_T (
+            KEY_TYPE_CD   TEXT NOT NULL,   -- 'CMD', 'JOB', 'ARTIFACT' or 'TYPE'
+            KEY_TX        TEXT NOT NULL,
+            EST_SECONDS   REAL NOT NULL,
+            SAMPLE_CT     INTEGER NOT NULL,
+            UPDATED_TS    REAL,
+            PRIMARY KEY (KEY_TYPE_CD, KEY_TX)
+        );
+
+        CREATE TABLE IF NOT EXISTS RUNJOB_STEP_CHECKPOINT_T (
+            RUNBOT_ID     INTEGER NOT NULL,
+            STEP_ID       INTEGER NOT NULL,
+            STEP_HASH_TX  TEXT NOT NULL,
+            STATUS_CD     TEXT NOT NULL,
+            RETURN_CD     INTEGER,
+            DURATION_SEC  REAL,
+            ATTEMPT_CT    INTEGER NOT NULL DEFAULT 1,
+            UPDATED_TS    REAL DEFAULT (strftime('%s', 'now')),
+            PRIMARY KEY (RUNBOT_ID, STEP_ID)
+        );
+        """
+
+    def __init__(self, db_path, timeout=30) -> None:
+        self.db_path = db_path
+        self.timeout = timeout
+        self.__local = threading.local()
+        self.conn.executescript(self.SCHEMA)
+
+    @property
+    def conn(self):
+        # One connection per thread: lease renewal and heartbeats run on background threads
+        if getattr(self.__local, 'conn', None) is None:
+            self.__local.conn = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
+            self.__local.conn.row_factory = sqlite3.Row
+            self.__local.conn.execute("PRAGMA journal_mode=WAL")
+        return self.__local.conn
+
+    def __transaction(self, fn):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(self.conn)
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+        return result
+
+    def has_claimable_rows(self):
+        return self.conn.execute(
+            "SELECT EXISTS (SELECT 1 FROM RUNJOB_REQUEST_T WHERE STATUS_CD = 'NEW' AND JOB_TYPE IN ({})) "
+            "OR EXISTS (SELECT 1 FROM RUNJOB_REQUEST_T WHERE STATUS_CD IN ('QUEUED', 'RUNNING') AND LEASE_EXPIRY_TS < ?)".format(
+                ", ".join("?" for _ in CLAIMABLE_JOB_TYPES)), (*CLAIMABLE_JOB_TYPES, time.time())).fetchone()[0] == 1
+
+    def enqueue(self, rows):
+        """
+        INPUT: rows (list of dict), column name -> value; used to seed a local queue
+        OUTPUT: None
+        """
+        def insert(conn):
+            for row in rows:
+                cols = list(row)
+                conn.execute("INSERT INTO RUNJOB_REQUEST_T ({}) VALUES ({})".format(
+                    ", ".join(cols), ", ".join("?" for _ in cols)), [row[c] for c in cols])
+        self.__transaction(insert)
+
+    # Same estimate lookup and claim order as RUNJOB_REQUEST_CLAIM: the most specific key with history wins
+    ESTIMATED_ROWS_SQL = """
+        SELECT * FROM (
+        SELECT r.*,
+               COALESCE(c.EST_SECONDS, j.EST_SECONDS, a.EST_SECONDS, t.EST_SECONDS, :default_est) AS EST_SECONDS,
+               CASE WHEN c.EST_SECONDS IS NOT NULL THEN 'CMD' WHEN j.EST_SECONDS IS NOT NULL THEN 'JOB'
+                    WHEN a.EST_SECONDS IS NOT NULL THEN 'ARTIFACT' WHEN t.EST_SECONDS IS NOT NULL THEN 'TYPE'
+                    ELSE 'DEFAULT' END AS EST_BASIS_CD,
+               :now - r.QUEUE_TS AS AGE_SECONDS,
+               :now - r.EXECUTION_START_TS AS ELAPSED_SECONDS
+        FROM RUNJOB_REQUEST_T r
+            LEFT OUTER JOIN RUNJOB_DURATION_ESTIMATE_T c ON c.KEY_TYPE_CD = 'CMD' AND c.KEY_TX = substr(trim(r.RUNJOB_CMD), 1, :key_length)
+            LEFT OUTER JOIN RUNJOB_DURATION_ESTIMATE_T j ON j.KEY_TYPE_CD = 'JOB' AND j.KEY_TX = r.JOB_NM
+            LEFT OUTER JOIN RUNJOB_DURATION_ESTIMATE_T a ON a.KEY_TYPE_CD = 'ARTIFACT' AND a.KEY_TX = CAST(r.ARTIFACT_ID AS TEXT)
+            LEFT OUTER JOIN RUNJOB_DURATION_ESTIMATE_T t ON t.KEY_TYPE_CD = 'TYPE' AND t.KEY_TX = r.JOB_TYPE
+        WHERE r.STATUS_CD IN ({statuses}) AND r.JOB_TYPE IN ({job_types})
+        ) e
+        ORDER BY CASE e.STATUS_CD WHEN 'RUNNING' THEN 0 WHEN 'QUEUED' THEN 1 ELSE 2 END,
+                 CASE WHEN :shortest_first = 1 THEN e.EST_SECONDS - :aging_factor * e.AGE_SECONDS ELSE 0 END, e.ID
+        """
+
+    def __estimated_rows(self, conn, statuses, limit=-1):
+        sql = self.ESTIMATED_ROWS_SQL.format(statuses=", ".join(f"'{status}'" for status in statuses),
+                                             job_types=", ".join(f"'{job_type}'" for job_type in CLAIMABLE_JOB_TYPES))
+        rows = conn.execute(sql + " LIMIT :limit", {'default_est': DEFAULT_ESTIMATE_SECONDS, 'now': time.time(),
+                                                    'key_length': ESTIMATE_KEY_LENGTH, 'shortest_first': int(SCHEDULING_POLICY != 'FIFO'),
+                                                    'aging_factor': AGING_FACTOR, 'limit': int(limit)})
+        return [{k.lower(): row[k] for k in row.keys()} for row in rows]
+
+    def claim_rows(self, owner_token, batch_size=1, lease_seconds=900):
+        def claim(conn):
+            rows = self.__estimated_rows(conn, ('NEW',), limit=batch_size)
+            if not rows:
+                return []
+            ids = [row['id'] for row in rows]
+            conn.execute("UPDATE RUNJOB_REQUEST_T SET STATUS_CD = 'QUEUED', OWNER_TOKEN_TX = ?, LEASE_EXPIRY_TS = ? "
+                         "WHERE ID IN ({})".format(", ".join("?" for _ in ids)), (owner_token, time.time() + lease_seconds, *ids))
+            for row in rows:
+                row.update(status_cd='QUEUED', owner_token_tx=owner_token, lease_expiry_ts=time.time() + lease_seconds)
+            return rows
+        return self.__transaction(claim)
+
+    def get_schedule(self):
+        return self.__estimated_rows(self.conn, ('RUNNING', 'QUEUED', 'NEW'))
+
+    def update_duration_estimates(self, id):
+        def update(conn):
+            row = conn.execute(
+                "SELECT RUNJOB_CMD, JOB_NM, ARTIFACT_ID, JOB_TYPE, EXECUTION_END_TS - EXECUTION_START_TS FROM RUNJOB_REQUEST_T "
+                "WHERE ID = ? AND STATUS_CD = 'COMPLETE' AND EXECUTION_START_TS IS NOT NULL AND EXECUTION_END_TS IS NOT NULL",
+                (id,)).fetchone()
+            if row is None:
+                return 0
+            runjob_cmd, job_nm, artifact_id, job_type, seconds = row
+            keys = [('CMD', runjob_cmd.strip()[:ESTIMATE_KEY_LENGTH] if runjob_cmd else None), ('JOB', job_nm),
+                    ('ARTIFACT', str(artifact_id) if artifact_id is not None else None), ('TYPE', job_type)]
+            keys = [(key_type, key) for key_type, key in keys if key]
+            conn.executemany(
+                "INSERT INTO RUNJOB_DURATION_ESTIMATE_T (KEY_TYPE_CD, KEY_TX, EST_SECONDS, SAMPLE_CT, UPDATED_TS) "
+                "VALUES (?, ?, ?, 1, ?) ON CONFLICT (KEY_TYPE_CD, KEY_TX) DO UPDATE SET "
+                "EST_SECONDS = EST_SECONDS + ? * (excluded.EST_SECONDS - EST_SECONDS), SAMPLE_CT = SAMPLE_CT + 1, "
+                "UPDATED_TS = excluded.UPDATED_TS",
+                [(key_type, key, seconds, time.time(), ESTIMATE_ALPHA) for key_type, key in keys])
+            return len(keys)
+        return self.__transaction(update)
+
+    def renew_lease(self, owner_token, ids, lease_seconds=900):
+        if not ids:
+            return 0
+        cur = self.conn.execute(
+            "UPDATE RUNJOB_REQUEST_T SET LEASE_EXPIRY_TS = ? WHERE OWNER_TOKEN_TX = ? "
+            "AND STATUS_CD IN ('QUEUED', 'RUNNING') AND ID IN ({})".format(", ".join("?" for _ in ids)),
+            (time.time() + lease_seconds, owner_token, *ids))
+        return cur.rowcount
+
+    def reclaim_expired(self):
+        def reclaim(conn):
+            ids = [r[0] for r in conn.execute(
+                "SELECT ID FROM RUNJOB_REQUEST_T WHERE STATUS_CD IN ('QUEUED', 'RUNNING') AND LEASE_EXPIRY_TS < ?",
+                (time.time(),))]
+            if ids:
+                conn.execute("UPDATE RUNJOB_REQUEST_T SET STATUS_CD = 'NEW', OWNER_TOKEN_TX = NULL, LEASE_EXPIRY_TS = NULL, "
+                             "EXECUTION_START_TS = NULL WHERE ID IN ({})".format(", ".join("?" for _ in ids)), ids)
+            orphan_ids = [r[0] for r in conn.execute(
+                "SELECT f.ID FROM RUNJOB_REQUEST_T f JOIN RUNJOB_REQUEST_T l ON l.ID = f.LEADER_ID "
+                "WHERE f.STATUS_CD = 'FOLLOWING' AND l.STATUS_CD NOT IN ('QUEUED', 'RUNNING')")]
+            if orphan_ids:
+                conn.execute("UPDATE RUNJOB_REQUEST_T SET STATUS_CD = 'NEW', LEADER_ID = NULL WHERE ID IN ({})".format(
+                    ", ".join("?" for _ in orphan_ids)), orphan_ids)
+            return sorted(ids + orphan_ids)
+        return self.__transaction(reclaim)
+
+    def release_rows(self, owner_token, ids):
+        if not ids:
+            return 0
+        cur = self.conn.execute(
+            "UPDATE RUNJOB_REQUEST_T SET STATUS_CD = 'NEW', OWNER_TOKEN_TX = NULL, LEASE_EXPIRY_TS = NULL "
+            "WHERE OWNER_TOKEN_TX = ? AND STATUS_CD = 'QUEUED' AND ID IN ({})".format(", ".join("?" for _ in ids)),
+            (owner_token, *ids))
+        return cur.rowcount
+
+    def get_outstanding_jira_statuses(self):
+        rows = self.conn.execute(
+            "SELECT JIRA_ISSUE_ID, JIRA_STATUS_TX FROM RUNJOB_REQUEST_T "
+            "WHERE (JIRA_STATUS_TX IS NULL OR JIRA_STATUS_TX NOT IN ({})) AND EXECUTION_END_TS IS NULL "
+            "AND QUEUE_TS > ? AND JIRA_ISSUE_ID IS NOT NULL ORDER BY ID".format(", ".join("?" for _ in FINAL_JIRA_STATUSES)),
+            (*FINAL_JIRA_STATUSES, time.time() - JIRA_SYNC_WINDOW_DAYS * 86400))
+        return {row[0]: row[1] for row in rows}
+
+    def get_active_requests(self):
+        rows = self.conn.execute(
+            "SELECT ID, STATUS_CD, JOB_TYPE, ARTIFACT_ID, JOB_NM, RUNJOB_CMD FROM RUNJOB_REQUEST_T "
+            "WHERE STATUS_CD IN ('NEW', 'QUEUED', 'RUNNING') AND JOB_TYPE IN ({}) ORDER BY ID".format(
+                ", ".join("?" for _ in CLAIMABLE_JOB_TYPES)), CLAIMABLE_JOB_TYPES)
+        return [{k.lower(): row[k] for k in row.keys()} for row in rows]
+
+    def attach_followers(self, leader_id, ids, owner_token=None):
+        if not ids:
+            return []
+        def attach(conn):
+            leader = conn.execute("SELECT STATUS_CD FROM RUNJOB_REQUEST_T WHERE ID = ?", (leader_id,)).fetchone()
+            if leader is None or leader[0] not in ('QUEUED', 'RUNNING'):
+                return []
+            attached = [r[0] for r in conn.execute(
+                "SELECT ID FROM RUNJOB_REQUEST_T WHERE ID IN ({}) AND ID <> ? AND (STATUS_CD = 'NEW' OR "
+                "(STATUS_CD = 'QUEUED' AND OWNER_TOKEN_TX = ?))".format(", ".join("?" for _ in ids)), (*ids, leader_id, owner_token))]
+            if attached:
+                conn.execute("UPDATE RUNJOB_REQUEST_T SET STATUS_CD = 'FOLLOWING', LEADER_ID = ?, OWNER_TOKEN_TX = NULL, "
+                             "LEASE_EXPIRY_TS = NULL WHERE ID IN ({})".format(", ".join("?" for _ in attached)), (leader_id, *attached))
+            return attached
+        return self.__transaction(attach)
+
+    def finish_followers(self, leader_id, final_status):
+        def finish(conn):
+            conn.execute(
+                "UPDATE RUNJOB_REQUEST_T SET STATUS_CD = ?, EXECUTION_END_TS = ?, "
+                "EXECUTION_START_TS = (SELECT l.EXECUTION_START_TS FROM RUNJOB_REQUEST_T l WHERE l.ID = ?), "
+                "RUN_ID = (SELECT l.RUN_ID FROM RUNJOB_REQUEST_T l WHERE l.ID = ?) "
+                "WHERE LEADER_ID = ? AND STATUS_CD = 'FOLLOWING'", (final_status, time.time(), leader_id, leader_id, leader_id))
+            rows = conn.execute(
+                "SELECT j.*, l.ERROR_SNIPPIT_TX FROM RUNJOB_REQUEST_T j "
+                "LEFT OUTER JOIN BATCH_FRAMEWORK_LOG_T l ON j.RUN_ID = l.RUN_ID AND l.SEQ_ID = 1 "
+                "WHERE j.LEADER_ID = ? AND j.STATUS_CD = ? ORDER BY j.ID", (leader_id, final_status))
+            return [{k.lower(): row[k] for k in row.keys()} for row in rows]
+        return self.__transaction(finish)
+
+    def heartbeat(self, owner_token, id, progress_tx=None):
+        cur = self.conn.execute(
+            "UPDATE RUNJOB_REQUEST_T SET HEARTBEAT_TS = ?, PROGRESS_TX = ? WHERE ID = ? AND OWNER_TOKEN_TX = ? AND STATUS_CD = 'RUNNING'",
+            (time.time(), progress_tx, id, owner_token))
+        return cur.rowcount
+
+    def get_duration_history(self, job_type, limit=200):
+        rows = self.conn.execute(
+            "SELECT RUNJOB_CMD, EXECUTION_END_TS - EXECUTION_START_TS FROM RUNJOB_REQUEST_T WHERE JOB_TYPE = ? "
+            "AND STATUS_CD = 'COMPLETE' AND EXECUTION_START_TS IS NOT NULL AND EXECUTION_END_TS IS NOT NULL "
+            "ORDER BY ID DESC LIMIT ?", (job_type, int(limit)))
+        return [(row[0], row[1]) for row in rows]
+
+    def get_step_checkpoints(self, runbot_id):
+        rows = self.conn.execute(
+            "SELECT STEP_ID, STEP_HASH_TX, STATUS_CD, RETURN_CD, DURATION_SEC, ATTEMPT_CT FROM RUNJOB_STEP_CHECKPOINT_T "
+            "WHERE RUNBOT_ID = ? ORDER BY STEP_ID", (runbot_id,))
+        return [{k.lower(): row[k] for k in row.keys()} for row in rows]
+
+    def save_step_checkpoint(self, runbot_id, step_id, step_hash, status_cd, returncode, duration, attempt):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO RUNJOB_STEP_CHECKPOINT_T (RUNBOT_ID, STEP_ID, STEP_HASH_TX, STATUS_CD, RETURN_CD, "
+            "DURATION_SEC, ATTEMPT_CT, UPDATED_TS) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (runbot_id, step_id, step_hash, status_cd, returncode, duration, attempt, time.time()))
+
+    def bulk_update_jira_status(self, status_by_key):
+        if not status_by_key:
+            return 0
+        def update(conn):
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS jira_status (JIRA_ISSUE_ID TEXT PRIMARY KEY, JIRA_STATUS_TX TEXT)")
+            conn.execute("DELETE FROM jira_status")
+            conn.executemany("INSERT INTO jira_status VALUES (?, ?)", status_by_key.items())
+            cur = conn.execute(
+                "UPDATE RUNJOB_REQUEST_T SET JIRA_STATUS_TX = s.JIRA_STATUS_TX FROM jira_status s "
+                "WHERE RUNJOB_REQUEST_T.JIRA_ISSUE_ID = s.JIRA_ISSUE_ID "
+                "AND (RUNJOB_REQUEST_T.JIRA_STATUS_TX IS NULL OR RUNJOB_REQUEST_T.JIRA_STATUS_TX <> s.JIRA_STATUS_TX)")
+            return cur.rowcount
+        return self.__transaction(update)
+
+    def get_status_changes(self, since_version=0, since_id=0, page_size=200):
+        rows = self.conn.execute(
+            "SELECT {}, j.ROW_VERSION, l.ERROR_SNIPPIT_TX FROM RUNJOB_REQUEST_T j "
+            "LEFT OUTER JOIN BATCH_FRAMEWORK_LOG_T l ON j.RUN_ID = l.RUN_ID AND l.SEQ_ID = 1 "
+            "WHERE j.ROW_VERSION > ? AND j.ID > ? AND j.QUEUE_TS >= ? AND j.JOB_TYPE IN ({}) "
+            "ORDER BY j.ROW_VERSION LIMIT ?".format(", ".join("j." + col for col in STATUS_COLUMNS),
+                                                   ", ".join("?" for _ in STATUS_JOB_TYPES)),
+            (int(since_version), int(since_id), time.time() - STATUS_WINDOW_DAYS * 86400, *STATUS_JOB_TYPES, int(page_size)))
+        return [{k.lower(): row[k] for k in row.keys()} for row in rows]
+
+    def get_people(self, schwab_ids):
+        if not schwab_ids:
+            return {}
+        rows = self.conn.execute("SELECT SCHWAB_ID, DISPLAY_NM, EMAIL_TX FROM SCHWAB_PERSON_DM WHERE SCHWAB_ID IN ({})".format(
+            ", ".join("?" for _ in schwab_ids)), list(schwab_ids))
+        return {row[0]: {'display_nm': row[1], 'email_tx': row[2]} for row in rows}
+
+    def get_artifact_titles(self, artifact_ids):
+        if not artifact_ids:
+            return {}
+        rows = self.conn.execute("SELECT ARTFCT_ID, ATTRB_ID, VAL_255 FROM ARTFCT_DETAILS_VALUES_T "
+                                 "WHERE ATTRB_ID IN (35, 36) AND ARTFCT_ID IN ({})".format(", ".join("?" for _ in artifact_ids)),
+                                 list(artifact_ids))
+        return format_artifact_titles(tuple(row) for row in rows)
+
+
+def get_default_backend():
+    """
+    OUTPUT: MssqlQueueBackend, or SqliteQueueBackend on RUNBOT_LOCAL_DB when it is set
+    """
+    return SqliteQueueBackend(LOCAL_DB_PATH) if LOCAL_DB_PATH else MssqlQueueBackend()
+
+
+def format_artifact_titles(attribute_rows):
+    """
+    INPUT: attribute_rows (iterable of (artifact_id, attrb_id, val_255)); ATTRB_ID 36 is the title, 35 the job id
+    OUTPUT: dict of artifact_id -> "title (job id)" or "title"; artifacts without a title are left out (INNER JOIN semantics)
+    """
+    titles, job_ids = {}, {}
+    for artifact_id, attrb_id, val_255 in attribute_rows:
+        (titles if attrb_id == 36 else job_ids)[artifact_id] = val_255
+    return {artifact_id: f"{title} ({job_ids[artifact_id]})" if job_ids.get(artifact_id) is not None else title
+            for artifact_id, title in titles.items()}
+
+
+def _contention_worker(db_path, batch_size, claimed_queue):
+    backend = SqliteQueueBackend(db_path)
+    owner_token = f"bench:{os.getpid()}"
+    claimed = []
+    while True:
+        rows = backend.claim_rows(owner_token, batch_size=batch_size)
+        if not rows:
+            break
+        claimed.extend(row['id'] for row in rows)
+    claimed_queue.put(claimed)
+
+
+def benchmark_claim_contention(db_path, processes=4, rows=1000, batch_size=10):
+    """
+    INPUT: db_path (str), processes (int), rows (int), batch_size (int)
+           - Seeds a fresh SQLite queue and has several processes drain it concurrently
+
+    OUTPUT: (is_valid, claims_per_second); is_valid is False if any row was claimed twice or never claimed
+    """
+    import multiprocessing # only needed here; keeps the runbot_probe import path light
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    SqliteQueueBackend(db_path).enqueue(
+        [{'JOB_TYPE': 'RERUN_REPORT', 'RUNJOB_CMD': f"runjob bench job_{i}"} for i in range(rows)])
+
+    claimed_queue = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=_contention_worker, args=(db_path, batch_size, claimed_queue))
+             for _ in range(processes)]
+    start = time.monotonic()
+    for p in procs:
+        p.start()
+    claimed = [id for _ in procs for id in claimed_queue.get()]
+    for p in procs:
+        p.join()
+    elapsed = time.monotonic() - start
+
+    is_valid = len(claimed) == rows and len(set(claimed)) == rows
+    if not is_valid:
+        logerr(f"{script_arrow} Contention check failed: {len(claimed)} claims for {rows} rows ({len(set(claimed))} unique)")
+    logmsg(f"{script_arrow} {processes} process(es), batch_size={batch_size}: {rows} rows claimed in {elapsed:.2f}s "
+           f"({rows / elapsed:.0f} claims/s)")
+    return is_valid, rows / elapsed
+
+
+if __name__ == "__main__":
+    # Usage: runbot_queue.py [db_path] [processes] [rows] [batch_size]
+    args = sys.argv[1:]
+    is_valid, _ = benchmark_claim_contention(args[0] if args else "/tmp/runbot_queue_bench.db",
+                                             *(int(a) for a in args[1:4]))
+    sys.exit(0 if is_valid else 1)
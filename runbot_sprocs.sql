@@ -34,6 +34,7 @@ BEGIN
             WHEN j.STATUS_CD = 'RUNNING' THEN 'Running'
             WHEN j.STATUS_CD = 'COMPLETE' THEN 'Done'
             WHEN j.STATUS_CD = 'ERROR' THEN 'Failed'
+            WHEN j.STATUS_CD = 'TIMEOUT' THEN 'Timed out'
             WHEN j.JIRA_STATUS_TX = 'Approval Pending' THEN 'Pending manager approval'
             WHEN j.JIRA_STATUS_TX = 'Ready to Implement' THEN 'Awaiting execution'
             ELSE j.JIRA_STATUS_TX            
@@ -94,7 +95,8 @@ GO
 CREATE PROCEDURE [jobs].[RUNJOB_REQUEST_UPDATE]
     @ID INT,
     @STATUS VARCHAR(10) = 'RUNNING',
-    @RUN_ID VARCHAR(50) = NULL
+    @RUN_ID VARCHAR(50) = NULL,
+    @OWNER_TOKEN VARCHAR(100) = NULL
    WITH
    EXEC AS CALLER
 AS
@@ -106,12 +108,488 @@ BEGIN
                 STATUS_CD =  'RUNNING'
             WHERE ID = @ID;
         END
+    ELSE IF @STATUS = 'NEW'
+        BEGIN
+            -- release a claimed row back to the queue without stamping an end time; only its current owner may,
+            -- so a host whose lease expired cannot release a row another host has since claimed
+            UPDATE mis_reports.jobs.RUNJOB_REQUEST_T
+                SET EXECUTION_START_TS = NULL,
+                EXECUTION_END_TS = NULL,
+                STATUS_CD = 'NEW',
+                OWNER_TOKEN_TX = NULL,
+                LEASE_EXPIRY_TS = NULL
+            WHERE ID = @ID AND STATUS_CD = 'QUEUED' AND OWNER_TOKEN_TX = @OWNER_TOKEN;
+
+            SELECT @@ROWCOUNT AS RELEASED_CT;
+        END
     ELSE    
         BEGIN
         UPDATE mis_reports.jobs.RUNJOB_REQUEST_T
             SET EXECUTION_END_TS = getDate(),
-                STATUS_CD = @STATUS                
+                STATUS_CD = @STATUS,
+                LEASE_EXPIRY_TS = NULL
             WHERE ID = @ID;
         END
 END
 GO
+
+/****** Object: Lease columns on [jobs].[RUNJOB_REQUEST_T] ******/
+USE [MIS_Reports];
+GO
+ALTER TABLE [jobs].[RUNJOB_REQUEST_T] ADD
+    OWNER_TOKEN_TX VARCHAR(100) NULL,
+    LEASE_EXPIRY_TS DATETIME NULL;
+GO
+CREATE INDEX RUNJOB_REQUEST_STATUS_IX ON [jobs].[RUNJOB_REQUEST_T] (STATUS_CD, ID) INCLUDE (JOB_TYPE, QUEUE_TS);
+GO
+CREATE INDEX RUNJOB_REQUEST_LEASE_IX ON [jobs].[RUNJOB_REQUEST_T] (LEASE_EXPIRY_TS) WHERE LEASE_EXPIRY_TS IS NOT NULL;
+GO
+
+/****** Object: Table [jobs].[RUNJOB_DURATION_ESTIMATE_T] (rolling runtime estimates for claim ordering) ******/
+USE [MIS_Reports];
+GO
+CREATE TABLE [jobs].[RUNJOB_DURATION_ESTIMATE_T] (
+    KEY_TYPE_CD   VARCHAR(10) NOT NULL,  -- 'CMD', 'JOB', 'ARTIFACT' or 'TYPE'
+    KEY_TX        VARCHAR(400) NOT NULL,
+    EST_SECONDS   FLOAT NOT NULL,
+    SAMPLE_CT     INT NOT NULL,
+    UPDATED_TS    DATETIME NOT NULL DEFAULT getDate(),
+    CONSTRAINT RUNJOB_DURATION_ESTIMATE_PK PRIMARY KEY (KEY_TYPE_CD, KEY_TX)
+);
+GO
+
+/****** Object: Function [jobs].[RUNJOB_DURATION_ESTIMATE_FN] ******/
+USE [MIS_Reports];
+GO
+SET ANSI_NULLS ON;
+GO
+SET QUOTED_IDENTIFIER ON;
+GO
+CREATE FUNCTION [jobs].[RUNJOB_DURATION_ESTIMATE_FN] (
+    @RUNJOB_CMD VARCHAR(MAX),
+    @JOB_NM VARCHAR(400),
+    @ARTIFACT_ID INT,
+    @JOB_TYPE VARCHAR(50),
+    @DEFAULT_EST_SECONDS FLOAT
+)
+RETURNS TABLE
+AS
+RETURN
+    -- the most specific key with history wins: command, then job_nm, artifact_id and job_type
+    SELECT COALESCE(c.EST_SECONDS, j.EST_SECONDS, a.EST_SECONDS, t.EST_SECONDS, @DEFAULT_EST_SECONDS) AS EST_SECONDS,
+           CASE WHEN c.EST_SECONDS IS NOT NULL THEN 'CMD' WHEN j.EST_SECONDS IS NOT NULL THEN 'JOB'
+                WHEN a.EST_SECONDS IS NOT NULL THEN 'ARTIFACT' WHEN t.EST_SECONDS IS NOT NULL THEN 'TYPE'
+                ELSE 'DEFAULT' END AS EST_BASIS_CD
+    FROM (SELECT 1 AS ONE) k
+        LEFT OUTER JOIN mis_reports.jobs.RUNJOB_DURATION_ESTIMATE_T c WITH (NOLOCK)
+            ON c.KEY_TYPE_CD = 'CMD' AND c.KEY_TX = LEFT(LTRIM(RTRIM(@RUNJOB_CMD)), 400)
+        LEFT OUTER JOIN mis_reports.jobs.RUNJOB_DURATION_ESTIMATE_T j WITH (NOLOCK) ON j.KEY_TYPE_CD = 'JOB' AND j.KEY_TX = @JOB_NM
+        LEFT OUTER JOIN mis_reports.jobs.RUNJOB_DURATION_ESTIMATE_T a WITH (NOLOCK)
+            ON a.KEY_TYPE_CD = 'ARTIFACT' AND a.KEY_TX = CAST(@ARTIFACT_ID AS VARCHAR(20))
+        LEFT OUTER JOIN mis_reports.jobs.RUNJOB_DURATION_ESTIMATE_T t WITH (NOLOCK) ON t.KEY_TYPE_CD = 'TYPE' AND t.KEY_TX = @JOB_TYPE;
+GO
+
+/****** Object: Procedure [jobs].[RUNJOB_REQUEST_CLAIM] ******/
+USE [MIS_Reports];
+GO
+SET ANSI_NULLS ON;
+GO
+SET QUOTED_IDENTIFIER ON;
+GO
+CREATE PROCEDURE [jobs].[RUNJOB_REQUEST_CLAIM]
+    @OWNER_TOKEN VARCHAR(100),
+    @BATCH_SIZE INT = 1,
+    @LEASE_SECONDS INT = 900,
+    @SHORTEST_FIRST BIT = 1,
+    @AGING_FACTOR FLOAT = 2.0,
+    @DEFAULT_EST_SECONDS FLOAT = 900
+   WITH
+   EXEC AS CALLER
+AS
+BEGIN
+    SET NOCOUNT ON;
+    SET XACT_ABORT ON;
+    DECLARE @claimed TABLE (SEQ_NO INT IDENTITY(1, 1), ID INT PRIMARY KEY, EST_SECONDS FLOAT, EST_BASIS_CD VARCHAR(10));
+
+    BEGIN TRANSACTION;
+    -- Shortest expected runtime first; every second waited takes @AGING_FACTOR seconds off, so long jobs still get their turn.
+    -- READPAST skips rows another host is claiming right now, so concurrent claimers never block or double-claim.
+    -- Rows without a person or title are never returned by the SELECT below, so they are not claimed either
+    INSERT INTO @claimed (ID, EST_SECONDS, EST_BASIS_CD)
+    SELECT TOP (@BATCH_SIZE) r.ID, est.EST_SECONDS, est.EST_BASIS_CD
+    FROM   mis_reports.jobs.RUNJOB_REQUEST_T r WITH (UPDLOCK, READPAST, ROWLOCK)
+        CROSS APPLY mis_reports.jobs.RUNJOB_DURATION_ESTIMATE_FN(r.RUNJOB_CMD, r.JOB_NM, r.ARTIFACT_ID, r.JOB_TYPE, @DEFAULT_EST_SECONDS) est
+    WHERE  r.JOB_TYPE IN ('RERUN_REPORT','RELOAD_TABLE')
+        AND r.STATUS_CD = 'NEW'
+        AND r.QUEUE_TS >= getDate() - 20
+        AND EXISTS (SELECT 1 FROM mis_data.dbo.SCHWAB_PERSON_DM per WITH(NOLOCK) WHERE per.SCHWAB_ID = r.SCHWAB_ID)
+        AND EXISTS (SELECT 1 FROM mis_reports.dbo.ARTFCT_DETAILS_VALUES_T ttl WITH(NOLOCK)
+                    WHERE ttl.ARTFCT_ID = r.ARTIFACT_ID AND ttl.ATTRB_ID = 36)
+    ORDER BY CASE WHEN @SHORTEST_FIRST = 1 THEN est.EST_SECONDS - @AGING_FACTOR * DATEDIFF(SECOND, r.QUEUE_TS, getDate()) ELSE 0 END,
+        r.ID;
+
+    UPDATE j
+        SET STATUS_CD = 'QUEUED',
+            OWNER_TOKEN_TX = @OWNER_TOKEN,
+            LEASE_EXPIRY_TS = DATEADD(SECOND, @LEASE_SECONDS, getDate())
+    FROM mis_reports.jobs.RUNJOB_REQUEST_T j
+        INNER JOIN @claimed c ON j.ID = c.ID;
+    COMMIT TRANSACTION;
+
+    -- same shape as RUNJOB_REQUEST_GET
+    SELECT j.ID AS ID,
+        CASE WHEN jobid.VAL_255 IS NOT NULL THEN ttl.VAL_255 + ' (' + jobid.VAL_255 + ')' ELSE ttl.VAL_255 END TITLE_TX,
+         j.JIRA_ISSUE_ID, j.SCHWAB_ID, j.JOB_TYPE,
+         per.DISPLAY_NM, per.EMAIL_TX,
+         j.ARTIFACT_ID, j.JOB_NM,
+         j.RUNJOB_CMD, j.START_STEP_ID,
+         j.QUEUE_TS, j.EXECUTION_START_TS,
+         j.EXECUTION_END_TS,
+         j.STATUS_CD,
+         j.RUN_ID,  l.ERROR_SNIPPIT_TX,
+         j.JIRA_STATUS_TX,
+         j.OWNER_TOKEN_TX, j.LEASE_EXPIRY_TS,
+         c.EST_SECONDS, c.EST_BASIS_CD
+    FROM     @claimed c
+            INNER JOIN mis_reports.jobs.RUNJOB_REQUEST_T j ON j.ID = c.ID
+            INNER JOIN mis_data.dbo.SCHWAB_PERSON_DM per WITH(NOLOCK) On j.SCHWAB_ID = per.SCHWAB_ID
+            INNER JOIN mis_reports.dbo.ARTFCT_DETAILS_VALUES_T ttl WITH(NOLOCK) ON j.ARTIFACT_ID = ttl.ARTFCT_ID AND ttl.ATTRB_ID = 36
+            LEFT OUTER JOIN mis_reports.dbo.ARTFCT_DETAILS_VALUES_T jobid WITH(NOLOCK) ON j.ARTIFACT_ID = jobid.ARTFCT_ID AND jobid.ATTRB_ID = 35
+            LEFT OUTER JOIN mis_reports.jobs.BATCH_FRAMEWORK_LOG_T l WITH(NOLOCK) ON j.RUN_ID = l.RUN_ID AND l.SEQ_ID = 1
+    ORDER BY c.SEQ_NO;
+END
+GO
+
+/****** Object: Procedure [jobs].[RUNJOB_REQUEST_RENEW_LEASE] ******/
+USE [MIS_Reports];
+GO
+SET ANSI_NULLS ON;
+GO
+SET QUOTED_IDENTIFIER ON;
+GO
+CREATE PROCEDURE [jobs].[RUNJOB_REQUEST_RENEW_LEASE]
+    @OWNER_TOKEN VARCHAR(100),
+    @IDS VARCHAR(MAX),
+    @LEASE_SECONDS INT = 900
+   WITH
+   EXEC AS CALLER
+AS
+BEGIN
+    SET NOCOUNT ON;
+    UPDATE mis_reports.jobs.RUNJOB_REQUEST_T
+        SET LEASE_EXPIRY_TS = DATEADD(SECOND, @LEASE_SECONDS, getDate())
+    WHERE ID IN (SELECT CAST(value AS INT) FROM STRING_SPLIT(@IDS, ','))
+        AND OWNER_TOKEN_TX = @OWNER_TOKEN
+        AND STATUS_CD IN ('QUEUED', 'RUNNING');
+
+    SELECT @@ROWCOUNT AS RENEWED_CT;
+END
+GO
+
+/****** Object: Procedure [jobs].[RUNJOB_REQUEST_RECLAIM] ******/
+USE [MIS_Reports];
+GO
+SET ANSI_NULLS ON;
+GO
+SET QUOTED_IDENTIFIER ON;
+GO
+CREATE PROCEDURE [jobs].[RUNJOB_REQUEST_RECLAIM]
+   WITH
+   EXEC AS CALLER
+AS
+BEGIN
+    SET NOCOUNT ON;
+    DECLARE @reclaimed TABLE (ID INT PRIMARY KEY, OWNER_TOKEN_TX VARCHAR(100), STATUS_CD VARCHAR(10));
+
+    -- rows whose owner stopped renewing (crashed host/run) go back to the queue
+    UPDATE mis_reports.jobs.RUNJOB_REQUEST_T
+        SET STATUS_CD = 'NEW',
+            OWNER_TOKEN_TX = NULL,
+            LEASE_EXPIRY_TS = NULL,
+            EXECUTION_START_TS = NULL
+    OUTPUT deleted.ID, deleted.OWNER_TOKEN_TX, deleted.STATUS_CD INTO @reclaimed
+    WHERE STATUS_CD IN ('QUEUED', 'RUNNING')
+        AND LEASE_EXPIRY_TS < getDate();
+
+    -- followers whose leader is no longer queued/running (reclaimed above, or finished without them) run on their own
+    UPDATE f
+        SET STATUS_CD = 'NEW',
+            LEADER_ID = NULL
+    OUTPUT deleted.ID, deleted.OWNER_TOKEN_TX, deleted.STATUS_CD INTO @reclaimed
+    FROM mis_reports.jobs.RUNJOB_REQUEST_T f
+        INNER JOIN mis_reports.jobs.RUNJOB_REQUEST_T l ON l.ID = f.LEADER_ID
+    WHERE f.STATUS_CD = 'FOLLOWING'
+        AND l.STATUS_CD NOT IN ('QUEUED', 'RUNNING');
+
+    SELECT ID, OWNER_TOKEN_TX, STATUS_CD FROM @reclaimed ORDER BY ID;
+END
+GO
+
+/****** Object: Tables [jobs].[RUNBOT_LOG_T], [jobs].[RUNBOT_LOG_CHUNK_T] (native chunked log writer) ******/
+-- Written only when RunBot runs with RUNBOT_NATIVE_LOG_SINK=1; until then logs stay in the table written by
+-- MIS::Jobs::log_content_to_database. Move that table's readers to [jobs].[RUNBOT_LOG_V] before switching a host over.
+USE [MIS_Reports];
+GO
+CREATE TABLE [jobs].[RUNBOT_LOG_T] (
+    LOG_ID       CHAR(32) NOT NULL PRIMARY KEY,
+    RUNBOT_ID    INT NULL,
+    ARTIFACT_ID  INT NULL,
+    JOB_CMD_TX   VARCHAR(4000) NULL,
+    LOG_FILE_NM  VARCHAR(1000) NULL,
+    IS_FAILURE   BIT NOT NULL DEFAULT 0,
+    CHUNK_CT     INT NOT NULL,
+    CHAR_CT      BIGINT NOT NULL,
+    CREATED_TS   DATETIME NOT NULL DEFAULT getDate()
+);
+GO
+CREATE INDEX RUNBOT_LOG_RUNBOT_IX ON [jobs].[RUNBOT_LOG_T] (RUNBOT_ID);
+GO
+CREATE TABLE [jobs].[RUNBOT_LOG_CHUNK_T] (
+    LOG_ID     CHAR(32) NOT NULL,
+    CHUNK_SEQ  INT NOT NULL,
+    CHUNK_TX   VARCHAR(MAX) NULL,
+    CONSTRAINT RUNBOT_LOG_CHUNK_PK PRIMARY KEY (LOG_ID, CHUNK_SEQ)
+);
+GO
+CREATE VIEW [jobs].[RUNBOT_LOG_V] AS
+    SELECT l.LOG_ID, l.RUNBOT_ID, l.ARTIFACT_ID, l.JOB_CMD_TX, l.LOG_FILE_NM, l.IS_FAILURE, l.CREATED_TS,
+           (SELECT STRING_AGG(CAST(c.CHUNK_TX AS VARCHAR(MAX)), '') WITHIN GROUP (ORDER BY c.CHUNK_SEQ)
+            FROM   [jobs].[RUNBOT_LOG_CHUNK_T] c
+            WHERE  c.LOG_ID = l.LOG_ID) AS LOG_TX
+    FROM   [jobs].[RUNBOT_LOG_T] l;
+GO
+
+/****** Object: Change tracking on [jobs].[RUNJOB_REQUEST_T] (incremental status snapshots) ******/
+USE [MIS_Reports];
+GO
+-- ROWVERSION is bumped by every insert/update, so pollers can ask for "rows changed since version N"
+ALTER TABLE [jobs].[RUNJOB_REQUEST_T] ADD
+    ROW_VERSION_RV ROWVERSION NOT NULL;
+GO
+CREATE INDEX RUNJOB_REQUEST_VERSION_IX ON [jobs].[RUNJOB_REQUEST_T] (ROW_VERSION_RV) INCLUDE (ID, JOB_TYPE, QUEUE_TS);
+GO
+
+/****** Object: Duplicate-request coalescing on [jobs].[RUNJOB_REQUEST_T] ******/
+USE [MIS_Reports];
+GO
+-- a 'FOLLOWING' row is an identical request attached to the queued/running row in LEADER_ID; it takes the leader's result
+ALTER TABLE [jobs].[RUNJOB_REQUEST_T] ADD
+    LEADER_ID INT NULL;
+GO
+CREATE INDEX RUNJOB_REQUEST_LEADER_IX ON [jobs].[RUNJOB_REQUEST_T] (LEADER_ID) INCLUDE (STATUS_CD) WHERE LEADER_ID IS NOT NULL;
+GO
+
+/****** Object: Procedure [jobs].[RUNJOB_REQUEST_ATTACH_FOLLOWERS] ******/
+USE [MIS_Reports];
+GO
+SET ANSI_NULLS ON;
+GO
+SET QUOTED_IDENTIFIER ON;
+GO
+CREATE PROCEDURE [jobs].[RUNJOB_REQUEST_ATTACH_FOLLOWERS]
+    @LEADER_ID INT,
+    @IDS VARCHAR(MAX),
+    @OWNER_TOKEN VARCHAR(100) = NULL
+   WITH
+   EXEC AS CALLER
+AS
+BEGIN
+    SET NOCOUNT ON;
+    -- UPDLOCK on the leader waits out a concurrent RUNJOB_REQUEST_FINISH_FOLLOWERS, so nothing attaches to a finished leader.
+    -- Only unclaimed rows, or rows claimed by the caller, can become followers
+    UPDATE f
+        SET STATUS_CD = 'FOLLOWING',
+            LEADER_ID = @LEADER_ID,
+            OWNER_TOKEN_TX = NULL,
+            LEASE_EXPIRY_TS = NULL
+    OUTPUT inserted.ID
+    FROM mis_reports.jobs.RUNJOB_REQUEST_T f
+    WHERE f.ID IN (SELECT CAST(value AS INT) FROM STRING_SPLIT(@IDS, ','))
+        AND f.ID <> @LEADER_ID
+        AND (f.STATUS_CD = 'NEW' OR (f.STATUS_CD = 'QUEUED' AND f.OWNER_TOKEN_TX = @OWNER_TOKEN))
+        AND EXISTS (SELECT 1 FROM mis_reports.jobs.RUNJOB_REQUEST_T l WITH (UPDLOCK, ROWLOCK)
+                    WHERE l.ID = @LEADER_ID AND l.STATUS_CD IN ('QUEUED', 'RUNNING'));
+END
+GO
+
+/****** Object: Procedure [jobs].[RUNJOB_REQUEST_FINISH_FOLLOWERS] ******/
+USE [MIS_Reports];
+GO
+SET ANSI_NULLS ON;
+GO
+SET QUOTED_IDENTIFIER ON;
+GO
+CREATE PROCEDURE [jobs].[RUNJOB_REQUEST_FINISH_FOLLOWERS]
+    @LEADER_ID INT,
+    @STATUS VARCHAR(10)
+   WITH
+   EXEC AS CALLER
+AS
+BEGIN
+    SET NOCOUNT ON;
+    DECLARE @finished TABLE (ID INT PRIMARY KEY);
+
+    -- followers share the leader's run (RUN_ID, so the same error snippet) and end status
+    UPDATE f
+        SET STATUS_CD = @STATUS,
+            EXECUTION_START_TS = l.EXECUTION_START_TS,
+            EXECUTION_END_TS = getDate(),
+            RUN_ID = l.RUN_ID
+    OUTPUT inserted.ID INTO @finished
+    FROM mis_reports.jobs.RUNJOB_REQUEST_T f
+        INNER JOIN mis_reports.jobs.RUNJOB_REQUEST_T l ON l.ID = f.LEADER_ID
+    WHERE f.LEADER_ID = @LEADER_ID
+        AND f.STATUS_CD = 'FOLLOWING';
+
+    -- same shape as RUNJOB_REQUEST_GET
+    SELECT j.ID AS ID,
+        CASE WHEN jobid.VAL_255 IS NOT NULL THEN ttl.VAL_255 + ' (' + jobid.VAL_255 + ')' ELSE ttl.VAL_255 END TITLE_TX,
+         j.JIRA_ISSUE_ID, j.SCHWAB_ID, j.JOB_TYPE,
+         per.DISPLAY_NM, per.EMAIL_TX,
+         j.ARTIFACT_ID, j.JOB_NM,
+         j.RUNJOB_CMD, j.START_STEP_ID,
+         j.QUEUE_TS, j.EXECUTION_START_TS,
+         j.EXECUTION_END_TS,
+         j.STATUS_CD,
+         j.RUN_ID,  l.ERROR_SNIPPIT_TX,
+         j.JIRA_STATUS_TX,
+         j.LEADER_ID
+    FROM     @finished c
+            INNER JOIN mis_reports.jobs.RUNJOB_REQUEST_T j ON j.ID = c.ID
+            LEFT OUTER JOIN mis_data.dbo.SCHWAB_PERSON_DM per WITH(NOLOCK) On j.SCHWAB_ID = per.SCHWAB_ID
+            LEFT OUTER JOIN mis_reports.dbo.ARTFCT_DETAILS_VALUES_T ttl WITH(NOLOCK) ON j.ARTIFACT_ID = ttl.ARTFCT_ID AND ttl.ATTRB_ID = 36
+            LEFT OUTER JOIN mis_reports.dbo.ARTFCT_DETAILS_VALUES_T jobid WITH(NOLOCK) ON j.ARTIFACT_ID = jobid.ARTFCT_ID AND jobid.ATTRB_ID = 35
+            LEFT OUTER JOIN mis_reports.jobs.BATCH_FRAMEWORK_LOG_T l WITH(NOLOCK) ON j.RUN_ID = l.RUN_ID AND l.SEQ_ID = 1
+    ORDER BY j.ID;
+END
+GO
+
+/****** Object: Table [jobs].[RUNJOB_STEP_CHECKPOINT_T] (restart a CTL from its failed step) ******/
+USE [MIS_Reports];
+GO
+CREATE TABLE [jobs].[RUNJOB_STEP_CHECKPOINT_T] (
+    RUNBOT_ID     INT NOT NULL,
+    STEP_ID       INT NOT NULL,
+    STEP_HASH_TX  CHAR(16) NOT NULL,
+    STATUS_CD     VARCHAR(20) NOT NULL,
+    RETURN_CD     INT NULL,
+    DURATION_SEC  FLOAT NULL,
+    ATTEMPT_CT    INT NOT NULL DEFAULT 1,
+    UPDATED_TS    DATETIME NOT NULL DEFAULT getDate(),
+    CONSTRAINT RUNJOB_STEP_CHECKPOINT_PK PRIMARY KEY (RUNBOT_ID, STEP_ID)
+);
+GO
+
+/****** Object: Heartbeat columns on [jobs].[RUNJOB_REQUEST_T] (watchdog progress while a job runs) ******/
+USE [MIS_Reports];
+GO
+ALTER TABLE [jobs].[RUNJOB_REQUEST_T] ADD
+    HEARTBEAT_TS DATETIME NULL,
+    PROGRESS_TX VARCHAR(200) NULL;
+GO
+
+/****** Object: Procedure [jobs].[RUNJOB_REQUEST_HEARTBEAT] ******/
+USE [MIS_Reports];
+GO
+SET ANSI_NULLS ON;
+GO
+SET QUOTED_IDENTIFIER ON;
+GO
+CREATE PROCEDURE [jobs].[RUNJOB_REQUEST_HEARTBEAT]
+    @OWNER_TOKEN VARCHAR(100),
+    @ID INT,
+    @PROGRESS_TX VARCHAR(200) = NULL
+   WITH
+   EXEC AS CALLER
+AS
+BEGIN
+    SET NOCOUNT ON;
+    UPDATE mis_reports.jobs.RUNJOB_REQUEST_T
+        SET HEARTBEAT_TS = getDate(),
+            PROGRESS_TX = @PROGRESS_TX
+    WHERE ID = @ID
+        AND OWNER_TOKEN_TX = @OWNER_TOKEN
+        AND STATUS_CD = 'RUNNING';
+
+    SELECT @@ROWCOUNT AS UPDATED_CT;
+END
+GO
+
+/****** Object: Index for per-job_type duration history (watchdog time budgets) ******/
+USE [MIS_Reports];
+GO
+CREATE INDEX RUNJOB_REQUEST_HISTORY_IX ON [jobs].[RUNJOB_REQUEST_T] (JOB_TYPE, STATUS_CD, ID DESC)
+    INCLUDE (RUNJOB_CMD, EXECUTION_START_TS, EXECUTION_END_TS);
+GO
+
+/****** Object: Procedure [jobs].[RUNJOB_DURATION_ESTIMATE_UPDATE] ******/
+USE [MIS_Reports];
+GO
+SET ANSI_NULLS ON;
+GO
+SET QUOTED_IDENTIFIER ON;
+GO
+CREATE PROCEDURE [jobs].[RUNJOB_DURATION_ESTIMATE_UPDATE]
+    @ID INT,
+    @ALPHA FLOAT = 0.3
+   WITH
+   EXEC AS CALLER
+AS
+BEGIN
+    SET NOCOUNT ON;
+    -- exponentially weighted: each completed run moves the estimate @ALPHA of the way towards its runtime
+    MERGE mis_reports.jobs.RUNJOB_DURATION_ESTIMATE_T WITH (HOLDLOCK) AS t
+    USING (
+        SELECT k.KEY_TYPE_CD, k.KEY_TX, DATEDIFF(SECOND, r.EXECUTION_START_TS, r.EXECUTION_END_TS) AS DURATION_SEC
+        FROM mis_reports.jobs.RUNJOB_REQUEST_T r
+            CROSS APPLY (VALUES ('CMD', LEFT(LTRIM(RTRIM(r.RUNJOB_CMD)), 400)), ('JOB', r.JOB_NM),
+                                ('ARTIFACT', CAST(r.ARTIFACT_ID AS VARCHAR(20))), ('TYPE', r.JOB_TYPE)) k (KEY_TYPE_CD, KEY_TX)
+        WHERE r.ID = @ID
+            AND r.STATUS_CD = 'COMPLETE'
+            AND r.EXECUTION_START_TS IS NOT NULL
+            AND r.EXECUTION_END_TS IS NOT NULL
+            AND NULLIF(k.KEY_TX, '') IS NOT NULL
+    ) AS s
+        ON t.KEY_TYPE_CD = s.KEY_TYPE_CD AND t.KEY_TX = s.KEY_TX
+    WHEN MATCHED THEN
+        UPDATE SET EST_SECONDS = t.EST_SECONDS + @ALPHA * (s.DURATION_SEC - t.EST_SECONDS),
+                   SAMPLE_CT = t.SAMPLE_CT + 1,
+                   UPDATED_TS = getDate()
+    WHEN NOT MATCHED THEN
+        INSERT (KEY_TYPE_CD, KEY_TX, EST_SECONDS, SAMPLE_CT)
+        VALUES (s.KEY_TYPE_CD, s.KEY_TX, s.DURATION_SEC, 1);
+
+    SELECT @@ROWCOUNT AS UPDATED_CT;
+END
+GO
+
+/****** Object: Procedure [jobs].[RUNJOB_REQUEST_SCHEDULE] (claim order and runtime estimates for the wait forecast) ******/
+USE [MIS_Reports];
+GO
+SET ANSI_NULLS ON;
+GO
+SET QUOTED_IDENTIFIER ON;
+GO
+CREATE PROCEDURE [jobs].[RUNJOB_REQUEST_SCHEDULE]
+    @SHORTEST_FIRST BIT = 1,
+    @AGING_FACTOR FLOAT = 2.0,
+    @DEFAULT_EST_SECONDS FLOAT = 900
+   WITH
+   EXEC AS CALLER
+AS
+BEGIN
+    SET NOCOUNT ON;
+    SELECT r.ID, r.STATUS_CD, r.JOB_TYPE, r.JOB_NM, r.ARTIFACT_ID, r.RUNJOB_CMD,
+           est.EST_SECONDS, est.EST_BASIS_CD,
+           DATEDIFF(SECOND, r.QUEUE_TS, getDate()) AS AGE_SECONDS,
+           DATEDIFF(SECOND, r.EXECUTION_START_TS, getDate()) AS ELAPSED_SECONDS
+    FROM   mis_reports.jobs.RUNJOB_REQUEST_T r WITH (NOLOCK)
+        CROSS APPLY mis_reports.jobs.RUNJOB_DURATION_ESTIMATE_FN(r.RUNJOB_CMD, r.JOB_NM, r.ARTIFACT_ID, r.JOB_TYPE, @DEFAULT_EST_SECONDS) est
+    WHERE  r.JOB_TYPE IN ('RERUN_REPORT','RELOAD_TABLE')
+        AND r.STATUS_CD IN ('NEW', 'QUEUED', 'RUNNING')
+        AND r.QUEUE_TS >= getDate() - 20
+    ORDER BY CASE r.STATUS_CD WHEN 'RUNNING' THEN 0 WHEN 'QUEUED' THEN 1 ELSE 2 END,
+        CASE WHEN @SHORTEST_FIRST = 1 THEN est.EST_SECONDS - @AGING_FACTOR * DATEDIFF(SECOND, r.QUEUE_TS, getDate()) ELSE 0 END,
+        r.ID;
+END
+GO
@@ -10,44 +10,111 @@
 ########################################################################
 
 import os
+import re
+import json
+import time
+import shlex
+import hashlib
+import signal
+import mmap
 import subprocess
 import asyncio
+import queue
+import threading
+import contextlib
+import selectors
+import collections
+import bisect
+import itertools
 import cs_environment as env
+import runbot_db
+import runbot_metrics
 from cs_logging import logmsg, logwarning, logerr, print_console_note
 
+# Local disk: a cached parse is a few hundred bytes, but reading it from the NAS would cost as much as the CTL
+CTL_CACHE_DIR = os.getenv('RUNBOT_CTL_CACHE_DIR', os.path.expanduser("~/.runbot/ctl_cache"))
+CTL_CACHE_VERSION = 3
+CTL_PARSE_CACHE_MAX = 256   # parses kept in memory by a long-lived daemon
+# CTL authors mark independent runjobs by wrapping them in these comment lines
+PARALLEL_BEGIN_RE = re.compile(r"^\s*#\s*runbot:\s*parallel\s*$", re.IGNORECASE)
+PARALLEL_END_RE = re.compile(r"^\s*#\s*runbot:\s*end\s+parallel\s*$", re.IGNORECASE)
+# Setup lines that are safe to repeat before every step: plain variable assignments and export/cd/set/unset/umask,
+# without command substitution (a `date` timestamp would differ per step)
+REPEATABLE_PROLOGUE_RE = re.compile(r"^\s*(?:(?:export\s+)?[A-Za-z_]\w*=|(?:export|cd|set|unset|umask)\b)")
+# Steps run as '<interpreter> -c <script>', which only means "run this script" for POSIX-style shells
+STEP_SHELLS = ('sh', 'ksh', 'bash')
+_ctl_parse_cache = collections.OrderedDict()
+OUTPUT_TAIL_LINES = 200
+OUTPUT_ERROR_LINES = 50
+ERROR_LINE_RE = re.compile(r"\b(ERROR|FATAL|Exception|Traceback|ORA-\d+|Msg \d+, Level \d+|failed)\b", re.IGNORECASE)
 
-async def run_command_async(command, results_dict={}):
+# Failures worth retrying unchanged: transient DB/network errors, EX_TEMPFAIL, timeout(1) and killed processes
+RETRYABLE_ERROR_RE = re.compile(r"(deadlock victim|Msg 1205,|Login timeout expired|Query timeout expired|Communication link failure|"
+                                r"TCP Provider|Connection reset by peer|Connection refused|ORA-12170|ORA-03113|ORA-03114|"
+                                r"Resource temporarily unavailable|Stale file handle)", re.IGNORECASE)
+RETRYABLE_RETURNCODES = {75, 124, 137, 143}
+
+# Error snippet extraction from finished logs: family -> (pattern, weight); the highest weight wins, then the latest line
+ERROR_SNIPPET_PATTERNS = {
+    'mssql': (re.compile(r"Msg \d+, Level (1[6-9]|2[0-5]), State \d+"), 4),
+    'oracle': (re.compile(r"\bORA-\d{5}\b"), 4),
+    'python': (re.compile(r"^(Traceback \(most recent call last\)|\w+(Error|Exception): )"), 3),
+    'perl': (re.compile(r"\b(died|Can't locate|DBD::\w+::\w+ \w+ failed)\b"), 3),
+    'runjob': (re.compile(r"\b(ABEND|FATAL|Job failed|exit(ed)? (code|status) [1-9]\d*)\b", re.IGNORECASE), 3),
+    'shell': (re.compile(r"(command not found|No such file or directory|Permission denied|Segmentation fault|Killed$)"), 2),
+    'generic': (re.compile(r"\b(ERROR|Exception|failed|failure)\b", re.IGNORECASE), 1),
+}
+# Lower-case literals that every pattern above needs; found with bytes.find() before any regex runs on a line
+ERROR_SNIPPET_KEYWORDS = (b"error", b"exception", b"fail", b"msg ", b"ora-", b"traceback", b"died", b"can't locate", b"abend",
+                          b"fatal", b"exit", b"not found", b"no such file", b"denied", b"segmentation fault", b"killed")
+ERROR_SNIPPET_LINES = 5
+ERROR_SNIPPET_SCAN_BYTES = 16 * 1024 * 1024
+LOG_RUN_MARKER = "### NEW RUNBOT RUN BEGINS ###"
+MAX_CONCURRENCY = int(os.getenv('RUNBOT_MAX_CONCURRENCY', 8))
+KILL_GRACE_SECONDS = 10
+FAILED_STATUSES = ('FAILED', 'TIMEOUT', 'CANCELLED')
+ARTIFACT_CACHE_TTL_SECONDS = int(os.getenv('RUNBOT_ARTIFACT_CACHE_TTL_SECONDS', 900))
+
+
+async def run_command_async(command, results_dict=None, semaphore=None, detailed=False, timeout=None):
     """
-    INPUT: Unix command (str), results_dict (dict, optional)
+    INPUT: Unix command (str), results_dict (dict, optional), semaphore (asyncio.Semaphore, optional), detailed (bool, optional),
+           timeout (seconds, optional)
            - Not intended for standalone use, only to be called by the next function run_commands_async()
+           - semaphore caps how many commands run at once; detailed=True returns the CommandExecutor result dict instead of a tuple
            
     OUTPUT: command (same as input), failed (bool)
+            or, if detailed, {'command', 'returncode', 'duration', 'status', 'output_tail', 'error_lines'}
     """
-    if command in results_dict:
-        return command, 'SKIPPED'
-    logmsg(f"cs_util.py -> Executing command {command} asynchronously...")
-    failed = False
-    proc = await asyncio.create_subprocess_shell(command,
-                                                stdout=asyncio.subprocess.DEVNULL,
-                                                stderr=asyncio.subprocess.DEVNULL
-                                                )
-    await proc.wait()
-    if proc.returncode != 0:
-        failed = True
-        
-    return command, failed
+    if command in (results_dict or {}):
+        return _skipped_result(command) if detailed else (command, 'SKIPPED')
+    async with (semaphore or contextlib.nullcontext()):
+        result = await CommandExecutor(timeout=timeout).run(command)
+    return result if detailed else (command, result['status'] != 'SUCCESS')
     
 
-async def run_commands_async(commands, results_dict={}):
+async def run_commands_async(commands, results_dict=None, max_concurrency=None, detailed=False, timeout=None):
     """
-    INPUT: Unix commands (list), results_dict (dict, optional)
-           - Calls run_command_async() to execute all commands in list input at once
+    INPUT: Unix commands (list), results_dict (dict, optional), max_concurrency (int, optional), detailed (bool, optional),
+           timeout (seconds per command, optional)
+           - Runs the commands through a CommandExecutor, at most max_concurrency (default MAX_CONCURRENCY) at a time
            - results_dict is only to be used to tell the downstream function whether to skip the command
            
-    OUTPUT: List of (command, failed) tuples, output from run_command_async()
+    OUTPUT: List of (command, failed) tuples (or result dicts if detailed), in the order of commands
     """
-    tasks = [run_command_async(command, results_dict) for command in commands]
-    return await asyncio.gather(*tasks)
+    results_dict = results_dict or {}
+    results = [_skipped_result(command) if command in results_dict else None for command in commands]
+    executor = CommandExecutor(max_concurrency=max_concurrency, timeout=timeout)
+    async for result in executor.iter_results((i, command) for i, command in enumerate(commands) if results[i] is None):
+        results[result['key']] = result
+    if detailed:
+        return results
+    return [(r['command'], 'SKIPPED' if r['status'] == 'SKIPPED' else r['status'] != 'SUCCESS') for r in results]
+
+
+def _skipped_result(command, key=None, status='SKIPPED'):
+    return {'key': key, 'command': command, 'returncode': None, 'duration': 0.0, 'status': status,
+            'output_tail': "", 'error_lines': [], 'kill_reason': None}
         
 
 def get_unix_command_output(unix_cmd):
@@ -94,6 +161,138 @@ def check_valid_line(line):
     return True
 
 
+def is_runjob_line(line):
+    """
+    INPUT: line (str) from a CTL
+
+    OUTPUT: is_runjob (bool); True for uncommented, non-empty lines that invoke runjob
+    """
+    return "runjob " in line and check_valid_line(line)
+
+
+def _ctl_cache_file(ctl_path):
+    return os.path.join(CTL_CACHE_DIR, hashlib.sha1(os.path.abspath(ctl_path).encode()).hexdigest() + ".json")
+
+
+def _ctl_content_hash(ctl_path):
+    # Same digest scrub_ctl() computes while parsing
+    digest = hashlib.sha1()
+    with open(ctl_path) as f:
+        for line in f:
+            digest.update(line.encode())
+    return digest.hexdigest()
+
+
+def _get_cached_ctl(ctl_path, stat):
+    """
+    OUTPUT: cached parse (dict) for ctl_path if its mtime/size still match, or if only the mtime changed and
+            the content hash is the same (e.g. the CTL was copied or touched); else None
+    """
+    parsed = _ctl_parse_cache.get(ctl_path)
+    if parsed is None:
+        try:
+            with open(_ctl_cache_file(ctl_path)) as f:
+                parsed = json.load(f)
+        except (OSError, ValueError):
+            return None
+    if parsed.get('version') != CTL_CACHE_VERSION or parsed.get('path') != ctl_path or parsed.get('size') != stat.st_size:
+        return None
+    if parsed.get('mtime_ns') != stat.st_mtime_ns:
+        if _ctl_content_hash(ctl_path) != parsed.get('content_hash'):
+            return None
+        _store_cached_ctl({**parsed, 'mtime_ns': stat.st_mtime_ns})
+        return _ctl_parse_cache[ctl_path]
+    _ctl_parse_cache[ctl_path] = parsed
+    _ctl_parse_cache.move_to_end(ctl_path)
+    return parsed
+
+
+def _store_cached_ctl(parsed):
+    _ctl_parse_cache[parsed['path']] = parsed
+    _ctl_parse_cache.move_to_end(parsed['path'])
+    while len(_ctl_parse_cache) > CTL_PARSE_CACHE_MAX:
+        _ctl_parse_cache.popitem(last=False)
+    try:
+        os.makedirs(CTL_CACHE_DIR, exist_ok=True)
+        cache_file = _ctl_cache_file(parsed['path'])
+        with open(cache_file + f".{os.getpid()}", 'w') as f:
+            json.dump(parsed, f)
+        os.replace(cache_file + f".{os.getpid()}", cache_file)
+    except OSError as err:
+        logwarning(f"cs_util.py -> Unable to persist CTL parse cache to {CTL_CACHE_DIR}: {err}")
+
+
+def scrub_ctl(ctl_path, scrubbed_path=None, format_runjob=None, echo=False):
+    """
+    INPUT: ctl_path (str), scrubbed_path (str, optional), format_runjob (callable, optional), echo (bool, optional)
+           - Single streaming pass over the CTL: classifies each line, rewrites runjob lines through
+             format_runjob(line) -> line and writes them to scrubbed_path as it goes
+           - The parse (runjob lines, parallel blocks, prologue), not the CTL text, is cached in memory and in CTL_CACHE_DIR,
+             keyed by path + mtime + size, then content hash when only the mtime changed. With no scrubbed_path and no echo
+             a cached CTL is not read at all; otherwise it is streamed once without being classified again
+           - echo logs each scrubbed line, replacing a separate read-back of the scrubbed file
+
+    OUTPUT: runjob steps (list of dict), each {'step_id', 'line_no', 'command', 'parallel_block'} in CTL order;
+            parallel_block is the id of the '# runbot: parallel' block the step sits in, else None
+    """
+    stat = os.stat(ctl_path)
+    parsed = _get_cached_ctl(ctl_path, stat)
+    out = open(scrubbed_path, 'w') if scrubbed_path else None
+    steps = []
+
+    def emit(line_no, line, is_runjob, parallel_block=None):
+        if is_runjob:
+            line = line.strip()
+            if format_runjob:
+                line = format_runjob(line)
+            steps.append({'step_id': len(steps) + 1, 'line_no': line_no, 'command': line, 'parallel_block': parallel_block})
+        if out:
+            out.write(line + "\n")
+        if echo:
+            print(line)
+
+    try:
+        if parsed is not None and out is None and not echo:
+            for line_no, line, block in parsed['runjobs']:
+                emit(line_no, line, True, block)
+        elif parsed is not None:
+            runjob_blocks = {line_no: block for line_no, _, block in parsed['runjobs']}
+            with open(ctl_path) as f:
+                for line_no, line in enumerate(f, 1):
+                    emit(line_no, line.rstrip("\n"), line_no in runjob_blocks, runjob_blocks.get(line_no))
+        else:
+            digest, interpreter, runjobs = hashlib.sha1(), None, []
+            prologue, trailing_commands, block, block_count = [], 0, None, 0
+            with open(ctl_path) as f:
+                for line_no, line in enumerate(f, 1):
+                    digest.update(line.encode())
+                    line = line.rstrip("\n")
+                    is_runjob = is_runjob_line(line)
+                    if line_no == 1 and line.startswith('#!'):
+                        interpreter = line[2:].strip()
+                    if PARALLEL_BEGIN_RE.match(line):
+                        block_count += 1
+                        block = block_count
+                    elif PARALLEL_END_RE.match(line):
+                        block = None
+                    elif is_runjob:
+                        runjobs.append((line_no, line, block))
+                    elif check_valid_line(line):
+                        # Executable non-runjob lines: setup before the first runjob, anything else after it
+                        if runjobs:
+                            trailing_commands += 1
+                        else:
+                            prologue.append(line)
+                    emit(line_no, line, is_runjob, block)
+            _store_cached_ctl({'version': CTL_CACHE_VERSION, 'path': ctl_path, 'mtime_ns': stat.st_mtime_ns,
+                               'size': stat.st_size, 'content_hash': digest.hexdigest(), 'runjobs': runjobs,
+                               'prologue': prologue, 'trailing_commands': trailing_commands, 'interpreter': interpreter})
+    finally:
+        if out:
+            out.close()
+    return steps
+
+
 def check_ctl_for_runjob(command, silent=False):
     """
     INPUT: command (str), silent (bool, optional)
@@ -104,12 +303,9 @@ def check_ctl_for_runjob(command, silent=False):
         logmsg(f"cs_util.py -> Parsing CTL for runjob command(s): {command}")
     else:
         logmsg("cs_util.py -> Parsing CTL for runjob command(s)...")
-    runjobs_list = []
-    with open(command) as f:
-        for line in list(map(str.strip, f.readlines())):
-            if "runjob " in line and check_valid_line(line):
-                logmsg(f"CTL Contains Runjob: {line}")
-                runjobs_list.append(line)
+    runjobs_list = [step['command'] for step in scrub_ctl(command)]
+    for line in runjobs_list:
+        logmsg(f"CTL Contains Runjob: {line}")
                 
     if len(runjobs_list) == 1:
         return runjobs_list[0]
@@ -118,39 +314,282 @@ def check_ctl_for_runjob(command, silent=False):
     return command
     
     
-def get_srg_runjob_command(job_nm):
+def describe_ctl(ctl_path):
     """
-    Given job name (mis_?i??_00_c format), returns SRG runjob command since CTL does not exist for SRG
+    INPUT: ctl_path (str)
 
-    params: job_nm (str)
-    returns: runjob_cmd (str)
+    OUTPUT: parsed CTL (dict) from the scrub_ctl() cache: prologue lines, interpreter, trailing_commands, etc.
     """
-    # If job_nm is passed in CTL format, scrub it back to expected format
-    job_nm = f"mis_{job_nm.split('/')[-1].split('praa')[-1].removesuffix('.ctl')}_00_c"
-    
-    logmsg(f"cs_artifact -> Getting runjob cmd for {job_nm} from MIS_Reports.dbo.ARTFCT_DETAILS_VALUES_T")
+    parsed = _get_cached_ctl(ctl_path, os.stat(ctl_path))
+    if parsed is None:
+        scrub_ctl(ctl_path)
+        parsed = _ctl_parse_cache[ctl_path]
+    return parsed
+
+
+def build_ctl_step_graph(steps):
+    """
+    INPUT: steps (list of dict) from scrub_ctl()
+           - Steps run in CTL order by default; consecutive steps in the same '# runbot: parallel' block form one stage
+
+    OUTPUT: stages (list of lists of steps); every step in a stage may run concurrently, stages run in order
+    """
+    stages = []
+    for step in steps:
+        block = step.get('parallel_block')
+        if block is not None and stages and stages[-1][0].get('parallel_block') == block:
+            stages[-1].append(step)
+        else:
+            stages.append([step])
+    return stages
+
+
+def is_ctl_step_decomposable(ctl_path, steps, require_parallel=True):
+    """
+    INPUT: ctl_path (str), steps (list of dict) from scrub_ctl(), require_parallel (bool, optional)
+
+    OUTPUT: is_decomposable (bool); True if the CTL is a sh/ksh/bash script that only has repeatable setup lines
+            (assignments, export/cd/set) before its runjobs (and, with require_parallel, marks parallel blocks), so each
+            runjob can safely run as its own step. Otherwise the CTL must run as one script
+    """
+    if require_parallel and not any(step.get('parallel_block') is not None for step in steps):
+        return False
+    parsed = describe_ctl(ctl_path)
+    shell = _interpreter_name(parsed['interpreter'])
+    if shell not in STEP_SHELLS:
+        # e.g. 'perl -c' would only syntax-check the step and report SUCCESS without running it
+        logwarning(f"cs_util.py -> CTL interpreter '{parsed['interpreter']}' is not one of {', '.join(STEP_SHELLS)}; executing plain CTL")
+        return False
+    if parsed['trailing_commands']:
+        logwarning(f"cs_util.py -> CTL has {parsed['trailing_commands']} non-runjob command(s) after its first runjob; "
+                   "executing plain CTL")
+        return False
+    # Every step re-runs the prologue, so it may only set up the environment
+    unsafe = [line for line in parsed['prologue'] if not REPEATABLE_PROLOGUE_RE.match(line) or '$(' in line or '`' in line]
+    if unsafe:
+        logwarning(f"cs_util.py -> CTL setup line '{unsafe[0].strip()}' cannot be repeated for each step; executing plain CTL")
+        return False
+    return True
+
+
+def _interpreter_name(interpreter):
+    """
+    OUTPUT: basename (str) of a shebang's interpreter, looking through '/usr/bin/env'; 'sh' when there is no shebang
+    """
+    words = (interpreter or '/bin/sh').split()
+    if words and os.path.basename(words[0]) == 'env':
+        words = [word for word in words[1:] if not word.startswith('-')]
+    return os.path.basename(words[0]) if words else None
+
+
+def _ctl_step_command(step, prologue, interpreter):
+    script = "\n".join(prologue + [step['command']])
+    return f"{interpreter or '/bin/sh'} -c {shlex.quote(script)}"
+
+
+def execute_ctl_steps(ctl_path, steps, max_concurrency=4, completed_step_ids=(), on_step_done=None, step_timeout=None, log_path=None,
+                      deadline=None, stall_timeout=None):
+    """
+    INPUT: ctl_path (str), steps (list of dict) from scrub_ctl(), max_concurrency (int, optional),
+           completed_step_ids (collection of int, optional), on_step_done (callable, optional),
+           step_timeout (seconds, optional), log_path (str, optional), deadline (time.monotonic() value, optional),
+           stall_timeout (seconds, optional)
+           - Runs the step graph from build_ctl_step_graph(); each step gets the CTL's setup lines (prologue)
+           - Steps in completed_step_ids are not run again and are recorded as CHECKPOINTED
+           - on_step_done(result) is called as soon as each step finishes, e.g. to checkpoint it
+           - A step running longer than step_timeout, or past the deadline, or silent for stall_timeout, has its process
+             group killed and is recorded as TIMEOUT, with kill_reason 'BUDGET' or 'STALL'
+           - Step output is appended to log_path, each line prefixed with '[step_id] '
+           - Stops after the first stage with a failure; later steps are recorded as SKIPPED
+
+    OUTPUT: step results (list of dict), each step plus {'returncode', 'duration', 'status', 'output_tail', 'error_lines',
+            'kill_reason'}, in CTL order
+    """
+    parsed = describe_ctl(ctl_path)
+    stages = build_ctl_step_graph(steps)
+    completed_step_ids = set(completed_step_ids)
+    logmsg(f"cs_util.py -> Executing {len(steps) - len(completed_step_ids & {s['step_id'] for s in steps})} of {len(steps)} "
+           f"CTL step(s) in {len(stages)} stage(s), up to {max_concurrency} at a time")
+
+    async def run_stage(stage):
+        timeout = step_timeout
+        if deadline is not None:
+            timeout = max(1, min(timeout or float('inf'), deadline - time.monotonic()))
+        executor = CommandExecutor(max_concurrency=max_concurrency, timeout=timeout, log_path=log_path, stall_seconds=stall_timeout)
+        steps_by_id, results = {step['step_id']: step for step in stage}, {}
+        async for result in executor.iter_results(
+                (step['step_id'], _ctl_step_command(step, parsed['prologue'], parsed['interpreter'])) for step in stage):
+            result = {**steps_by_id[result['key']], **{k: result[k] for k in ('returncode', 'duration', 'status', 'output_tail', 'error_lines', 'kill_reason')}}
+            if on_step_done:
+                on_step_done(result)
+            results[result['step_id']] = result
+        return results
+
+    results, failed = [], False
+    for stage in stages:
+        if failed:
+            results.extend({**step, 'returncode': None, 'duration': 0.0, 'status': 'SKIPPED'} for step in stage)
+            continue
+        done = {step['step_id']: {**step, 'returncode': 0, 'duration': 0.0, 'status': 'CHECKPOINTED'}
+                for step in stage if step['step_id'] in completed_step_ids}
+        pending = [step for step in stage if step['step_id'] not in done]
+        stage_results = {}
+        if pending:
+            with runbot_metrics.get_metrics().children_of('ctl_step', count=len(pending)):
+                stage_results = asyncio.run(run_stage(pending))
+        for step in stage:
+            result = done.get(step['step_id']) or stage_results[step['step_id']]
+            results.append(result)
+            if result['status'] in FAILED_STATUSES:
+                failed = True
+    return results
+
+
+def is_retryable_failure(returncode, error_lines=()):
+    """
+    INPUT: returncode (int or None), error_lines (iterable of str, optional) captured from the failed command
+
+    OUTPUT: is_retryable (bool); True if the failure looks transient (RETRYABLE_RETURNCODES, a signal, or a
+            RETRYABLE_ERROR_RE match) and the same command may succeed if simply run again
+    """
+    if returncode is not None and (returncode < 0 or returncode in RETRYABLE_RETURNCODES):
+        return True
+    return any(RETRYABLE_ERROR_RE.search(line) for line in error_lines)
+
+
+def log_ctl_step_results(results):
+    """
+    INPUT: results (list of dict) from execute_ctl_steps()
     
+    OUTPUT: None; logs one line per step
+    """
+    for result in results:
+        block = f" [parallel block {result['parallel_block']}]" if result.get('parallel_block') is not None else ""
+        msg = (f"cs_util.py -> Step {result['step_id']} (line {result['line_no']}){block}: {result['status']} "
+               f"rc={result['returncode']} in {result['duration']:.1f}s -- {result['command']}")
+        logerr(msg) if result['status'] in FAILED_STATUSES else logmsg(msg)
+
+
+def _srg_job_nm(job_nm):
+    # If job_nm is passed in CTL format, scrub it back to expected format
+    return f"mis_{job_nm.split('/')[-1].split('praa')[-1].removesuffix('.ctl')}_00_c"
+
+
+def _srg_key(job_nm):
+    # VAL_255 was compared under a case-insensitive collation that ignores trailing spaces; match the same way
+    return (job_nm or '').strip().casefold()
+
+
+class ArtifactResolver:
+    """
+    In-process cache of artifact lookups used to build runjob commands:
+      - SRG job_nm -> runjob_cmd, loaded for all production SRG artifacts in one query and reloaded after
+        ttl_seconds (or, at most every miss_refresh_seconds, when a job name is not found)
+      - publish CFG names, from one listing of the publish directory, refreshed when its mtime changes
+    """
+    SRG_COMMANDS_SQL = """
+        SELECT j.VAL_255 AS 'JOB_NM', 'runjob srg ' + v.[VALUE] AS 'RUNJOB_CMD'
+        FROM   MIS_Reports.dbo.ARTFCT_ATTRB_VALUE_V v
+            INNER JOIN MIS_Reports.dbo.ARTFCT_DETAILS_VALUES_T pd ON pd.ARTFCT_ID = v.ARTFCT_ID AND pd.ATTRB_ID = 4
+            INNER JOIN MIS_Reports.dbo.ARTFCT_DETAILS_VALUES_T j ON j.ARTFCT_ID = v.ARTFCT_ID AND j.ATTRB_ID = 9
+        WHERE  ARTFCT_TYPE_CD = 'SRG' AND v.ATTRB_ID = 35 AND pd.VAL_255 = 'P'
+        """
+
+    def __init__(self, ttl_seconds=ARTIFACT_CACHE_TTL_SECONDS, miss_refresh_seconds=60) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.miss_refresh_seconds = miss_refresh_seconds
+        self.__srg_commands = None   # _srg_key(job_nm) -> list of runjob_cmd
+        self.__srg_loaded_at = 0
+        self.__lock = threading.Lock()
+
+    def __load_srg_commands(self):
+        start = time.monotonic()
+        commands = {}
+        for row in runbot_db.get_session().query(self.SRG_COMMANDS_SQL, label='SRG_RUNJOB_CMDS'):
+            commands.setdefault(_srg_key(row.get('JOB_NM')), []).append(row.get('RUNJOB_CMD'))
+        self.__srg_commands, self.__srg_loaded_at = commands, time.monotonic()
+        logmsg(f"cs_artifact -> Loaded runjob commands for {len(commands)} SRG job(s) from MIS_Reports.dbo.ARTFCT_DETAILS_VALUES_T "
+               f"in {time.monotonic() - start:.2f}s")
+
+    def srg_commands(self, job_nms):
+        """
+        INPUT: job_nms (iterable of str), already in mis_?i??_00_c format
+
+        OUTPUT: dict of job_nm -> list of runjob_cmd (empty if not found), or None if the bulk load failed
+        """
+        with self.__lock:
+            age = time.monotonic() - self.__srg_loaded_at
+            try:
+                if self.__srg_commands is None or age > self.ttl_seconds:
+                    self.__load_srg_commands()
+                elif age > self.miss_refresh_seconds and any(_srg_key(job_nm) not in self.__srg_commands for job_nm in job_nms):
+                    # A job added since the last load; reload rather than report it missing
+                    self.__load_srg_commands()
+            except Exception as e:
+                logwarning(f"cs_artifact -> Bulk SRG command load failed; looking up each job instead. Exception: {e}")
+                return None
+            return {job_nm: self.__srg_commands.get(_srg_key(job_nm), []) for job_nm in job_nms}
+
+    def invalidate(self):
+        with self.__lock:
+            self.__srg_commands, self.__srg_loaded_at = None, 0
+
+
+_artifact_resolver = ArtifactResolver()
+
+
+def _query_srg_runjob_commands(job_nm):
     sql = """
         SELECT 'runjob srg ' + v.[VALUE] AS 'RUNJOB_CMD'
         FROM   MIS_Reports.dbo.ARTFCT_ATTRB_VALUE_V v
             INNER JOIN MIS_Reports.dbo.ARTFCT_DETAILS_VALUES_T pd ON pd.ARTFCT_ID = v.ARTFCT_ID AND pd.ATTRB_ID = 4
             INNER JOIN MIS_Reports.dbo.ARTFCT_DETAILS_VALUES_T j ON j.ARTFCT_ID = v.ARTFCT_ID AND j.ATTRB_ID = 9
-        WHERE  ARTFCT_TYPE_CD = 'SRG' AND v.ATTRB_ID = 35 AND pd.VAL_255 = 'P' AND j.val_255 = '{}'
-        """.format(job_nm)
-    
-    try:
-        data = cs_db.DataBase.mssql_query(sql)
-        if len(data) > 1:
-            logwarning(f"cs_artifact -> More than 1 command returned for {job_nm}; check data and retry")
-            return
-        if len(data) < 1:
-            raise Exception f"No command found for '{job_nm}'; either job name \
-                is invalid or data entry is missing"
-            return
-        return data[0].get('RUNJOB_CMD')
-    except Exception as e:
-        logerr(f"cs_artifact.get_srg_runjob_command() -> Threw exception:\n{e}")
-        return
+        WHERE  ARTFCT_TYPE_CD = 'SRG' AND v.ATTRB_ID = 35 AND pd.VAL_255 = 'P' AND j.val_255 = ?
+        """
+    return [row.get('RUNJOB_CMD') for row in runbot_db.get_session().query(sql, (job_nm,), label='SRG_RUNJOB_CMD')]
+
+
+def get_srg_runjob_commands(job_nms):
+    """
+    Batch form of get_srg_runjob_command(); all names are resolved from one bulk load of the SRG artifacts
+
+    params: job_nms (iterable of str), job names or CTL paths
+    returns: dict of each input -> runjob_cmd (str), or None if there is no unique command
+    """
+    job_nms = list(dict.fromkeys(job_nms))
+    scrubbed = {job_nm: _srg_job_nm(job_nm) for job_nm in job_nms}
+    commands_by_job_nm = _artifact_resolver.srg_commands(set(scrubbed.values()))
+
+    results = {}
+    for job_nm in job_nms:
+        try:
+            if commands_by_job_nm is None:
+                logmsg(f"cs_artifact -> Getting runjob cmd for {scrubbed[job_nm]} from MIS_Reports.dbo.ARTFCT_DETAILS_VALUES_T")
+                commands = _query_srg_runjob_commands(scrubbed[job_nm])
+            else:
+                commands = commands_by_job_nm[scrubbed[job_nm]]
+            if len(commands) > 1:
+                logwarning(f"cs_artifact -> More than 1 command returned for {scrubbed[job_nm]}; check data and retry")
+                results[job_nm] = None
+                continue
+            if len(commands) < 1:
+                raise Exception(f"No command found for '{scrubbed[job_nm]}'; either job name "
+                                "is invalid or data entry is missing")
+            results[job_nm] = commands[0]
+        except Exception as e:
+            logerr(f"cs_artifact.get_srg_runjob_command() -> Threw exception:\n{e}")
+            results[job_nm] = None
+    return results
+
+
+def get_srg_runjob_command(job_nm):
+    """
+    Given job name (mis_?i??_00_c format), returns SRG runjob command since CTL does not exist for SRG
+
+    params: job_nm (str)
+    returns: runjob_cmd (str)
+    """
+    return get_srg_runjob_commands([job_nm])[job_nm]
 
 def run_command_python(command, pipe_output=True):
     """
@@ -166,12 +605,566 @@ def run_command_python(command, pipe_output=True):
                             stdout=(subprocess.PIPE if pipe_output else subprocess.DEVNULL),
                             stderr=(subprocess.PIPE if pipe_output else subprocess.DEVNULL)
                             )
-    proc.wait()
+    _wait_and_record(proc, 'python_command')
     if proc.returncode != 0:
         failed = True
     return failed
 
 
+def _wait_and_record(proc, label):
+    """
+    INPUT: proc (subprocess.Popen), label (str) for the metrics
+           - Reaps the child with os.wait4() so its CPU time and max RSS go to runbot_metrics
+
+    OUTPUT: returncode (int), also set on proc
+    """
+    try:
+        _, status, rusage = os.wait4(proc.pid, 0)
+    except ChildProcessError:
+        return proc.wait()
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    runbot_metrics.get_metrics().record_child(label, rusage)
+    return proc.returncode
+
+
+class OutputCapture:
+    """
+    Fixed-size view of a child's output: a ring buffer of the last tail_lines lines and of the last error_lines lines
+    matching ERROR_LINE_RE (with their line numbers). Memory use is bounded no matter how much output is fed in
+    """
+    def __init__(self, tail_lines=OUTPUT_TAIL_LINES, error_lines=OUTPUT_ERROR_LINES, max_line_len=4096) -> None:
+        self.tail = collections.deque(maxlen=tail_lines)
+        self.errors = collections.deque(maxlen=error_lines)
+        self.max_line_len = max_line_len
+        self.line_count = 0
+        self.byte_count = 0
+        self.returncode = None
+        self.kill_reason = None # set when a Watchdog killed the command ('BUDGET' or 'STALL')
+        self.__partial = b""
+
+    def __add_line(self, raw):
+        self.line_count += 1
+        line = raw[:self.max_line_len].decode('utf-8', errors='replace').rstrip("\r")
+        self.tail.append(line)
+        if ERROR_LINE_RE.search(line):
+            self.errors.append((self.line_count, line))
+
+    def feed(self, data):
+        """
+        INPUT: data (bytes), the next chunk of output
+        """
+        self.byte_count += len(data)
+        *lines, self.__partial = (self.__partial + data).split(b"\n")
+        for raw in lines:
+            self.__add_line(raw)
+        # An unterminated line can't grow without bound; keep only what will be stored
+        if len(self.__partial) > self.max_line_len:
+            self.__partial = self.__partial[:self.max_line_len]
+
+    def close(self):
+        if self.__partial:
+            self.__add_line(self.__partial)
+            self.__partial = b""
+
+    def summary(self, error_text=None):
+        """
+        INPUT: error_text (str, optional), e.g. from format_error_lines(); replaces the captured error lines
+        OUTPUT: text (str) with the error lines followed by the output tail
+        """
+        text = ""
+        if error_text:
+            text += "Error lines:\n" + error_text + "\n\n"
+        elif self.errors:
+            text += "Error lines:\n" + "\n".join(f"[line {n}] {line}" for n, line in self.errors) + "\n\n"
+        text += f"Last {len(self.tail)} of {self.line_count} line(s):\n" + "\n".join(self.tail)
+        return text
+
+
+class CommandExecutor:
+    """
+    Runs shell commands with asyncio, at most max_concurrency at a time, each in its own process group.
+    A command still running after timeout seconds has its whole process group sent SIGTERM, then SIGKILL after
+    kill_grace seconds; so is a command that produces no output for stall_seconds (a Watchdog per command).
+    Output (stdout + stderr) is kept as an OutputCapture tail and optionally appended, line by
+    line and prefixed with the command's key, to log_path. cancel() stops commands that are running and any not yet started.
+
+    Each result is a dict: {'key', 'command', 'returncode', 'duration', 'status', 'output_tail', 'error_lines', 'kill_reason'}
+    with status SUCCESS, FAILED, TIMEOUT or CANCELLED; kill_reason is 'BUDGET' or 'STALL' for a TIMEOUT, else None
+    """
+    def __init__(self, max_concurrency=None, timeout=None, kill_grace=KILL_GRACE_SECONDS, tail_lines=OUTPUT_TAIL_LINES,
+                 error_lines=OUTPUT_ERROR_LINES, log_path=None, stall_seconds=None) -> None:
+        self.max_concurrency = max_concurrency or MAX_CONCURRENCY
+        self.timeout = timeout
+        self.stall_seconds = stall_seconds
+        self.kill_grace = kill_grace
+        self.tail_lines = tail_lines
+        self.error_lines = error_lines
+        self.log_path = log_path
+        self.is_cancelled = False
+        self.__running = {}   # pid -> asyncio.subprocess.Process
+        self.__semaphore = None
+
+
+    def cancel(self):
+        """
+        Kills the process group of every running command; commands not yet started finish as CANCELLED.
+        Safe to call from a signal handler or another thread
+        """
+        self.is_cancelled = True
+        for pid in list(self.__running):
+            self.__signal_group(pid, signal.SIGKILL)
+
+
+    def __signal_group(self, pid, signum):
+        try:
+            os.killpg(pid, signum)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+    async def __terminate(self, proc):
+        self.__signal_group(proc.pid, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(proc.wait(), self.kill_grace)
+        except asyncio.TimeoutError:
+            logwarning(f"cs_util.py -> Process group {proc.pid} ignored SIGTERM for {self.kill_grace}s; sending SIGKILL")
+            self.__signal_group(proc.pid, signal.SIGKILL)
+            await proc.wait()
+
+
+    async def __read_output(self, proc, capture, log, prefix, watchdog):
+        partial = b""
+        while True:
+            data = await proc.stdout.read(65536)
+            if not data:
+                break
+            capture.feed(data)
+            if watchdog:
+                watchdog.progress(len(data))
+            if log:
+                *lines, partial = (partial + data).split(b"\n")
+                log.write(b"".join(prefix + line + b"\n" for line in lines))
+                log.flush()
+        if log and partial:
+            log.write(prefix + partial + b"\n")
+        await proc.wait()
+
+
+    async def __read_watched(self, proc, capture, log, prefix):
+        """
+        OUTPUT: 'STALL' if the command went silent for stall_seconds (output is no longer read), else None once it exited
+        """
+        watchdog = Watchdog(stall_seconds=self.stall_seconds) if self.stall_seconds else None
+        reader = asyncio.ensure_future(self.__read_output(proc, capture, log, prefix, watchdog))
+        try:
+            while watchdog and not reader.done():
+                await asyncio.wait({reader}, timeout=1)
+                if not reader.done() and watchdog.check():
+                    if log:
+                        log.write(f"\n{prefix.decode()}### RUNBOT WATCHDOG: killed (STALL): {watchdog.describe()} ###\n".encode())
+                    return watchdog.kill_reason
+            await reader
+            return None
+        finally:
+            if not reader.done():
+                reader.cancel()
+                await asyncio.gather(reader, return_exceptions=True)
+
+
+    async def run(self, command, key=None):
+        """
+        INPUT: Unix command (str), key (any, optional) to identify the result
+        OUTPUT: result (dict); runs now, without waiting for a concurrency slot
+        """
+        if self.is_cancelled:
+            return _skipped_result(command, key, status='CANCELLED')
+        logmsg(f"cs_util.py -> Executing command {command} asynchronously...")
+        capture = OutputCapture(self.tail_lines, self.error_lines)
+        start, status, kill_reason = time.monotonic(), None, None
+        proc = await asyncio.create_subprocess_shell(command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+                                                     start_new_session=True)
+        self.__running[proc.pid] = proc
+        log = open(self.log_path, 'ab') if self.log_path else None
+        try:
+            kill_reason = await asyncio.wait_for(self.__read_watched(proc, capture, log, f"[{key}] ".encode() if key is not None else b""),
+                                                 self.timeout)
+            if kill_reason:
+                status = 'TIMEOUT'
+                logerr(f"cs_util.py -> Command produced no output for {self.stall_seconds}s; terminating process group {proc.pid}: {command}")
+                await self.__terminate(proc)
+        except asyncio.TimeoutError:
+            status, kill_reason = 'TIMEOUT', 'BUDGET'
+            logwarning(f"cs_util.py -> Command exceeded its {self.timeout}s timeout; terminating process group {proc.pid}: {command}")
+            await self.__terminate(proc)
+        except asyncio.CancelledError:
+            # Reap before re-raising, so nothing is left behind when the event loop closes
+            self.__signal_group(proc.pid, signal.SIGKILL)
+            await proc.wait()
+            raise
+        finally:
+            self.__running.pop(proc.pid, None)
+            if log:
+                log.close()
+        capture.close()
+        if status is None:
+            status = 'CANCELLED' if self.is_cancelled and proc.returncode != 0 else ('SUCCESS' if proc.returncode == 0 else 'FAILED')
+        return {'key': key, 'command': command, 'returncode': proc.returncode, 'duration': time.monotonic() - start,
+                'status': status, 'output_tail': "\n".join(capture.tail), 'error_lines': [line for _, line in capture.errors],
+                'kill_reason': kill_reason}
+
+
+    async def __run_bounded(self, key, command):
+        async with self.__semaphore:
+            return await self.run(command, key)
+
+
+    async def iter_results(self, commands):
+        """
+        INPUT: commands (iterable of str, or of (key, command) tuples); key defaults to the command's position
+        OUTPUT: async generator of result dicts, in the order the commands finish.
+                Closing the generator early cancels the rest and kills their process groups
+        """
+        self.__semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks = [asyncio.create_task(self.__run_bounded(*(item if isinstance(item, tuple) else (i, item))))
+                 for i, item in enumerate(commands)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def run_commands(commands, max_concurrency=None, timeout=None, on_result=None, **executor_args):
+    """
+    INPUT: commands (iterable of str or (key, command)), max_concurrency (int, optional), timeout (seconds per command, optional),
+           on_result (callable, optional), called with each result as soon as its command finishes
+           - Synchronous entry point for scripts; Ctrl-C kills every running process group before returning
+
+    OUTPUT: list of result dicts (see CommandExecutor), in the order the commands finished
+    """
+    executor = CommandExecutor(max_concurrency=max_concurrency, timeout=timeout, **executor_args)
+
+    async def collect():
+        results = []
+        async for result in executor.iter_results(commands):
+            results.append(result)
+            if on_result:
+                on_result(result)
+        return results
+    return asyncio.run(collect())
+
+
+def iter_command_results(commands, max_concurrency=None, timeout=None, **executor_args):
+    """
+    INPUT: same as run_commands()
+    OUTPUT: generator of result dicts as each command finishes, for synchronous callers (e.g. run_bulk_jobs-style loops).
+            The commands run on an event loop in a background thread; breaking out of the loop cancels the rest
+    """
+    executor = CommandExecutor(max_concurrency=max_concurrency, timeout=timeout, **executor_args)
+    results, is_done = queue.Queue(), object()
+
+    async def produce():
+        try:
+            async for result in executor.iter_results(commands):
+                results.put(result)
+                if executor.is_cancelled:
+                    break
+        finally:
+            results.put(is_done)
+
+    thread = threading.Thread(target=asyncio.run, args=(produce(),), name="command-executor", daemon=True)
+    thread.start()
+    try:
+        while (result := results.get()) is not is_done:
+            yield result
+    finally:
+        executor.cancel()
+        thread.join()
+
+
+def _descendant_pids(pid):
+    """
+    OUTPUT: list of pids (int) of every live descendant of pid, read from /proc; empty where /proc is unavailable
+    """
+    children = collections.defaultdict(list)
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children[ppid].append(int(entry))
+    descendants, stack = [], [pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            descendants.append(child)
+            stack.append(child)
+    return descendants
+
+
+def kill_process_tree(pid, grace=KILL_GRACE_SECONDS):
+    """
+    INPUT: pid (int) of a child started with start_new_session=True, grace (seconds, optional)
+           - SIGTERM to its process group and to every descendant (including ones that left the group with setsid),
+             then SIGKILL to whatever is still alive after grace seconds
+
+    OUTPUT: None
+    """
+    def signal_tree(pids, signum):
+        for target in pids:
+            try:
+                os.kill(target, signum)
+            except (ProcessLookupError, PermissionError):
+                pass
+        try:
+            os.killpg(pid, signum)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    pids = [pid] + _descendant_pids(pid)
+    signal_tree(pids, signal.SIGTERM)
+    deadline = time.monotonic() + grace
+    while time.monotonic() < deadline:
+        alive = [p for p in pids if os.path.exists(f"/proc/{p}") and not _is_zombie(p)]
+        if not alive:
+            return
+        time.sleep(0.2)
+    logwarning(f"cs_util.py -> Process tree {pid} ignored SIGTERM for {grace}s; sending SIGKILL")
+    signal_tree(pids + _descendant_pids(pid), signal.SIGKILL)
+
+
+def _is_zombie(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(')', 1)[1].split()[0] == 'Z'
+    except (OSError, IndexError):
+        return True
+
+
+class Watchdog:
+    """
+    Time budget and stall policy for one running command. The runner calls progress() as output arrives and
+    check() periodically; check() returns 'BUDGET' once the command has run budget_seconds, or 'STALL' once it has
+    produced no output for stall_seconds. Either limit may be None
+    """
+    def __init__(self, budget_seconds=None, stall_seconds=None) -> None:
+        self.budget_seconds = budget_seconds
+        self.stall_seconds = stall_seconds
+        self.byte_count = 0
+        self.kill_reason = None
+        self.started = self.last_output = time.monotonic()
+
+
+    def progress(self, byte_count):
+        self.byte_count += byte_count
+        self.last_output = time.monotonic()
+
+
+    def check(self):
+        """
+        OUTPUT: kill_reason (str: 'BUDGET' or 'STALL') if the command should be killed, else None
+        """
+        now = time.monotonic()
+        if self.budget_seconds and now - self.started > self.budget_seconds:
+            self.kill_reason = 'BUDGET'
+        elif self.stall_seconds and now - self.last_output > self.stall_seconds:
+            self.kill_reason = 'STALL'
+        return self.kill_reason
+
+
+    def describe(self):
+        """
+        OUTPUT: short progress text (str), e.g. for a heartbeat
+        """
+        now = time.monotonic()
+        budget = f" of {self.budget_seconds / 60:.0f}m budget" if self.budget_seconds else ""
+        return (f"running {(now - self.started) / 60:.1f}m{budget}; {self.byte_count / 1e6:.1f} MB output, "
+                f"last output {now - self.last_output:.0f}s ago")
+
+
+def run_command_streaming(command, log_path=None, tail_lines=OUTPUT_TAIL_LINES, error_lines=OUTPUT_ERROR_LINES, chunk_size=65536,
+                          watchdog=None):
+    """
+    INPUT: Unix command (str), log_path (str, optional), tail_lines (int, optional), error_lines (int, optional),
+           watchdog (Watchdog, optional)
+           - stdout and stderr are read incrementally with non-blocking reads and appended to log_path as they arrive
+           - Only an OutputCapture (tail + error lines) is kept in memory, so RSS stays flat for any output size
+           - With a watchdog, the command runs in its own session; once watchdog.check() trips, the whole process tree
+             is killed and capture.kill_reason is set
+
+    OUTPUT: failed (bool), capture (OutputCapture)
+    """
+    logmsg(f"cs_util.py -> Executing Python command (output streamed to {log_path or 'in-memory tail only'})")
+    capture = OutputCapture(tail_lines, error_lines)
+    proc = subprocess.Popen(command,
+                            shell=True,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT,
+                            start_new_session=watchdog is not None
+                            )
+    fd = proc.stdout.fileno()
+    os.set_blocking(fd, False)
+    log = open(log_path, 'ab') if log_path else None
+    try:
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+            is_open, killed_at = True, None
+            while is_open:
+                for _ in selector.select(timeout=1):
+                    try:
+                        data = os.read(fd, chunk_size)
+                    except BlockingIOError:
+                        continue
+                    if not data:
+                        is_open = False
+                        break
+                    if log:
+                        log.write(data)
+                        log.flush()
+                    capture.feed(data)
+                    if watchdog:
+                        watchdog.progress(len(data))
+                if watchdog and capture.kill_reason is None and watchdog.check():
+                    capture.kill_reason = watchdog.kill_reason
+                    logerr(f"cs_util.py -> Watchdog killing process tree {proc.pid} ({watchdog.kill_reason}: {watchdog.describe()})")
+                    if log:
+                        log.write(f"\n### RUNBOT WATCHDOG: killed ({watchdog.kill_reason}): {watchdog.describe()} ###\n".encode())
+                    kill_process_tree(proc.pid)
+                    killed_at = time.monotonic()
+                # An orphan that escaped the kill may still hold the pipe open; stop reading rather than wait on it
+                if capture.kill_reason and time.monotonic() - killed_at > KILL_GRACE_SECONDS:
+                    break
+    finally:
+        if log:
+            log.close()
+        proc.stdout.close()
+    _wait_and_record(proc, 'runbot_command')
+    capture.close()
+    capture.returncode = proc.returncode
+    return proc.returncode != 0, capture
+
+
+def _error_line_weight(line):
+    return max((weight for pattern, weight in ERROR_SNIPPET_PATTERNS.values() if pattern.search(line)), default=0)
+
+
+def extract_error_lines(log_path, max_lines=ERROR_SNIPPET_LINES, context_lines=2, max_scan_bytes=ERROR_SNIPPET_SCAN_BYTES,
+                        block_size=65536, stop_marker=LOG_RUN_MARKER):
+    """
+    INPUT: log_path (str), max_lines (int, optional), context_lines (int, optional), max_scan_bytes (int, optional),
+           block_size (int, optional), stop_marker (str, optional)
+           - Memory-maps the log and scans backwards from the end in block_size blocks, so the cost depends on
+             the tail scanned (at most max_scan_bytes), not the file size
+           - Stops at the last stop_marker, i.e. at the start of the latest run appended to the log
+
+    OUTPUT: list of dict {'line_no', 'from_end', 'line', 'family', 'before', 'after'}, oldest first. The most relevant
+            error lines (ERROR_SNIPPET_PATTERNS weight, then nearest the end). line_no is None unless the scan
+            reached the start of the file; from_end is always the line's distance from the last line
+    """
+    try:
+        with open(log_path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if not size:
+                return []
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return _extract_error_lines(mm, size, max_lines, context_lines, max_scan_bytes, block_size,
+                                            stop_marker.encode() if stop_marker else None)
+    except (OSError, ValueError) as e:
+        logerr(f"cs_util.py -> Could not scan {log_path} for errors: {e}")
+        return []
+
+
+def _keyword_line_starts(block):
+    lowered, line_starts = block.lower(), set()
+    for keyword in ERROR_SNIPPET_KEYWORDS:
+        at = lowered.find(keyword)
+        while at != -1:
+            line_starts.add(lowered.rfind(b"\n", 0, at) + 1)
+            line_end = lowered.find(b"\n", at)
+            at = -1 if line_end == -1 else lowered.find(keyword, line_end)
+    return line_starts
+
+
+def _extract_error_lines(mm, size, max_lines, context_lines, max_scan_bytes, block_size, stop_marker):
+    floor = max(0, size - max_scan_bytes)
+    candidates, end, newlines_after = [], size, 0
+    # Treat a trailing newline as the end of the last line, not as an empty line after it
+    if mm[size - 1:size] == b"\n":
+        end -= 1
+    while end > floor and len(candidates) < max_lines * 4:
+        start = max(floor, end - block_size)
+        block = mm[start:end]
+        if start > floor:
+            # Leave the partial first line for the next block
+            cut = block.find(b"\n")
+            if cut == -1:
+                end = start
+                continue
+            start, block = start + cut + 1, block[cut + 1:]
+        marker_at = block.rfind(stop_marker) if stop_marker else -1
+        if marker_at != -1:
+            line_start = block.rfind(b"\n", 0, marker_at) + 1
+            start, block, floor = start + line_start, block[line_start:], start + line_start
+        for line_start in sorted(_keyword_line_starts(block), reverse=True):
+            line_end = block.find(b"\n", line_start)
+            line_end = len(block) if line_end == -1 else line_end
+            line = block[line_start:line_end].decode('utf-8', errors='replace').rstrip("\r")
+            weight = _error_line_weight(line)
+            if weight:
+                candidates.append({'offset': start + line_start, 'from_end': newlines_after + block.count(b"\n", line_end),
+                                   'line': line[:4096], 'weight': weight})
+        newlines_after += block.count(b"\n") + (1 if start > floor else 0)
+        end = start - 1 if start > floor else floor
+
+    reached_start = floor == 0 and end <= 0
+    total_lines = newlines_after + 1 if reached_start else None
+    best = sorted(candidates, key=lambda c: (-c['weight'], c['from_end']))[:max_lines]
+    results = []
+    for candidate in sorted(best, key=lambda c: c['offset']):
+        before, after = _context_lines(mm, size, candidate['offset'], context_lines)
+        family = next((name for name, (pattern, _) in ERROR_SNIPPET_PATTERNS.items() if pattern.search(candidate['line'])), 'generic')
+        results.append({'line_no': total_lines - candidate['from_end'] if total_lines else None, 'from_end': candidate['from_end'],
+                        'line': candidate['line'], 'family': family, 'before': before, 'after': after})
+    return results
+
+
+def _context_lines(mm, size, offset, count):
+    before, pos = [], offset
+    for _ in range(count):
+        if pos <= 0:
+            break
+        prev = mm.rfind(b"\n", 0, pos - 1) + 1
+        before.insert(0, mm[prev:pos - 1].decode('utf-8', errors='replace').rstrip("\r")[:4096])
+        pos = prev
+    after, pos = [], mm.find(b"\n", offset)
+    for _ in range(count):
+        if pos == -1 or pos + 1 >= size:
+            break
+        nxt = mm.find(b"\n", pos + 1)
+        after.append(mm[pos + 1:nxt if nxt != -1 else size].decode('utf-8', errors='replace').rstrip("\r")[:4096])
+        pos = nxt
+    return before, after
+
+
+def format_error_lines(error_lines, max_chars=4000):
+    """
+    INPUT: error_lines (list of dict) from extract_error_lines(), max_chars (int, optional)
+
+    OUTPUT: text (str) with each error line and its context, or "" if there are none
+    """
+    blocks = []
+    for error in error_lines:
+        where = f"line {error['line_no']}" if error['line_no'] else f"{error['from_end']} line(s) from the end"
+        blocks.append("\n".join([f"[{where}, {error['family']}]", *(f"  {l}" for l in error['before']),
+                                  f"> {error['line']}", *(f"  {l}" for l in error['after'])]))
+    text = "\n\n".join(blocks)
+    return text if len(text) <= max_chars else "...\n" + text[-max_chars:]
+
+
 def publish_to_runjob(publish_cmd):
     """
     INPUT: publish_cmd (str), which is any command such as 'publish RESQ-195'
@@ -179,19 +1172,166 @@ def publish_to_runjob(publish_cmd):
     
     OUTPUT: the runjob command corresponding to the input, or None if no CFG was found
     """
+    return publish_to_runjobs([publish_cmd])[publish_cmd]
+
+
+def publish_to_runjobs(publish_cmds):
+    """
+    INPUT: publish_cmds (iterable of str), batch form of publish_to_runjob()
+           - CFG names are checked against one cached listing of the publish directory (_logfile_index),
+             re-read only when the directory's mtime changes, instead of two os.path.exists() calls each
+
+    OUTPUT: dict of publish_cmd -> runjob command, or None if no CFG was found
+    """
     dir_name = f"{'/NAS/mis/jobs' if env.current_user_is_production() else os.getenv('WORKING_JOBS_DIR')}/all/publish/scpt"
-    pub_name, pub_id = publish_cmd.split()[1].lower().split('-')
-    # Option 1: with hyphen
-    possible_cfg = f"{dir_name}/{pub_name}-{pub_id}_publish.cfg"
-    if os.path.exists(possible_cfg):
-        return f"runjob all_publish {pub_name}-{pub_id}_publish"
-    
-    # Option 2: without hyphen
-    possible_cfg = ''.join(possible_cfg.split('-'))
-    if os.path.exists(possible_cfg):
-        return f"runjob all_publish {pub_name}{pub_id}_publish"
-    # If neither was found, return None
-    return
+    results = {}
+    for publish_cmd in publish_cmds:
+        pub_name, pub_id = publish_cmd.split()[1].lower().split('-')
+        # Option 1: with hyphen
+        possible_cfg = f"{dir_name}/{pub_name}-{pub_id}_publish.cfg"
+        if _logfile_index.has_file(*os.path.split(possible_cfg)):
+            results[publish_cmd] = f"runjob all_publish {pub_name}-{pub_id}_publish"
+            continue
+
+        # Option 2: without hyphen
+        possible_cfg = ''.join(possible_cfg.split('-'))
+        if _logfile_index.has_file(*os.path.split(possible_cfg)):
+            results[publish_cmd] = f"runjob all_publish {pub_name}{pub_id}_publish"
+            continue
+        # If neither was found, return None
+        results[publish_cmd] = None
+    return results
+
+
+class LogfileIndex:
+    """
+    In-process index of log directories, built with os.scandir() and refreshed per directory only when the
+    directory's mtime changes (i.e. a logfile was added, renamed or removed). Rewriting a logfile does not change
+    the directory's mtime, so newest() re-stats its few candidates rather than trusting the listed mtimes
+    """
+    def __init__(self) -> None:
+        self.dirs = {}   # path -> {'mtime_ns', 'names' (sorted), 'files' (name -> mtime_ns), 'subdirs' (sorted)}
+
+    def __scan(self, path):
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self.dirs.pop(path, None)
+            return None
+        cached = self.dirs.get(path)
+        if cached and cached['mtime_ns'] == mtime_ns:
+            return cached
+        files, subdirs = {}, []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        subdirs.append(entry.name)
+                    elif entry.is_file():
+                        files[entry.name] = entry.stat().st_mtime_ns
+                except OSError:
+                    continue
+        cached = {'mtime_ns': mtime_ns, 'names': sorted(files), 'files': files, 'subdirs': sorted(subdirs)}
+        self.dirs[path] = cached
+        return cached
+
+    def newest(self, dir_path, prefix):
+        """
+        INPUT: dir_path (str), prefix (str)
+
+        OUTPUT: f"{dir_path}/{name}" for the newest file whose name starts with prefix (same pick as
+                'ls -ltr dir/prefix* | tail -1'), or None
+        """
+        cached = self.__scan(dir_path)
+        if not cached:
+            return None
+        names, best, best_mtime_ns = cached['names'], None, None
+        for name in itertools.takewhile(lambda n: n.startswith(prefix), names[bisect.bisect_left(names, prefix):]):
+            try:
+                mtime_ns = cached['files'][name] = os.stat(f"{dir_path}/{name}").st_mtime_ns
+            except FileNotFoundError:
+                continue
+            # ls -t breaks mtime ties by name, and -r reverses both, so the last line is the lowest name
+            if best is None or mtime_ns > best_mtime_ns:
+                best, best_mtime_ns = name, mtime_ns
+        return f"{dir_path}/{best}" if best else None
+
+    def has_file(self, dir_path, name):
+        """
+        INPUT: dir_path (str), name (str)
+
+        OUTPUT: True if dir_path holds a file called name (os.path.exists() against the cached listing)
+        """
+        cached = self.__scan(dir_path)
+        return bool(cached) and name in cached['files']
+
+    def find_subdir(self, dir_path, pattern):
+        """
+        INPUT: dir_path (str), pattern (str)
+
+        OUTPUT: first subdirectory name (sorted, as 'ls -d dir/*/ | grep pattern') containing pattern, or None
+        """
+        cached = self.__scan(dir_path)
+        if not cached:
+            return None
+        return next((name for name in cached['subdirs'] if pattern in name), None)
+
+
+_logfile_index = LogfileIndex()
+
+
+def _resolve_runjob_logfile(runjob_cmd, is_prod):
+    # First, check if runjob_cmd starts with "publish ??". In this case, it needs to be translated to "runjob all_publish ??_publish"
+    if runjob_cmd.startswith('publish'):
+        runjob_cmd = publish_to_runjob(runjob_cmd)
+        if not runjob_cmd:
+            raise Exception("No CFG file matching the provided report number found")
+            
+    # Main code
+    is_srg = (runjob_cmd.split()[1] == "srg")
+    identifier = runjob_cmd.split()[2]
+    base_dir = "/NAS/mis/" if is_prod else "/NAS/mis/tmp/_"
+    base_dir += "srg" if is_srg else "jobs/"
+    
+    # Prod (CS_PROD=P) vs non-prod distinction in logfile name and/or path
+    if is_prod:
+        if is_srg:
+            srg_name = _logfile_index.find_subdir(base_dir, identifier)
+            if srg_name is None:
+                raise Exception(f"No SRG directory matching '{identifier}' found in {base_dir}")
+            # Wrap SRG name in single quotes, as it contains NBSP
+            return f"/NAS/mis/srg/'{srg_name}'/logs/logfile.txt"
+        else:
+            pieces = runjob_cmd.split()[1].split('_')
+            base_dir += f"{pieces[0]}/{pieces[1]}/log"
+    
+    else:
+        if not is_srg:
+            base_dir += runjob_cmd.split()[1]
+    
+    logfile = _logfile_index.newest(base_dir, identifier)
+    if not logfile:
+        logerr(f"cs_util.py -> No logfile matching {base_dir}/{identifier}* found")
+        return ""
+    return logfile
+
+
+def get_runjob_logfiles(runjob_cmds):
+    """
+    INPUT: runjob_cmds (list of str), any runjob/publish commands
+           - Batch form of get_runjob_logfile(); each log directory is scanned at most once
+
+    OUTPUT: dict of runjob_cmd -> logfile path (str), or "<LOGFILE RETRIEVAL ERROR>" on failure
+    """
+    is_prod = env.current_machine_is_production_server()
+    logfiles = {}
+    for runjob_cmd in runjob_cmds:
+        try:
+            logfiles[runjob_cmd] = _resolve_runjob_logfile(runjob_cmd, is_prod)
+        except Exception as err:
+            logerr(f"cs_util.get_runjob_logfile({runjob_cmd}) -> Threw exception:\n{err}")
+            logfiles[runjob_cmd] = "<LOGFILE RETRIEVAL ERROR>"
+    return logfiles
 
 
 def get_runjob_logfile(runjob_cmd):
@@ -200,38 +1340,4 @@ def get_runjob_logfile(runjob_cmd):
     
     OUTPUT: result (str) of the runjob_cmd
     """
-    try:
-        # First, check if runjob_cmd starts with "publish ??". In this case, it needs to be translated to "runjob all_publish ??_publish"
-        if runjob_cmd.startswith('publish'):
-            runjob_cmd = publish_to_runjob(runjob_cmd)
-            if not runjob_cmd:
-                raise Exception("No CFG file matching the provided report number found")
-                
-        # Main code
-        is_srg = (runjob_cmd.split()[1] == "srg")
-        identifier = runjob_cmd.split()[2]
-        is_prod = env.current_machine_is_production_server()
-        base_dir = "/NAS/mis/" if is_prod else "/NAS/mis/tmp/_"
-        base_dir += "srg" if is_srg else "jobs/"
-        
-        # Prod (CS_PROD=P) vs non-prod distinction in logfile name and/or path
-        if is_prod:
-            if is_srg:
-                get_srg_name_command = f"ls -d {base_dir}/*/ | grep {identifier}"
-                srg_name = get_unix_command_output(get_srg_name_command).split('/NAS/mis/srg/')[1][:-1]
-                # Wrap SRG name in single quotes, as it contains NBSP
-                return f"/NAS/mis/srg/'{srg_name}'/logs/logfile.txt"
-            else:
-                pieces = runjob_cmd.split()[1].split('_')
-                base_dir += f"{pieces[0]}/{pieces[1]}/log"
-        
-        else:
-            if not is_srg:
-                base_dir += runjob_cmd.split()[1]
-        
-        logfile_command = f"ls -ltr {base_dir}/{identifier}* | tail -1 " + "| awk '{print $NF}'"
-        return get_unix_command_output(logfile_command)
-    
-    except Exception as err:
-        logerr(f"cs_util.get_runjob_logfile({runjob_cmd}) -> Threw exception:\n{err}")
-        return "<LOGFILE RETRIEVAL ERROR>"
+    return get_runjob_logfiles([runjob_cmd])[runjob_cmd]